@@ -1,5 +1,9 @@
 import sys
 import os
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 from typing import Dict, Any, List
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
@@ -19,10 +23,23 @@ from vnet.common.config.env import load_env
 load_env(dotenv_path=os.path.join(BASE_DIR, ".env"), override=False)
 
 from vnet.common.storage.dal.minio.minio_conn import minio_handler
-from vnet.common.tools.http_utils import multiple_download_async
+from vnet.common.tools.http_utils import download_manager
 
 app = FastAPI(title="Accessibility API", version="1.0.0")
 
+# 同时进行的下载-上传转存数
+RELAY_CONCURRENCY = int(os.getenv("RELAY_CONCURRENCY", "16"))
+UPLOAD_DIR = "accessibility_downloads"
+# 转存的上传在线程中边收边传，单独的线程池保证 RELAY_CONCURRENCY 个转存都能同时进行
+relay_executor = ThreadPoolExecutor(max_workers=RELAY_CONCURRENCY, thread_name_prefix="relay")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await download_manager.close()
+    relay_executor.shutdown(wait=False)
+
+
 class DownloadRequest(BaseModel):
     download_url_jsonpath: List[str]
     data: List[Dict[str, Any]]
@@ -40,31 +57,47 @@ def extract_urls(jsonpaths: List[str], data: dict) -> List[str]:
             logger.error(f"Jsonpath解析失败: {path_str}: {e}")
     return urls
 
-def upload_files(downloaded_files: dict) -> dict:
-    url_map = {}
-    for url, local_path in downloaded_files.items():
-        if not local_path or not os.path.exists(local_path):
-            logger.error(f"下载文件不存在: {url}, 路径: {local_path}")
-            continue
-        try:
-            upload = minio_handler.upload_file(local_path, upload_dir="accessibility_downloads")
-            if upload.get("error"):
-                logger.error(f"上传失败: {local_path}: {upload.get('error_str')}")
-                continue
-            put_path = upload.get("minio_put_path")
-            download_url = minio_handler.generate_download_url(put_path) if put_path else None
-            final_url = download_url or put_path
-            if not final_url:
-                logger.error(f"未生成下载链接: {url}, put_path: {put_path}")
-                continue
-            url_map[url] = final_url
-            logger.info(f"上传成功: {url} -> {final_url}")
-        finally:
+async def relay_url(url: str, proxy) -> str:
+    """
+    下载响应逐块送入 MinIO 分片上传，不写本地文件，返回 MinIO 下载地址。
+    """
+    # 同时转存的文件可能同名，加随机目录避免在同一秒内互相覆盖
+    file_name = f"{uuid.uuid4().hex}/{os.path.basename(urlparse(url).path) or 'downloaded_file'}"
+    async with download_manager.stream(url, proxy) as response:
+        response.raise_for_status()
+        # 响应经过压缩时 aiohttp 会解压，Content-Length 不是实际长度
+        length = None if response.headers.get("Content-Encoding") else response.content_length
+        upload = await minio_handler.upload_data_async(response.content.iter_chunked(1024 * 1024), file_name,
+                                                       upload_dir=UPLOAD_DIR, length=length,
+                                                       content_type=response.headers.get("Content-Type"),
+                                                       executor=relay_executor)
+    if upload.get("error"):
+        raise RuntimeError(f"上传失败: {upload.get('error_str')}")
+    put_path = upload.get("minio_put_path")
+    final_url = (minio_handler.generate_download_url(put_path) if put_path else None) or put_path
+    if not final_url:
+        raise RuntimeError(f"未生成下载链接, put_path: {put_path}")
+    return final_url
+
+async def relay_urls(urls: List[str], proxy=None) -> dict:
+    """
+    并发转存多个 URL（重复的只转存一次），同时进行的转存不超过 RELAY_CONCURRENCY 个，全部结束后返回 {原url: 新url}。
+    """
+    semaphore = asyncio.Semaphore(RELAY_CONCURRENCY)
+
+    async def relay(url):
+        async with semaphore:
             try:
-                os.remove(local_path)
-            except Exception:
-                pass
-    return url_map
+                final_url = await relay_url(url, proxy)
+                logger.info(f"转存成功: {url} -> {final_url}")
+                return final_url
+            except Exception as e:
+                logger.error(f"转存失败: {url}: {e}")
+                return None
+
+    urls = list(dict.fromkeys(urls))
+    results = await asyncio.gather(*(relay(url) for url in urls))
+    return {url: final_url for url, final_url in zip(urls, results) if final_url}
 
 def replace_urls(jsonpaths: List[str], data: dict, url_map: dict) -> int:
     replaced = 0
@@ -95,8 +128,7 @@ async def download_and_upload(request: DownloadRequest):
             {"http": os.getenv("HTTP_PROXY"), "https": os.getenv("HTTPS_PROXY")}
             if os.getenv("HTTP_PROXY") else None
         )
-        downloaded_files = await multiple_download_async(urls, proxy=proxy)
-        url_map = upload_files(downloaded_files)
+        url_map = await relay_urls(urls, proxy=proxy)
         logger.info(f"替换url映射: {url_map}")
         replaced = replace_urls(request.download_url_jsonpath, search_data, url_map)
         logger.info(f"替换了{replaced}个url")
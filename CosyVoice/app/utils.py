@@ -1,5 +1,7 @@
 import os
+import struct
 from urllib.parse import urlparse, unquote
+import numpy as np
 import requests
 # utils 
 def get_filename_from_url(url: str) -> str:
@@ -46,5 +48,46 @@ def download_file(url: str, destination_path: str):
         return False
 
 
+def wav_stream_header(sample_rate: int, num_channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    生成流式 WAV 头部。
+
+    流式输出时音频总长度未知，RIFF 与 data 块的长度字段按惯例填 0xFFFFFFFF，
+    播放器会一直读到连接结束。
+
+    :param sample_rate: 采样率。
+    :param num_channels: 声道数。
+    :param bits_per_sample: 采样位深。
+    :return: 44 字节的 WAV 头部。
+    """
+    block_align = num_channels * bits_per_sample // 8
+    byte_rate = sample_rate * block_align
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 0xFFFFFFFF, b'WAVE',
+                       b'fmt ', 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample,
+                       b'data', 0xFFFFFFFF)
+
+
+def tensor_to_pcm16(speech) -> bytes:
+    """
+    将模型输出的 float 音频张量（取值 [-1, 1]）转换为 16-bit little-endian PCM 字节。
+
+    :param speech: 形如 (1, T) 的音频张量。
+    :return: PCM 字节。
+    """
+    audio = speech.detach().cpu().numpy().flatten()
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
 
 
+def iter_audio_stream(model_output, sample_rate: int, response_format: str = "wav"):
+    """
+    将 inference_*(stream=True) 产出的音频块逐块编码为字节流。
+
+    :param model_output: 模型推理生成器，每项包含 'tts_speech'。
+    :param sample_rate: 模型输出采样率。
+    :param response_format: wav 先输出流式头部再输出 PCM 数据，pcm 只输出裸 PCM 数据。
+    """
+    if response_format != "pcm":
+        yield wav_stream_header(sample_rate)
+    for j in model_output:
+        yield tensor_to_pcm16(j['tts_speech'])
@@ -36,7 +36,7 @@ import ffmpeg
 
 from app.response import error_response,success_response
 from app.schemas import ChatCompletionRequest, TTSCloneRequest, TTSCloneDelRequest, TTSCloneSpkRequest
-from app.utils import get_filename_from_url, download_file
+from app.utils import get_filename_from_url, download_file, iter_audio_stream
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -328,15 +328,23 @@ async def tts1(request: TTSCloneRequest):
     print(voices)
     if voice_id not in voices:
         return error_response(code=400,message=f"音色不存在: {voice_id}")
+
+    # 记录所有提取的参数
+    logger.info(f"Received request with parameters: {request}")
+
+    # 流式输出：模型每生成一个音频块就直接编码发送，不落盘
+    if request.stream and getattr(request, "output", "file") == "file":
+        model_output = cosyvoice.inference_zero_shot(input_text, '', '', zero_shot_spk_id=voice_id, stream=True)
+        media_type = "audio/pcm" if request.response_format == "pcm" else "audio/wav"
+        return StreamingResponse(iter_audio_stream(model_output, cosyvoice.sample_rate, request.response_format),
+                                 media_type=media_type)
+
     ts_int = int(time.time())
     os.makedirs(download_dir, exist_ok=True)
     tmp = tempfile.NamedTemporaryFile(prefix=f"{voice_id}_{ts_int}_", suffix=".wav", dir=download_dir, delete=False)
     WAV_FILE_PATH = tmp.name
     tmp.close()
 
-        # 记录所有提取的参数
-    logger.info(f"Received request with parameters: {request}")
-
     # 收集分段音频并一次性保存，避免覆盖只保留最后一段
     _segments = []
     for _, j in enumerate(cosyvoice.inference_zero_shot(input_text, '', '', zero_shot_spk_id=voice_id, stream=False)):
@@ -352,9 +360,11 @@ async def tts1(request: TTSCloneRequest):
             with open(WAV_FILE_PATH, "rb") as f:
                 while chunk := f.read(1024):  # 逐块读取文件，每次读取 1024 字节
                     yield chunk
+            os.remove(WAV_FILE_PATH)
         return StreamingResponse(iterfile(), media_type="audio/wav")
     elif request.output == "url":
         upload_result = minio_handler.upload_file(file_path=WAV_FILE_PATH)
+        os.remove(WAV_FILE_PATH)
         if upload_result.get("error"):
             err = upload_result.get("error_str", "upload error")
             logger.error(f"MinIO 上传失败: {err}")
@@ -375,6 +385,7 @@ async def tts1(request: TTSCloneRequest):
         with open(WAV_FILE_PATH, "rb") as f:
             while chunk := f.read(1024):
                 yield chunk
+        os.remove(WAV_FILE_PATH)
     return StreamingResponse(iterfile(), media_type="audio/wav")
 
 
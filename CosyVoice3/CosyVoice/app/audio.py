@@ -0,0 +1,194 @@
+import io
+import math
+import torch
+import soundfile as sf
+from cosyvoice.utils.file_utils import get_resampler
+from app.utils import wav_stream_header, tensor_to_pcm16
+
+# response_format -> (soundfile format, subtype)，pcm 为裸 16-bit PCM
+AUDIO_FORMATS = {
+    "wav": ("WAV", "PCM_16"),
+    "mp3": ("MP3", "MPEG_LAYER_III"),
+    "opus": ("OGG", "OPUS"),
+    "pcm": None,
+}
+
+MEDIA_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "pcm": "audio/pcm",
+}
+
+# Opus 只支持以下采样率
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# libsndfile 的 SFC_SET_OGG_PAGE_LATENCY_MS（soundfile 未导出），默认约 1 秒音频才输出一个 Ogg 页
+SFC_SET_OGG_PAGE_LATENCY_MS = 0x1302
+OGG_PAGE_LATENCY_MS = 100
+
+
+def check_audio_format(response_format: str, sample_rate: int):
+    """
+    检查输出格式与采样率是否可编码。
+
+    :return: 错误信息，可编码时返回 None。
+    """
+    if response_format not in AUDIO_FORMATS:
+        return f"不支持的 response_format: {response_format}，可选 {list(AUDIO_FORMATS)}"
+    if response_format == "opus" and sample_rate not in OPUS_SAMPLE_RATES:
+        return f"opus 不支持采样率 {sample_rate}，可选 {list(OPUS_SAMPLE_RATES)}"
+    return None
+
+
+class StreamResampler:
+    """
+    分块重采样：复用按 (orig_sr, target_sr) 缓存的 sinc 核，逐块输入时输出与整段重采样逐点一致。
+
+    每次只输出已具备完整右侧上下文的样本，末尾由 flush 补零输出，与整段重采样的边界处理相同。
+    """
+
+    def __init__(self, orig_sr: int, target_sr: int):
+        self.resampler = None if orig_sr == target_sr else get_resampler(orig_sr, target_sr)
+        if self.resampler is not None:
+            gcd = math.gcd(orig_sr, target_sr)
+            self.orig, self.new = orig_sr // gcd, target_sr // gcd
+            # 输出第 i 组依赖输入 [i * orig - width, (i + 1) * orig + width)，上下文取 orig 的整数倍
+            self.context = math.ceil((self.resampler.width + self.orig) / self.orig) * self.orig
+        self.buffer = torch.zeros(1, 0)
+        # buffer[0] 对应的输入位置，以及已输出到的输入位置（orig 的整数倍）
+        self.buffer_start, self.done = 0, 0
+
+    def process(self, speech: torch.Tensor, final: bool = False) -> torch.Tensor:
+        speech = speech.detach().float().cpu().reshape(1, -1)
+        if self.resampler is None:
+            return speech
+        self.buffer = torch.concat([self.buffer, speech], dim=1)
+        end = self.buffer_start + self.buffer.shape[1]
+        emit_end = end if final else (end - self.context) // self.orig * self.orig
+        if emit_end <= self.done:
+            return torch.zeros(1, 0)
+        start = max(0, self.done - self.context)
+        segment = self.buffer[:, start - self.buffer_start: end - self.buffer_start if final else emit_end + self.context - self.buffer_start]
+        output = self.resampler(segment)
+        first = (self.done - start) // self.orig * self.new
+        output = output[:, first:] if final else output[:, first: first + (emit_end - self.done) // self.orig * self.new]
+        self.done = emit_end
+        keep = max(0, self.done - self.context)
+        self.buffer, self.buffer_start = self.buffer[:, keep - self.buffer_start:], keep
+        return output
+
+    def flush(self) -> torch.Tensor:
+        return self.process(torch.zeros(1, 0), final=True)
+
+
+class _StreamSink:
+    """
+    供 soundfile 写入的只追加缓冲：编码器关闭时回写文件头（如 MP3 的 Xing 帧）的数据已发送，直接丢弃。
+    """
+
+    def __init__(self):
+        self.chunks, self.position, self.end = [], 0, 0
+
+    def write(self, data):
+        if self.position == self.end:
+            self.chunks.append(bytes(data))
+            self.end += len(data)
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.end}[whence] + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        return b""
+
+    def pop(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class AudioEncoder:
+    """
+    增量音频编码：每个模型音频块重采样到目标采样率后立即编码，返回可以直接发送的字节。
+
+    wav 输出流式头部 + PCM，pcm 输出裸 PCM，mp3/opus 由 libsndfile 逐帧编码。
+    """
+
+    def __init__(self, response_format: str, sample_rate: int, target_sample_rate: int = None):
+        self.response_format = response_format
+        self.target_sample_rate = target_sample_rate or sample_rate
+        self.resampler = StreamResampler(sample_rate, self.target_sample_rate)
+        self.header_sent = False
+        self.sink, self.file = None, None
+        if response_format in ("mp3", "opus"):
+            audio_format, subtype = AUDIO_FORMATS[response_format]
+            self.sink = _StreamSink()
+            self.file = sf.SoundFile(self.sink, mode="w", samplerate=self.target_sample_rate, channels=1,
+                                     format=audio_format, subtype=subtype)
+        if response_format == "opus":
+            # 缩短 Ogg 页延迟，模型每个音频块编码后即可输出完整的页，首块音频不必等待下一块
+            latency = sf._ffi.new("double*", OGG_PAGE_LATENCY_MS)
+            sf._snd.sf_command(self.file._file, SFC_SET_OGG_PAGE_LATENCY_MS, latency, sf._ffi.sizeof(latency))
+
+    def _encode(self, speech: torch.Tensor) -> bytes:
+        if self.file is not None:
+            if speech.shape[1] > 0:
+                self.file.write(speech.numpy().reshape(-1))
+            return self.sink.pop()
+        data = tensor_to_pcm16(speech)
+        if self.response_format == "wav" and not self.header_sent:
+            self.header_sent = True
+            data = wav_stream_header(self.target_sample_rate) + data
+        return data
+
+    def encode(self, speech: torch.Tensor) -> bytes:
+        return self._encode(self.resampler.process(speech))
+
+    def flush(self) -> bytes:
+        data = self._encode(self.resampler.flush())
+        if self.file is not None:
+            self.file.close()
+            data += self.sink.pop()
+        return data
+
+
+def encode_audio(speech: torch.Tensor, sample_rate: int, response_format: str = "wav", target_sample_rate: int = None) -> bytes:
+    """
+    将整段模型音频编码到内存，不落盘。wav 带完整长度的文件头，mp3 带 Xing 帧。
+
+    :param speech: 形如 (1, T) 的 float 音频张量。
+    :param sample_rate: 模型输出采样率。
+    :param target_sample_rate: 输出采样率，为空时与模型一致。
+    """
+    target_sample_rate = target_sample_rate or sample_rate
+    speech = StreamResampler(sample_rate, target_sample_rate).process(speech, final=True)
+    if response_format == "pcm":
+        return tensor_to_pcm16(speech)
+    audio_format, subtype = AUDIO_FORMATS[response_format]
+    buffer = io.BytesIO()
+    sf.write(buffer, speech.numpy().reshape(-1), target_sample_rate, format=audio_format, subtype=subtype)
+    return buffer.getvalue()
+
+
+def iter_audio_stream(model_output, sample_rate: int, response_format: str = "wav", target_sample_rate: int = None):
+    """
+    将 inference_*(stream=True) 产出的音频块逐块编码为字节流。
+
+    :param model_output: 模型推理生成器，每项包含 'tts_speech'。
+    :param sample_rate: 模型输出采样率。
+    :param response_format: wav/pcm/mp3/opus。
+    :param target_sample_rate: 输出采样率，为空时与模型一致。
+    """
+    encoder = AudioEncoder(response_format, sample_rate, target_sample_rate)
+    for j in model_output:
+        data = encoder.encode(j['tts_speech'])
+        if data:
+            yield data
+    data = encoder.flush()
+    if data:
+        yield data
@@ -0,0 +1,134 @@
+import asyncio
+import math
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_STREAM_END = object()
+
+
+class InferenceBusyError(Exception):
+    """等待队列已满，请求被拒绝。"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    模型推理执行器。
+
+    使用固定数量的推理槽位（线程）执行阻塞的模型调用，避免阻塞 uvicorn 事件循环；
+    超出槽位的请求进入有界等待队列，队列满时直接拒绝（InferenceBusyError），
+    由接口层返回 503 + Retry-After。
+    """
+
+    def __init__(self, num_slots: int = 1, max_queue: int = 16):
+        assert num_slots >= 1, 'num_slots should be greater than 0'
+        self.num_slots = num_slots
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=num_slots, thread_name_prefix='inference')
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_time_total = 0.0
+        self._last_wait_time = 0.0
+        self._avg_service_time = None
+
+    def _retry_after(self) -> int:
+        service_time = self._avg_service_time or 1.0
+        return max(1, math.ceil(service_time * (self._waiting + 1) / self.num_slots))
+
+    def _admit(self, fn, args, kwargs):
+        """准入检查，通过后返回可提交到线程池的任务。"""
+        with self._lock:
+            if self._running + self._waiting >= self.num_slots + self.max_queue:
+                self._rejected += 1
+                raise InferenceBusyError(self._retry_after())
+            self._waiting += 1
+        enqueue_time = time.time()
+
+        def job():
+            start_time = time.time()
+            with self._lock:
+                self._waiting -= 1
+                self._running += 1
+                self._last_wait_time = start_time - enqueue_time
+                self._wait_time_total += self._last_wait_time
+            logger.info(f"inference job start, wait {start_time - enqueue_time:.3f}s, waiting {self._waiting}")
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                service_time = time.time() - start_time
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    if self._avg_service_time is None:
+                        self._avg_service_time = service_time
+                    else:
+                        self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+        return job
+
+    async def run(self, fn, *args, **kwargs):
+        """在推理槽位中执行 fn，返回其结果。"""
+        job = self._admit(fn, args, kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, job)
+
+    def stream(self, gen_fn, *args, **kwargs):
+        """
+        在推理槽位中迭代 gen_fn(*args, **kwargs) 产出的生成器，返回异步生成器。
+
+        准入检查在调用时立即进行，因此可以在返回 StreamingResponse 之前捕获 InferenceBusyError。
+        客户端断开后，推理线程在产出下一项时停止。
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for item in gen_fn(*args, **kwargs):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (None, e))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, (_STREAM_END, None))
+
+        job = self._admit(produce, (), {})
+        loop.run_in_executor(self._pool, job)
+
+        async def consume():
+            try:
+                while True:
+                    item, error = await queue.get()
+                    if error is not None:
+                        raise error
+                    if item is _STREAM_END:
+                        break
+                    yield item
+            finally:
+                cancelled.set()
+        return consume()
+
+    def stats(self) -> dict:
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "num_slots": self.num_slots,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "waiting": self._waiting,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "last_wait_time": round(self._last_wait_time, 3),
+                "avg_wait_time": round(self._wait_time_total / started, 3) if started else 0.0,
+                "avg_service_time": round(self._avg_service_time or 0.0, 3),
+            }
@@ -48,3 +48,18 @@ def base_response(code: int,message: Optional[Any] = None, data: Optional[Any] =
             "data": data
         }
     )
+
+
+def busy_response(retry_after: int, message: Optional[str] = None, data: Optional[Any] = None) -> dict:
+    if message is None:
+        message = error_code_dict[503]
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(retry_after)},
+        content={
+            "err_code": 1,
+            "code": 503,
+            "message": message,
+            "data": data
+        }
+    )
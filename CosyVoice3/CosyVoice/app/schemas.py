@@ -3,7 +3,9 @@ from pydantic import BaseModel, validator
 # 请求参数模型
 # 定义采样率枚举
 class SampleRateEnum(Enum):
+    RATE_48000 = 48000
     RATE_32000 = 32000
+    RATE_24000 = 24000
     RATE_16000 = 16000
 
 class ChatCompletionRequest(BaseModel):
@@ -46,10 +48,12 @@ class TTSInstructRequest(BaseModel):
     instruct_text: str = "You are a helpful assistant.<|endofprompt|>"  # 指令文本
     prompt_file: str = ""  # prompt 音频文件URL
     response_format: str = "wav"
+    sample_rate: SampleRateEnum = SampleRateEnum.RATE_24000  # 默认与模型输出一致
     output: str = "file"
 
 class TTSCrossLingualRequest(BaseModel):
     input: str = ""  # 输入文本
     prompt_file: str = ""  # prompt 音频文件URL
     response_format: str = "wav"
+    sample_rate: SampleRateEnum = SampleRateEnum.RATE_24000  # 默认与模型输出一致
     output: str = "file"
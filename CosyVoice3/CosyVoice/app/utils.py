@@ -1,5 +1,7 @@
 import os
+import struct
 from urllib.parse import urlparse, unquote
+import numpy as np
 import requests
 # utils 
 def get_filename_from_url(url: str) -> str:
@@ -44,3 +46,52 @@ def download_file(url: str, destination_path: str):
     except Exception as e:
         print(f"Error downloading file: {str(e)}")
         return False
+
+
+def download_bytes(url: str):
+    """
+    从给定的 URL 下载文件到内存，不落盘。
+
+    :param url: 下载链接的 URL。
+    :return: 文件内容 bytes，失败时返回 None。
+    """
+    try:
+        response = requests.get(url)
+        if response.status_code == 200:
+            return response.content
+        print(f"Failed to download file, status code: {response.status_code}")
+        return None
+    except Exception as e:
+        print(f"Error downloading file: {str(e)}")
+        return None
+
+
+def wav_stream_header(sample_rate: int, num_channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    生成流式 WAV 头部。
+
+    流式输出时音频总长度未知，RIFF 与 data 块的长度字段按惯例填 0xFFFFFFFF，
+    播放器会一直读到连接结束。
+
+    :param sample_rate: 采样率。
+    :param num_channels: 声道数。
+    :param bits_per_sample: 采样位深。
+    :return: 44 字节的 WAV 头部。
+    """
+    block_align = num_channels * bits_per_sample // 8
+    byte_rate = sample_rate * block_align
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 0xFFFFFFFF, b'WAVE',
+                       b'fmt ', 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample,
+                       b'data', 0xFFFFFFFF)
+
+
+def tensor_to_pcm16(speech) -> bytes:
+    """
+    将模型输出的 float 音频张量（取值 [-1, 1]）转换为 16-bit little-endian PCM 字节。
+
+    :param speech: 形如 (1, T) 的音频张量。
+    :return: PCM 字节。
+    """
+    audio = speech.detach().cpu().numpy().flatten()
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
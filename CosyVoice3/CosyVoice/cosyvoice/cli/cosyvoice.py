@@ -14,6 +14,9 @@
 import os
 import sys
 import time
+import queue
+import threading
+from collections import deque
 from typing import Generator
 from tqdm import tqdm
 from hyperpyyaml import load_hyperpyyaml
@@ -23,6 +26,7 @@ from cosyvoice.cli.frontend import CosyVoiceFrontEnd
 from cosyvoice.cli.model import CosyVoiceModel, CosyVoice2Model, CosyVoice3Model
 from cosyvoice.utils.file_utils import logging
 from cosyvoice.utils.class_utils import get_model_type
+from cosyvoice.utils.spk_store import SpeakerStore
 
 # Add Matcha-TTS to Python path for hyperpyyaml to find matcha module
 _BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -32,6 +36,8 @@ if os.path.exists(_MATCHA_TTS_PATH) and _MATCHA_TTS_PATH not in sys.path:
 
 
 class CosyVoice:
+    # max buffered outputs of every prefetched segment in synthesis(pipeline > 0)
+    pipeline_queue_size = 2
 
     def __init__(self, model_dir, load_jit=False, load_trt=False, fp16=False, trt_concurrent=1):
         self.model_dir = model_dir
@@ -81,59 +87,111 @@ class CosyVoice:
         self.frontend.spk2info[zero_shot_spk_id] = model_input
         return True
 
+    def delete_spk(self, spk_id):
+        del self.frontend.spk2info[spk_id]
+        return True
+
     def save_spkinfo(self):
-        torch.save(self.frontend.spk2info, '{}/spk2info.pt'.format(self.model_dir))
+        # NOTE the speaker store writes every add/delete itself, only make sure they reached the disk;
+        # without a spk2info file the frontend keeps speakers in a plain dict and there is nothing to save
+        if isinstance(self.frontend.spk2info, SpeakerStore):
+            self.frontend.spk2info.flush()
 
-    def inference_sft(self, tts_text, spk_id, stream=False, speed=1.0, text_frontend=True):
-        for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
-            model_input = self.frontend.frontend_sft(i, spk_id)
-            start_time = time.time()
-            logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
-                speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
-                logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
-                yield model_output
+    def synthesis(self, segments, frontend_fn, stream=False, speed=1.0, pipeline=0):
+        """Run frontend_fn and model.tts of every text segment, yield the outputs in segment order.
+
+        pipeline > 0 runs the frontend and model.tts of up to `pipeline` following segments in background threads, so
+        the llm of segment i + 1 decodes while segment i is in token2wav. Every prefetched segment buffers at most
+        pipeline_queue_size outputs before its token2wav blocks, which bounds the memory of long text.
+        """
+        if pipeline <= 0:
+            for i in segments:
+                model_input = frontend_fn(i)
+                start_time = time.time()
+                logging.info('synthesis text {}'.format(i))
+                for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+                    speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
+                    logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
+                    yield model_output
+                    start_time = time.time()
+            return
+
+        segments, running, cancel = iter(segments), deque(), threading.Event()
+
+        def put(output_queue, item):
+            while not cancel.is_set():
+                try:
+                    output_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(i, output_queue):
+            try:
+                model_input = frontend_fn(i)
+                logging.info('synthesis text {}'.format(i))
+                for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
+                    if not put(output_queue, model_output):
+                        return
+            except Exception as e:
+                put(output_queue, e)
+            put(output_queue, None)
+
+        def start_next():
+            i = next(segments, None)
+            if i is not None:
+                output_queue = queue.Queue(maxsize=self.pipeline_queue_size)
+                threading.Thread(target=produce, args=(i, output_queue), daemon=True).start()
+                running.append(output_queue)
+
+        try:
+            for _ in range(pipeline + 1):
+                start_next()
+            while len(running) != 0:
                 start_time = time.time()
+                while True:
+                    model_output = running[0].get()
+                    if model_output is None:
+                        break
+                    if isinstance(model_output, Exception):
+                        raise model_output
+                    speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
+                    logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
+                    yield model_output
+                    start_time = time.time()
+                running.popleft()
+                start_next()
+        finally:
+            # stop the prefetched segments if the caller stops early
+            cancel.set()
 
-    def inference_zero_shot(self, tts_text, prompt_text, prompt_wav, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True):
+    def inference_sft(self, tts_text, spk_id, stream=False, speed=1.0, text_frontend=True, pipeline=0):
+        yield from self.synthesis(tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)),
+                                  lambda i: self.frontend.frontend_sft(i, spk_id), stream=stream, speed=speed, pipeline=pipeline)
+
+    def inference_zero_shot(self, tts_text, prompt_text, prompt_wav, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, pipeline=0):
         if self.__class__.__name__ == 'CosyVoice3' and '<|endofprompt|>' not in prompt_text + tts_text:
             logging.warning('<|endofprompt|> not found in CosyVoice3 inference, check your input text')
         prompt_text = self.frontend.text_normalize(prompt_text, split=False, text_frontend=text_frontend)
-        for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
+
+        def frontend_fn(i):
             if (not isinstance(i, Generator)) and len(i) < 0.5 * len(prompt_text):
                 logging.warning('synthesis text {} too short than prompt text {}, this may lead to bad performance'.format(i, prompt_text))
-            model_input = self.frontend.frontend_zero_shot(i, prompt_text, prompt_wav, self.sample_rate, zero_shot_spk_id)
-            start_time = time.time()
-            logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
-                speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
-                logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
-                yield model_output
-                start_time = time.time()
+            return self.frontend.frontend_zero_shot(i, prompt_text, prompt_wav, self.sample_rate, zero_shot_spk_id)
+        yield from self.synthesis(tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)),
+                                  frontend_fn, stream=stream, speed=speed, pipeline=pipeline)
 
-    def inference_cross_lingual(self, tts_text, prompt_wav, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True):
-        for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
-            model_input = self.frontend.frontend_cross_lingual(i, prompt_wav, self.sample_rate, zero_shot_spk_id)
-            start_time = time.time()
-            logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
-                speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
-                logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
-                yield model_output
-                start_time = time.time()
+    def inference_cross_lingual(self, tts_text, prompt_wav, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, pipeline=0):
+        yield from self.synthesis(tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)),
+                                  lambda i: self.frontend.frontend_cross_lingual(i, prompt_wav, self.sample_rate, zero_shot_spk_id),
+                                  stream=stream, speed=speed, pipeline=pipeline)
 
-    def inference_instruct(self, tts_text, spk_id, instruct_text, stream=False, speed=1.0, text_frontend=True):
+    def inference_instruct(self, tts_text, spk_id, instruct_text, stream=False, speed=1.0, text_frontend=True, pipeline=0):
         assert self.__class__.__name__ == 'CosyVoice', 'inference_instruct is only implemented for CosyVoice!'
         instruct_text = self.frontend.text_normalize(instruct_text, split=False, text_frontend=text_frontend)
-        for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
-            model_input = self.frontend.frontend_instruct(i, spk_id, instruct_text)
-            start_time = time.time()
-            logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
-                speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
-                logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
-                yield model_output
-                start_time = time.time()
+        yield from self.synthesis(tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)),
+                                  lambda i: self.frontend.frontend_instruct(i, spk_id, instruct_text), stream=stream, speed=speed, pipeline=pipeline)
 
     def inference_vc(self, source_wav, prompt_wav, stream=False, speed=1.0):
         model_input = self.frontend.frontend_vc(source_wav, prompt_wav, self.sample_rate)
@@ -147,7 +205,7 @@ class CosyVoice:
 
 class CosyVoice2(CosyVoice):
 
-    def __init__(self, model_dir, load_jit=False, load_trt=False, load_vllm=False, fp16=False, trt_concurrent=1):
+    def __init__(self, model_dir, load_jit=False, load_trt=False, load_vllm=False, fp16=False, trt_concurrent=1, load_batch_engine=False):
         self.model_dir = model_dir
         self.fp16 = fp16
         if not os.path.exists(model_dir):
@@ -174,6 +232,8 @@ class CosyVoice2(CosyVoice):
                         '{}/hift.pt'.format(model_dir))
         if load_vllm:
             self.model.load_vllm('{}/vllm'.format(model_dir))
+        elif load_batch_engine:
+            self.model.load_batch_engine()
         if load_jit:
             self.model.load_jit('{}/flow.encoder.{}.zip'.format(model_dir, 'fp16' if self.fp16 is True else 'fp32'))
         if load_trt:
@@ -183,21 +243,15 @@ class CosyVoice2(CosyVoice):
                                 self.fp16)
         del configs
 
-    def inference_instruct2(self, tts_text, instruct_text, prompt_wav, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True):
-        for i in tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)):
-            model_input = self.frontend.frontend_instruct2(i, instruct_text, prompt_wav, self.sample_rate, zero_shot_spk_id)
-            start_time = time.time()
-            logging.info('synthesis text {}'.format(i))
-            for model_output in self.model.tts(**model_input, stream=stream, speed=speed):
-                speech_len = model_output['tts_speech'].shape[1] / self.sample_rate
-                logging.info('yield speech len {}, rtf {}'.format(speech_len, (time.time() - start_time) / speech_len))
-                yield model_output
-                start_time = time.time()
+    def inference_instruct2(self, tts_text, instruct_text, prompt_wav, zero_shot_spk_id='', stream=False, speed=1.0, text_frontend=True, pipeline=0):
+        yield from self.synthesis(tqdm(self.frontend.text_normalize(tts_text, split=True, text_frontend=text_frontend)),
+                                  lambda i: self.frontend.frontend_instruct2(i, instruct_text, prompt_wav, self.sample_rate, zero_shot_spk_id),
+                                  stream=stream, speed=speed, pipeline=pipeline)
 
 
 class CosyVoice3(CosyVoice2):
 
-    def __init__(self, model_dir, load_trt=False, load_vllm=False, fp16=False, trt_concurrent=1):
+    def __init__(self, model_dir, load_trt=False, load_vllm=False, fp16=False, trt_concurrent=1, load_batch_engine=False):
         self.model_dir = model_dir
         self.fp16 = fp16
         if not os.path.exists(model_dir):
@@ -224,6 +278,8 @@ class CosyVoice3(CosyVoice2):
                         '{}/hift.pt'.format(model_dir))
         if load_vllm:
             self.model.load_vllm('{}/vllm'.format(model_dir))
+        elif load_batch_engine:
+            self.model.load_batch_engine()
         if load_trt:
             if self.fp16 is True:
                 logging.warning('DiT tensorRT fp16 engine have some performance issue, use at caution!')
@@ -11,8 +11,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from functools import partial
+from functools import lru_cache, partial
 from typing import Generator
+from collections import OrderedDict
 import json
 import onnxruntime
 import torch
@@ -23,11 +24,15 @@ import torchaudio.compliance.kaldi as kaldi
 import os
 import re
 import inflect
-from cosyvoice.utils.file_utils import logging, load_wav
+from cosyvoice.utils.file_utils import logging, decode_wav, load_wav, resample
+from cosyvoice.utils.prompt_cache import PromptFeatureCache
+from cosyvoice.utils.spk_store import SpeakerStore
 from cosyvoice.utils.frontend_utils import contains_chinese, replace_blank, replace_corner_mark, remove_bracket, spell_out_number, split_paragraph, is_only_punctuation
 
 
 class CosyVoiceFrontEnd:
+    # max number of distinct texts whose normalization / tokenization result is kept, 0 disables the cache
+    text_cache_size = 4096
 
     def __init__(self,
                  get_tokenizer: Callable,
@@ -35,7 +40,8 @@ class CosyVoiceFrontEnd:
                  campplus_model: str,
                  speech_tokenizer_model: str,
                  spk2info: str = '',
-                 allowed_special: str = 'all'):
+                 allowed_special: str = 'all',
+                 prompt_cache: PromptFeatureCache = None):
         self.tokenizer = get_tokenizer()
         self.feat_extractor = feat_extractor
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -46,11 +52,21 @@ class CosyVoiceFrontEnd:
         self.speech_tokenizer_session = onnxruntime.InferenceSession(speech_tokenizer_model, sess_options=option,
                                                                      providers=["CUDAExecutionProvider" if torch.cuda.is_available() else
                                                                                 "CPUExecutionProvider"])
-        if os.path.exists(spk2info):
-            self.spk2info = torch.load(spk2info, map_location=self.device, weights_only=True)
+        if spk2info != '':
+            # NOTE speakers are kept in an append-only store next to spk2info.pt (imported on first start) and loaded lazily
+            self.spk2info = SpeakerStore('{}.store'.format(os.path.splitext(spk2info)[0]), self.device, legacy_spk2info=spk2info)
         else:
             self.spk2info = {}
         self.allowed_special = allowed_special
+        # NOTE optional cache of prompt speech token/feat/embedding, see cosyvoice.utils.prompt_cache
+        self.prompt_cache = prompt_cache
+        self.get_tokenizer = get_tokenizer
+        # NOTE optional process pool running text_normalize and tokenization, see load_text_pool
+        self.text_pool = None
+        self.pool_tokens = OrderedDict()
+        self._load_text_frontend()
+
+    def _load_text_frontend(self):
         self.inflect_parser = inflect.engine()
         # NOTE compatible when no text frontend tool is avaliable
         try:
@@ -73,7 +89,14 @@ class CosyVoiceFrontEnd:
             except:
                 self.text_frontend = ''
                 logging.info('no frontend is avaliable')
+        # NOTE the caches are per instance, so their keys are implicitly scoped to self.text_frontend
+        self._encode_cached = lru_cache(maxsize=self.text_cache_size)(self._encode)
+        self._normalize_cached = lru_cache(maxsize=self.text_cache_size)(self._normalize)
 
+    def load_text_pool(self, num_workers):
+        """Run text normalization and tokenization of uncached texts in num_workers processes instead of the calling thread."""
+        from cosyvoice.cli.text_frontend_pool import TextFrontendPool
+        self.text_pool = TextFrontendPool(self.get_tokenizer, self.allowed_special, num_workers)
 
     def _extract_text_token(self, text):
         if isinstance(text, Generator):
@@ -81,19 +104,30 @@ class CosyVoiceFrontEnd:
             # NOTE add a dummy text_token_len for compatibility
             return self._extract_text_token_generator(text), torch.tensor([0], dtype=torch.int32).to(self.device)
         else:
-            text_token = self.tokenizer.encode(text, allowed_special=self.allowed_special)
+            text_token = self._encode_cached(text)
             text_token = torch.tensor([text_token], dtype=torch.int32).to(self.device)
             text_token_len = torch.tensor([text_token.shape[1]], dtype=torch.int32).to(self.device)
             return text_token, text_token_len
 
+    def _encode(self, text):
+        text_token = self.pool_tokens.pop(text, None)
+        if text_token is not None:
+            return text_token
+        return tuple(self.tokenizer.encode(text, allowed_special=self.allowed_special))
+
     def _extract_text_token_generator(self, text_generator):
         for text in text_generator:
             text_token, _ = self._extract_text_token(text)
             for i in range(text_token.shape[1]):
                 yield text_token[:, i: i + 1]
 
-    def _extract_speech_token(self, prompt_wav):
-        speech = load_wav(prompt_wav, 16000)
+    def _load_prompt_wav(self, prompt_wav, min_sr=16000):
+        """Decode prompt_wav once and return its 16k and 24k views, see decode_wav for the accepted inputs."""
+        speech, sample_rate = decode_wav(prompt_wav)
+        assert sample_rate >= min_sr, 'wav sample rate {} must be greater than {}'.format(sample_rate, min_sr)
+        return resample(speech, sample_rate, 16000), resample(speech, sample_rate, 24000)
+
+    def _extract_speech_token(self, speech):
         assert speech.shape[1] / 16000 <= 30, 'do not support extract speech token for audio longer than 30s'
         feat = whisper.log_mel_spectrogram(speech, n_mels=128)
         speech_token = self.speech_tokenizer_session.run(None,
@@ -105,8 +139,7 @@ class CosyVoiceFrontEnd:
         speech_token_len = torch.tensor([speech_token.shape[1]], dtype=torch.int32).to(self.device)
         return speech_token, speech_token_len
 
-    def _extract_spk_embedding(self, prompt_wav):
-        speech = load_wav(prompt_wav, 16000)
+    def _extract_spk_embedding(self, speech):
         feat = kaldi.fbank(speech,
                            num_mel_bins=80,
                            dither=0,
@@ -117,13 +150,46 @@ class CosyVoiceFrontEnd:
         embedding = torch.tensor([embedding]).to(self.device)
         return embedding
 
-    def _extract_speech_feat(self, prompt_wav):
-        speech = load_wav(prompt_wav, 24000)
+    def _extract_speech_feat(self, speech):
         speech_feat = self.feat_extractor(speech).squeeze(dim=0).transpose(0, 1).to(self.device)
         speech_feat = speech_feat.unsqueeze(dim=0)
         speech_feat_len = torch.tensor([speech_feat.shape[1]], dtype=torch.int32).to(self.device)
         return speech_feat, speech_feat_len
 
+    def _extract_prompt_text_token(self, prompt_text):
+        if self.prompt_cache is None:
+            return self._extract_text_token(prompt_text)
+        cached = self.prompt_cache.get_text(prompt_text)
+        if cached is None:
+            cached = self._extract_text_token(prompt_text)
+            self.prompt_cache.put_text(prompt_text, cached)
+        return cached
+
+    def _extract_prompt_speech(self, prompt_wav, resample_rate):
+        if isinstance(prompt_wav, dict):
+            # features already extracted, e.g. returned by PromptFeatureCache.get_url_feat
+            return prompt_wav
+        sha1 = self.prompt_cache.audio_hash(prompt_wav) if self.prompt_cache is not None else None
+        if sha1 is not None:
+            cached = self.prompt_cache.get_feat(sha1, resample_rate)
+            if cached is not None:
+                return cached
+        speech_16k, speech_24k = self._load_prompt_wav(prompt_wav)
+        speech_feat, speech_feat_len = self._extract_speech_feat(speech_24k)
+        speech_token, speech_token_len = self._extract_speech_token(speech_16k)
+        if resample_rate == 24000:
+            # cosyvoice2, force speech_feat % speech_token = 2
+            token_len = min(int(speech_feat.shape[1] / 2), speech_token.shape[1])
+            speech_feat, speech_feat_len[:] = speech_feat[:, :2 * token_len], 2 * token_len
+            speech_token, speech_token_len[:] = speech_token[:, :token_len], token_len
+        embedding = self._extract_spk_embedding(speech_16k)
+        prompt_speech = {'speech_token': speech_token, 'speech_token_len': speech_token_len,
+                         'speech_feat': speech_feat, 'speech_feat_len': speech_feat_len,
+                         'embedding': embedding}
+        if sha1 is not None:
+            self.prompt_cache.put_feat(sha1, resample_rate, prompt_speech)
+        return prompt_speech
+
     def text_normalize(self, text, split=True, text_frontend=True):
         if isinstance(text, Generator):
             logging.info('get tts_text generator, will skip text_normalize!')
@@ -133,7 +199,19 @@ class CosyVoiceFrontEnd:
             text_frontend = False
         if text_frontend is False or text == '':
             return [text] if split is True else text
-        text = text.strip()
+        text, texts = self._normalize_cached(text.strip())
+        return list(texts) if split is True else text
+
+    def _normalize(self, text):
+        """Return the normalized text and its split segments, the result is memoized by _normalize_cached."""
+        if self.text_pool is not None:
+            text, texts, tokens = self.text_pool.normalize([text])[0]
+            # keep the token ids computed by the worker until _extract_text_token asks for them
+            for i, token in zip(texts, tokens):
+                self.pool_tokens[i] = token
+            while len(self.pool_tokens) > max(self.text_cache_size, len(texts)):
+                self.pool_tokens.popitem(last=False)
+            return text, texts
         if self.text_frontend == 'ttsfrd':
             texts = [i["text"] for i in json.loads(self.frd.do_voicegen_frd(text))["sentences"]]
             text = ''.join(texts)
@@ -156,8 +234,8 @@ class CosyVoiceFrontEnd:
                 text = spell_out_number(text, self.inflect_parser)
                 texts = list(split_paragraph(text, partial(self.tokenizer.encode, allowed_special=self.allowed_special), "en", token_max_n=80,
                                              token_min_n=60, merge_len=20, comma_split=False))
-        texts = [i for i in texts if not is_only_punctuation(i)]
-        return texts if split is True else text
+        texts = tuple(i for i in texts if not is_only_punctuation(i))
+        return text, texts
 
     def frontend_sft(self, tts_text, spk_id):
         tts_text_token, tts_text_token_len = self._extract_text_token(tts_text)
@@ -168,15 +246,11 @@ class CosyVoiceFrontEnd:
     def frontend_zero_shot(self, tts_text, prompt_text, prompt_wav, resample_rate, zero_shot_spk_id):
         tts_text_token, tts_text_token_len = self._extract_text_token(tts_text)
         if zero_shot_spk_id == '':
-            prompt_text_token, prompt_text_token_len = self._extract_text_token(prompt_text)
-            speech_feat, speech_feat_len = self._extract_speech_feat(prompt_wav)
-            speech_token, speech_token_len = self._extract_speech_token(prompt_wav)
-            if resample_rate == 24000:
-                # cosyvoice2, force speech_feat % speech_token = 2
-                token_len = min(int(speech_feat.shape[1] / 2), speech_token.shape[1])
-                speech_feat, speech_feat_len[:] = speech_feat[:, :2 * token_len], 2 * token_len
-                speech_token, speech_token_len[:] = speech_token[:, :token_len], token_len
-            embedding = self._extract_spk_embedding(prompt_wav)
+            prompt_text_token, prompt_text_token_len = self._extract_prompt_text_token(prompt_text)
+            prompt_speech = self._extract_prompt_speech(prompt_wav, resample_rate)
+            speech_token, speech_token_len = prompt_speech['speech_token'], prompt_speech['speech_token_len']
+            speech_feat, speech_feat_len = prompt_speech['speech_feat'], prompt_speech['speech_feat_len']
+            embedding = prompt_speech['embedding']
             model_input = {'prompt_text': prompt_text_token, 'prompt_text_len': prompt_text_token_len,
                            'llm_prompt_speech_token': speech_token, 'llm_prompt_speech_token_len': speech_token_len,
                            'flow_prompt_speech_token': speech_token, 'flow_prompt_speech_token_len': speech_token_len,
@@ -213,10 +287,11 @@ class CosyVoiceFrontEnd:
         return model_input
 
     def frontend_vc(self, source_speech_16k, prompt_wav, resample_rate):
-        prompt_speech_token, prompt_speech_token_len = self._extract_speech_token(prompt_wav)
-        prompt_speech_feat, prompt_speech_feat_len = self._extract_speech_feat(prompt_wav)
-        embedding = self._extract_spk_embedding(prompt_wav)
-        source_speech_token, source_speech_token_len = self._extract_speech_token(source_speech_16k)
+        prompt_speech_16k, prompt_speech_24k = self._load_prompt_wav(prompt_wav)
+        prompt_speech_token, prompt_speech_token_len = self._extract_speech_token(prompt_speech_16k)
+        prompt_speech_feat, prompt_speech_feat_len = self._extract_speech_feat(prompt_speech_24k)
+        embedding = self._extract_spk_embedding(prompt_speech_16k)
+        source_speech_token, source_speech_token_len = self._extract_speech_token(load_wav(source_speech_16k, 16000))
         model_input = {'source_speech_token': source_speech_token, 'source_speech_token_len': source_speech_token_len,
                        'flow_prompt_speech_token': prompt_speech_token, 'flow_prompt_speech_token_len': prompt_speech_token_len,
                        'prompt_speech_feat': prompt_speech_feat, 'prompt_speech_feat_len': prompt_speech_feat_len,
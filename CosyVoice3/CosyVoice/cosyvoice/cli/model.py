@@ -57,6 +57,8 @@ class CosyVoiceModel:
         # dict used to store session related variable
         self.tts_speech_token_dict = {}
         self.llm_end_dict = {}
+        self.token_cond_dict = {}
+        self.token_wait_dict = {}
         self.mel_overlap_dict = {}
         self.flow_cache_dict = {}
         self.hift_cache_dict = {}
@@ -118,19 +120,48 @@ class CosyVoiceModel:
                                                      prompt_speech_token_len=torch.tensor([llm_prompt_speech_token.shape[1]], dtype=torch.int32).to(self.device),
                                                      embedding=llm_embedding.to(self.device),
                                                      uuid=uuid)  
-            for i in token_generator:
-                if i in self.silent_tokens:
-                    cur_silent_token_num += 1
-                    if cur_silent_token_num > max_silent_token_num:
-                        continue
-                else:
-                    cur_silent_token_num = 0
-                self.tts_speech_token_dict[uuid].append(i)
-        self.llm_end_dict[uuid] = True
+            try:
+                for i in token_generator:
+                    # llm_end is set by tts() when its consumer stopped early, the remaining tokens are not needed
+                    if self.llm_end_dict[uuid] is True:
+                        break
+                    if i in self.silent_tokens:
+                        cur_silent_token_num += 1
+                        if cur_silent_token_num > max_silent_token_num:
+                            continue
+                    else:
+                        cur_silent_token_num = 0
+                    self.append_speech_token(uuid, i)
+            finally:
+                self.set_llm_end(uuid)
 
     def vc_job(self, source_speech_token, uuid):
-        self.tts_speech_token_dict[uuid] = source_speech_token.flatten().tolist()
-        self.llm_end_dict[uuid] = True
+        with self.token_cond_dict[uuid]:
+            self.tts_speech_token_dict[uuid] = source_speech_token.flatten().tolist()
+        self.set_llm_end(uuid)
+
+    def append_speech_token(self, uuid, token):
+        cond = self.token_cond_dict[uuid]
+        with cond:
+            self.tts_speech_token_dict[uuid].append(token)
+            # only wake the consumer when the chunk it is waiting for is complete
+            if len(self.tts_speech_token_dict[uuid]) >= self.token_wait_dict[uuid]:
+                self.token_wait_dict[uuid] = float('inf')
+                cond.notify()
+
+    def set_llm_end(self, uuid):
+        cond = self.token_cond_dict[uuid]
+        with cond:
+            self.llm_end_dict[uuid] = True
+            cond.notify()
+
+    def wait_speech_token(self, uuid, token_len):
+        # block until at least token_len speech tokens are generated or llm job is finished
+        cond = self.token_cond_dict[uuid]
+        with cond:
+            while len(self.tts_speech_token_dict[uuid]) < token_len and self.llm_end_dict[uuid] is False:
+                self.token_wait_dict[uuid] = token_len
+                cond.wait()
 
     def token2wav(self, token, prompt_token, prompt_feat, embedding, uuid, finalize=False, speed=1.0):
         with torch.cuda.amp.autocast(self.fp16):
@@ -181,65 +212,76 @@ class CosyVoiceModel:
         this_uuid = str(uuid.uuid1())
         with self.lock:
             self.tts_speech_token_dict[this_uuid], self.llm_end_dict[this_uuid] = [], False
+            self.token_cond_dict[this_uuid], self.token_wait_dict[this_uuid] = threading.Condition(), float('inf')
             self.hift_cache_dict[this_uuid] = None
             self.mel_overlap_dict[this_uuid] = torch.zeros(1, 80, 0)
             self.flow_cache_dict[this_uuid] = torch.zeros(1, 80, 0, 2)
-        if source_speech_token.shape[1] == 0:
-            p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
-        else:
-            p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
-        p.start()
-        if stream is True:
-            token_hop_len = self.token_min_hop_len
-            while True:
-                time.sleep(0.1)
-                if len(self.tts_speech_token_dict[this_uuid]) >= token_hop_len + self.token_overlap_len:
-                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:token_hop_len + self.token_overlap_len]) \
-                        .unsqueeze(dim=0)
-                    this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                                     prompt_token=flow_prompt_speech_token,
-                                                     prompt_feat=prompt_speech_feat,
-                                                     embedding=flow_embedding,
-                                                     uuid=this_uuid,
-                                                     finalize=False)
-                    yield {'tts_speech': this_tts_speech.cpu()}
-                    with self.lock:
-                        self.tts_speech_token_dict[this_uuid] = self.tts_speech_token_dict[this_uuid][token_hop_len:]
-                    # increase token_hop_len for better speech quality
-                    token_hop_len = min(self.token_max_hop_len, int(token_hop_len * self.stream_scale_factor))
-                if self.llm_end_dict[this_uuid] is True and len(self.tts_speech_token_dict[this_uuid]) < token_hop_len + self.token_overlap_len:
-                    break
-            p.join()
-            # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             uuid=this_uuid,
-                                             finalize=True)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        else:
-            # deal with all tokens
-            p.join()
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             uuid=this_uuid,
-                                             finalize=True,
-                                             speed=speed)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        with self.lock:
-            self.tts_speech_token_dict.pop(this_uuid)
-            self.llm_end_dict.pop(this_uuid)
-            self.mel_overlap_dict.pop(this_uuid)
-            self.hift_cache_dict.pop(this_uuid)
-            self.flow_cache_dict.pop(this_uuid)
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.current_stream().synchronize()
+        p = None
+        try:
+            if source_speech_token.shape[1] == 0:
+                p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
+            else:
+                p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
+            p.start()
+            if stream is True:
+                token_hop_len = self.token_min_hop_len
+                while True:
+                    self.wait_speech_token(this_uuid, token_hop_len + self.token_overlap_len)
+                    if len(self.tts_speech_token_dict[this_uuid]) >= token_hop_len + self.token_overlap_len:
+                        this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:token_hop_len + self.token_overlap_len]) \
+                            .unsqueeze(dim=0)
+                        this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                         prompt_token=flow_prompt_speech_token,
+                                                         prompt_feat=prompt_speech_feat,
+                                                         embedding=flow_embedding,
+                                                         uuid=this_uuid,
+                                                         finalize=False)
+                        yield {'tts_speech': this_tts_speech.cpu()}
+                        with self.token_cond_dict[this_uuid]:
+                            self.tts_speech_token_dict[this_uuid] = self.tts_speech_token_dict[this_uuid][token_hop_len:]
+                        # increase token_hop_len for better speech quality
+                        token_hop_len = min(self.token_max_hop_len, int(token_hop_len * self.stream_scale_factor))
+                    if self.llm_end_dict[this_uuid] is True and len(self.tts_speech_token_dict[this_uuid]) < token_hop_len + self.token_overlap_len:
+                        break
+                p.join()
+                # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
+                this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
+                this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                 prompt_token=flow_prompt_speech_token,
+                                                 prompt_feat=prompt_speech_feat,
+                                                 embedding=flow_embedding,
+                                                 uuid=this_uuid,
+                                                 finalize=True)
+                yield {'tts_speech': this_tts_speech.cpu()}
+            else:
+                # deal with all tokens
+                p.join()
+                this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
+                this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                 prompt_token=flow_prompt_speech_token,
+                                                 prompt_feat=prompt_speech_feat,
+                                                 embedding=flow_embedding,
+                                                 uuid=this_uuid,
+                                                 finalize=True,
+                                                 speed=speed)
+                yield {'tts_speech': this_tts_speech.cpu()}
+        finally:
+            # also reached when the consumer closes the generator early (client disconnected): stop the llm job
+            # before dropping the session state
+            if p is not None and p.is_alive():
+                self.set_llm_end(this_uuid)
+                p.join()
+            with self.lock:
+                self.tts_speech_token_dict.pop(this_uuid)
+                self.llm_end_dict.pop(this_uuid)
+                self.token_cond_dict.pop(this_uuid)
+                self.token_wait_dict.pop(this_uuid)
+                self.mel_overlap_dict.pop(this_uuid)
+                self.hift_cache_dict.pop(this_uuid)
+                self.flow_cache_dict.pop(this_uuid)
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                torch.cuda.current_stream().synchronize()
 
 
 class CosyVoice2Model(CosyVoiceModel):
@@ -262,11 +304,16 @@ class CosyVoice2Model(CosyVoiceModel):
         # speech fade in out
         self.speech_window = np.hamming(2 * self.source_cache_len)
         # rtf and decoding related
+        # flow streaming cache, None keeps all left frames so that stream output equals the non-cached flow inference
+        self.flow_max_cache_len = None
         self.llm_context = torch.cuda.stream(torch.cuda.Stream(self.device)) if torch.cuda.is_available() else nullcontext()
         self.lock = threading.Lock()
         # dict used to store session related variable
         self.tts_speech_token_dict = {}
         self.llm_end_dict = {}
+        self.token_cond_dict = {}
+        self.token_wait_dict = {}
+        self.flow_cache_dict = {}
         self.hift_cache_dict = {}
         self.silent_tokens = []
 
@@ -285,18 +332,35 @@ class CosyVoice2Model(CosyVoiceModel):
         self.llm.lock = threading.Lock()
         del self.llm.llm.model.model.layers
 
+    def load_batch_engine(self, max_batch_size=8, max_seq_len=2048):
+        from cosyvoice.llm.batch_engine import LLMBatchEngine
+        self.llm.batch_engine = LLMBatchEngine(self.llm, max_batch_size=max_batch_size, max_seq_len=max_seq_len, fp16=self.fp16)
+
+    def use_flow_cache(self):
+        return hasattr(self.flow, 'inference_chunk') and isinstance(self.flow.decoder.estimator, torch.nn.Module)
+
+    def flow_inference(self, token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=False, finalize=False):
+        # sessions with flow cache only compute the frames after the cached chunks, see CausalMaskedDiffWithDiT.inference_chunk
+        if self.flow_cache_dict.get(uuid) is not None:
+            tts_mel, self.flow_cache_dict[uuid] = self.flow.inference_chunk(token=token.to(self.device, dtype=torch.int32),
+                                                                            token_offset=token_offset,
+                                                                            cache=self.flow_cache_dict[uuid],
+                                                                            finalize=finalize)
+            return tts_mel
+        tts_mel, _ = self.flow.inference(token=token.to(self.device, dtype=torch.int32),
+                                         token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(self.device),
+                                         prompt_token=prompt_token.to(self.device),
+                                         prompt_token_len=torch.tensor([prompt_token.shape[1]], dtype=torch.int32).to(self.device),
+                                         prompt_feat=prompt_feat.to(self.device),
+                                         prompt_feat_len=torch.tensor([prompt_feat.shape[1]], dtype=torch.int32).to(self.device),
+                                         embedding=embedding.to(self.device),
+                                         streaming=stream,
+                                         finalize=finalize)
+        return tts_mel[:, :, token_offset * self.flow.token_mel_ratio:]
+
     def token2wav(self, token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=False, finalize=False, speed=1.0):
         with torch.cuda.amp.autocast(self.fp16):
-            tts_mel, _ = self.flow.inference(token=token.to(self.device, dtype=torch.int32),
-                                             token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(self.device),
-                                             prompt_token=prompt_token.to(self.device),
-                                             prompt_token_len=torch.tensor([prompt_token.shape[1]], dtype=torch.int32).to(self.device),
-                                             prompt_feat=prompt_feat.to(self.device),
-                                             prompt_feat_len=torch.tensor([prompt_feat.shape[1]], dtype=torch.int32).to(self.device),
-                                             embedding=embedding.to(self.device),
-                                             streaming=stream,
-                                             finalize=finalize)
-        tts_mel = tts_mel[:, :, token_offset * self.flow.token_mel_ratio:]
+            tts_mel = self.flow_inference(token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=stream, finalize=finalize)
         # append hift cache
         if self.hift_cache_dict[uuid] is not None:
             hift_cache_mel, hift_cache_source = self.hift_cache_dict[uuid]['mel'], self.hift_cache_dict[uuid]['source']
@@ -330,63 +394,87 @@ class CosyVoice2Model(CosyVoiceModel):
         this_uuid = str(uuid.uuid1())
         with self.lock:
             self.tts_speech_token_dict[this_uuid], self.llm_end_dict[this_uuid] = [], False
+            self.token_cond_dict[this_uuid], self.token_wait_dict[this_uuid] = threading.Condition(), float('inf')
+            self.flow_cache_dict[this_uuid] = None
             self.hift_cache_dict[this_uuid] = None
-        if source_speech_token.shape[1] == 0:
-            p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
-        else:
-            p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
-        p.start()
-        if stream is True:
-            token_offset = 0
-            prompt_token_pad = int(np.ceil(flow_prompt_speech_token.shape[1] / self.token_hop_len) * self.token_hop_len - flow_prompt_speech_token.shape[1])
-            while True:
-                time.sleep(0.1)
-                this_token_hop_len = self.token_hop_len + prompt_token_pad if token_offset == 0 else self.token_hop_len
-                if len(self.tts_speech_token_dict[this_uuid]) - token_offset >= this_token_hop_len + self.flow.pre_lookahead_len:
-                    this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:token_offset + this_token_hop_len + self.flow.pre_lookahead_len]).unsqueeze(dim=0)
-                    this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                                     prompt_token=flow_prompt_speech_token,
-                                                     prompt_feat=prompt_speech_feat,
-                                                     embedding=flow_embedding,
-                                                     token_offset=token_offset,
-                                                     uuid=this_uuid,
-                                                     stream=stream,
-                                                     finalize=False)
-                    token_offset += this_token_hop_len
-                    yield {'tts_speech': this_tts_speech.cpu()}
-                if self.llm_end_dict[this_uuid] is True and len(self.tts_speech_token_dict[this_uuid]) - token_offset < this_token_hop_len + self.flow.pre_lookahead_len:
-                    break
-            p.join()
-            # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             token_offset=token_offset,
-                                             uuid=this_uuid,
-                                             finalize=True)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        else:
-            # deal with all tokens
-            p.join()
-            this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
-            this_tts_speech = self.token2wav(token=this_tts_speech_token,
-                                             prompt_token=flow_prompt_speech_token,
-                                             prompt_feat=prompt_speech_feat,
-                                             embedding=flow_embedding,
-                                             token_offset=0,
-                                             uuid=this_uuid,
-                                             finalize=True,
-                                             speed=speed)
-            yield {'tts_speech': this_tts_speech.cpu()}
-        with self.lock:
-            self.tts_speech_token_dict.pop(this_uuid)
-            self.llm_end_dict.pop(this_uuid)
-            self.hift_cache_dict.pop(this_uuid)
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            torch.cuda.current_stream().synchronize()
+        p, batched = None, False
+        try:
+            if stream is True and self.use_flow_cache():
+                with torch.cuda.amp.autocast(self.fp16):
+                    self.flow_cache_dict[this_uuid] = self.flow.setup_cache(prompt_token=flow_prompt_speech_token.to(self.device),
+                                                                            prompt_feat=prompt_speech_feat.to(self.device),
+                                                                            embedding=flow_embedding.to(self.device),
+                                                                            max_cache_len=self.flow_max_cache_len)
+                if hasattr(self, 'token2wav_batcher'):
+                    self.token2wav_batcher.add_session()
+                    batched = True
+            if source_speech_token.shape[1] == 0:
+                p = threading.Thread(target=self.llm_job, args=(text, prompt_text, llm_prompt_speech_token, llm_embedding, this_uuid))
+            else:
+                p = threading.Thread(target=self.vc_job, args=(source_speech_token, this_uuid))
+            p.start()
+            if stream is True:
+                token_offset = 0
+                prompt_token_pad = int(np.ceil(flow_prompt_speech_token.shape[1] / self.token_hop_len) * self.token_hop_len - flow_prompt_speech_token.shape[1])
+                while True:
+                    this_token_hop_len = self.token_hop_len + prompt_token_pad if token_offset == 0 else self.token_hop_len
+                    self.wait_speech_token(this_uuid, token_offset + this_token_hop_len + self.flow.pre_lookahead_len)
+                    if len(self.tts_speech_token_dict[this_uuid]) - token_offset >= this_token_hop_len + self.flow.pre_lookahead_len:
+                        this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid][:token_offset + this_token_hop_len + self.flow.pre_lookahead_len]).unsqueeze(dim=0)
+                        this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                         prompt_token=flow_prompt_speech_token,
+                                                         prompt_feat=prompt_speech_feat,
+                                                         embedding=flow_embedding,
+                                                         token_offset=token_offset,
+                                                         uuid=this_uuid,
+                                                         stream=stream,
+                                                         finalize=False)
+                        token_offset += this_token_hop_len
+                        yield {'tts_speech': this_tts_speech.cpu()}
+                    if self.llm_end_dict[this_uuid] is True and len(self.tts_speech_token_dict[this_uuid]) - token_offset < this_token_hop_len + self.flow.pre_lookahead_len:
+                        break
+                p.join()
+                # deal with remain tokens, make sure inference remain token len equals token_hop_len when cache_speech is not None
+                this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
+                this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                 prompt_token=flow_prompt_speech_token,
+                                                 prompt_feat=prompt_speech_feat,
+                                                 embedding=flow_embedding,
+                                                 token_offset=token_offset,
+                                                 uuid=this_uuid,
+                                                 finalize=True)
+                yield {'tts_speech': this_tts_speech.cpu()}
+            else:
+                # deal with all tokens
+                p.join()
+                this_tts_speech_token = torch.tensor(self.tts_speech_token_dict[this_uuid]).unsqueeze(dim=0)
+                this_tts_speech = self.token2wav(token=this_tts_speech_token,
+                                                 prompt_token=flow_prompt_speech_token,
+                                                 prompt_feat=prompt_speech_feat,
+                                                 embedding=flow_embedding,
+                                                 token_offset=0,
+                                                 uuid=this_uuid,
+                                                 finalize=True,
+                                                 speed=speed)
+                yield {'tts_speech': this_tts_speech.cpu()}
+        finally:
+            # also reached when the consumer closes the generator early (client disconnected): stop the llm job
+            # before dropping the session state, so the flow/hift caches it holds on the gpu are freed
+            if p is not None and p.is_alive():
+                self.set_llm_end(this_uuid)
+                p.join()
+            if batched:
+                self.token2wav_batcher.remove_session()
+            with self.lock:
+                self.tts_speech_token_dict.pop(this_uuid)
+                self.llm_end_dict.pop(this_uuid)
+                self.token_cond_dict.pop(this_uuid)
+                self.token_wait_dict.pop(this_uuid)
+                self.flow_cache_dict.pop(this_uuid)
+                self.hift_cache_dict.pop(this_uuid)
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                torch.cuda.current_stream().synchronize()
 
 
 class CosyVoice3Model(CosyVoice2Model):
@@ -404,38 +492,109 @@ class CosyVoice3Model(CosyVoice2Model):
         # NOTE must matching training static_chunk_size
         self.token_hop_len = 25
         # rtf and decoding related
+        # flow streaming cache, None keeps all left frames so that stream output equals the non-cached flow inference
+        self.flow_max_cache_len = None
         self.llm_context = torch.cuda.stream(torch.cuda.Stream(self.device)) if torch.cuda.is_available() else nullcontext()
         self.lock = threading.Lock()
         # dict used to store session related variable
         self.tts_speech_token_dict = {}
         self.llm_end_dict = {}
+        self.token_cond_dict = {}
+        self.token_wait_dict = {}
+        self.flow_cache_dict = {}
         self.hift_cache_dict = {}
         # FSQ silent and breath token
         self.silent_tokens = [1, 2, 28, 29, 55, 248, 494, 2241, 2242, 2322, 2323]
 
+    def load_token2wav_batcher(self, max_batch_size=8, window=0.005):
+        assert self.use_flow_cache(), 'batched token2wav needs the flow chunk cache, which is not supported by trt estimator'
+        self.token2wav_batcher = Token2WavBatcher(self.batch_token2wav, max_batch_size=max_batch_size, window=window)
+
+    def batch_token2wav(self, requests):
+        # one flow solve and one vocoder pass for the streaming chunks of several sessions
+        session_ids, finalizes = [r['uuid'] for r in requests], [r['finalize'] for r in requests]
+        with torch.cuda.amp.autocast(self.fp16):
+            tts_mels, _ = self.flow.inference_chunk_batch(tokens=[r['token'].to(self.device, dtype=torch.int32) for r in requests],
+                                                          token_offsets=[r['token_offset'] for r in requests],
+                                                          caches=[self.flow_cache_dict[session_id] for session_id in session_ids],
+                                                          finalizes=finalizes)
+            tts_speeches, hift_caches = self.hift.inference_chunk_batch(tts_mels, [self.hift_cache_dict[session_id] for session_id in session_ids], finalizes)
+        for session_id, hift_cache in zip(session_ids, hift_caches):
+            self.hift_cache_dict[session_id] = hift_cache
+        return tts_speeches
+
     def token2wav(self, token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=False, finalize=False, speed=1.0):
+        if hasattr(self, 'token2wav_batcher') and self.flow_cache_dict.get(uuid) is not None and speed == 1.0:
+            return self.token2wav_batcher.submit(token=token, token_offset=token_offset, uuid=uuid, finalize=finalize)
         with torch.cuda.amp.autocast(self.fp16):
-            tts_mel, _ = self.flow.inference(token=token.to(self.device, dtype=torch.int32),
-                                             token_len=torch.tensor([token.shape[1]], dtype=torch.int32).to(self.device),
-                                             prompt_token=prompt_token.to(self.device),
-                                             prompt_token_len=torch.tensor([prompt_token.shape[1]], dtype=torch.int32).to(self.device),
-                                             prompt_feat=prompt_feat.to(self.device),
-                                             prompt_feat_len=torch.tensor([prompt_feat.shape[1]], dtype=torch.int32).to(self.device),
-                                             embedding=embedding.to(self.device),
-                                             streaming=stream,
-                                             finalize=finalize)
-            tts_mel = tts_mel[:, :, token_offset * self.flow.token_mel_ratio:]
-            # append mel cache
-            if self.hift_cache_dict[uuid] is not None:
-                hift_cache_mel = self.hift_cache_dict[uuid]['mel']
-                tts_mel = torch.concat([hift_cache_mel, tts_mel], dim=2)
-                self.hift_cache_dict[uuid]['mel'] = tts_mel
-            else:
-                self.hift_cache_dict[uuid] = {'mel': tts_mel, 'speech_offset': 0}
+            tts_mel = self.flow_inference(token, prompt_token, prompt_feat, embedding, token_offset, uuid, stream=stream, finalize=finalize)
             if speed != 1.0:
                 assert token_offset == 0 and finalize is True, 'speed change only support non-stream inference mode'
                 tts_mel = F.interpolate(tts_mel, size=int(tts_mel.shape[2] / speed), mode='linear')
-            tts_speech, _ = self.hift.inference(speech_feat=tts_mel, finalize=finalize)
-            tts_speech = tts_speech[:, self.hift_cache_dict[uuid]['speech_offset']:]
-            self.hift_cache_dict[uuid]['speech_offset'] += tts_speech.shape[1]
+            # hift carries its conv/source/istft state in hift_cache_dict, only the new mel frames are vocoded
+            tts_speech, self.hift_cache_dict[uuid] = self.hift.inference_chunk(speech_feat=tts_mel, cache=self.hift_cache_dict[uuid], finalize=finalize)
         return tts_speech
+
+
+class Token2WavBatcher:
+    """Run the streaming token2wav chunks of concurrent sessions as one batch.
+
+    A session submits its chunk and blocks. The batcher thread waits up to window seconds after the first pending
+    chunk, or until every registered session has a pending chunk or max_batch_size is reached, then calls run_fn on
+    the whole batch and hands every result back to its session.
+    """
+
+    def __init__(self, run_fn, max_batch_size=8, window=0.005):
+        self.run_fn = run_fn
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.cond = threading.Condition()
+        self.pending = []
+        self.num_sessions = 0
+        self.num_batches, self.num_chunks = 0, 0
+        self.thread = threading.Thread(target=self.loop, name='token2wav_batcher', daemon=True)
+        self.thread.start()
+
+    def add_session(self):
+        with self.cond:
+            self.num_sessions += 1
+
+    def remove_session(self):
+        with self.cond:
+            self.num_sessions -= 1
+            self.cond.notify()
+
+    def submit(self, **kwargs):
+        request = {'kwargs': kwargs, 'event': threading.Event(), 'result': None, 'error': None}
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify()
+        request['event'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def stats(self):
+        with self.cond:
+            return {'sessions': self.num_sessions, 'pending': len(self.pending), 'batches': self.num_batches,
+                    'avg_batch_size': round(self.num_chunks / max(self.num_batches, 1), 2)}
+
+    def loop(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+                deadline = time.time() + self.window
+                while len(self.pending) < min(self.max_batch_size, self.num_sessions) and time.time() < deadline:
+                    self.cond.wait(deadline - time.time())
+                batch, self.pending = self.pending[:self.max_batch_size], self.pending[self.max_batch_size:]
+                self.num_batches += 1
+                self.num_chunks += len(batch)
+            try:
+                for request, result in zip(batch, self.run_fn([request['kwargs'] for request in batch])):
+                    request['result'] = result
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            for request in batch:
+                request['event'].set()
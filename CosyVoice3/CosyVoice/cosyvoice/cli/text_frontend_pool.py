@@ -0,0 +1,79 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sys
+import types
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from cosyvoice.utils.file_utils import logging
+
+# text frontend of the worker process, built once by _init_worker
+_frontend = None
+
+
+def _init_worker(get_tokenizer, allowed_special):
+    global _frontend
+    from cosyvoice.cli.frontend import CosyVoiceFrontEnd
+    torch.set_num_threads(1)
+    # only the text part of CosyVoiceFrontEnd is needed, skip the onnx sessions and spk2info
+    _frontend = object.__new__(CosyVoiceFrontEnd)
+    _frontend.tokenizer = get_tokenizer()
+    _frontend.allowed_special = allowed_special
+    _frontend.text_pool = None
+    _frontend.pool_tokens = {}
+    _frontend._load_text_frontend()
+
+
+def _normalize_batch(texts):
+    results = []
+    for text in texts:
+        text, segments = _frontend._normalize_cached(text)
+        results.append((text, segments, [_frontend._encode(i) for i in segments]))
+    return results
+
+
+class TextFrontendPool:
+    """Process pool running CosyVoiceFrontEnd text normalization and tokenization outside of the service process.
+
+    Every worker holds its own tokenizer and ttsfrd/wetext normalizer, so normalizing concurrent requests scales with
+    cores and does not hold the GIL of the llm/flow threads. Workers are spawned, never forked from the threaded
+    service process.
+    """
+
+    def __init__(self, get_tokenizer, allowed_special, num_workers=2):
+        self.num_workers = num_workers
+        self.executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(get_tokenizer, allowed_special))
+        # start every worker now, so that the first requests do not pay the normalizer loading. spawned children
+        # re-import the __main__ module, which is the service script (and its model loading) under `python main.py`,
+        # the workers only need this module so __main__ is hidden while they start
+        main_module = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            futures = [self.executor.submit(_normalize_batch, []) for _ in range(num_workers)]
+        finally:
+            sys.modules['__main__'] = main_module
+        for future in futures:
+            future.result()
+        logging.info('text frontend pool started with {} workers'.format(num_workers))
+
+    def normalize(self, texts):
+        """Normalize and split every text, return a list of (normalized text, segments, token ids of every segment)."""
+        texts = list(texts)
+        # one task per worker at most, texts of a batch are normalized in parallel
+        chunk_size = max(1, -(-len(texts) // self.num_workers))
+        futures = [self.executor.submit(_normalize_batch, texts[i: i + chunk_size]) for i in range(0, len(texts), chunk_size)]
+        return [result for future in futures for result in future.result()]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
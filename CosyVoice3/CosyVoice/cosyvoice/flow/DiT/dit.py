@@ -15,7 +15,7 @@ from torch import nn
 import torch.nn.functional as F
 from einops import repeat
 from x_transformers.x_transformers import RotaryEmbedding
-from cosyvoice.utils.mask import add_optional_chunk_mask
+from cosyvoice.utils.mask import add_optional_chunk_mask, subsequent_chunk_mask
 from cosyvoice.flow.DiT.modules import (
     TimestepEmbedding,
     ConvNeXtV2Block,
@@ -97,6 +97,23 @@ class InputEmbedding(nn.Module):
         x = self.conv_pos_embed(x) + x
         return x
 
+    def forward_chunk(
+            self,
+            x: float["b n d"],
+            cond: float["b n d"],
+            text_embed: float["b n d"],
+            spks: float["b d"],
+            cnn_cache: float["2 b d k"],
+    ):
+        to_cat = [x, cond, text_embed]
+        if self.spk_dim > 0:
+            spks = repeat(spks, "b c -> b t c", t=x.shape[1])
+            to_cat.append(spks)
+
+        x = self.proj(torch.cat(to_cat, dim=-1))
+        pos_embed, cnn_cache = self.conv_pos_embed.forward_chunk(x, cnn_cache)
+        return pos_embed + x, cnn_cache
+
 
 # Transformer backbone using DiT blocks
 
@@ -130,6 +147,8 @@ class DiT(nn.Module):
 
         self.dim = dim
         self.depth = depth
+        self.heads = heads
+        self.dim_head = dim_head
 
         self.transformer_blocks = nn.ModuleList(
             [DiTBlock(dim=dim, heads=heads, dim_head=dim_head, ff_mult=ff_mult, dropout=dropout) for _ in range(depth)]
@@ -174,3 +193,64 @@ class DiT(nn.Module):
         x = self.norm_out(x, t)
         output = self.proj_out(x).transpose(1, 2)
         return output
+
+    def init_cache(self, batch_size, device=None, dtype=None):
+        """Empty att_cache and cnn_cache of forward_chunk"""
+        att_cache = torch.zeros(self.depth, 2, batch_size, self.heads, 0, self.dim_head, device=device, dtype=dtype)
+        cnn_cache = torch.zeros(2, batch_size, self.dim, self.input_embed.conv_pos_embed.kernel_size - 1, device=device, dtype=dtype)
+        return att_cache, cnn_cache
+
+    def forward_chunk(self, x, mu, t, spks, cond, offset, att_cache, cnn_cache, cache_lens=None, x_lens=None):
+        """Streaming forward of the frames following the cached ones.
+
+        Args:
+            x, mu, cond: (b, mel_dim, n), frames [offset, offset + n) of the utterance
+            offset: int or (b,) tensor, absolute position of the first frame of x, must be a multiple of static_chunk_size
+            att_cache: (depth, 2, b, heads, cache_len, dim_head), key and value of the cached frames
+            cnn_cache: (2, b, dim, kernel_size - 1), inputs of the causal conv position embedding before x
+            cache_lens, x_lens: optional (b,) tensors, valid length of att_cache and x when rows of several utterances
+                are right padded into one batch
+
+        Returns:
+            output: (b, mel_dim, n)
+            att_cache: (depth, 2, b, heads, cache_len + n, dim_head)
+            cnn_cache: (2, b, dim, kernel_size - 1 + n), the caller keeps the kernel_size - 1 inputs before its next offset
+        """
+        assert bool((offset % self.static_chunk_size == 0).all()) if isinstance(offset, torch.Tensor) else offset % self.static_chunk_size == 0, \
+            'offset {} should be a multiple of static_chunk_size'.format(offset)
+        x = x.transpose(1, 2)
+        mu = mu.transpose(1, 2)
+        cond = cond.transpose(1, 2)
+        batch, seq_len = x.shape[0], x.shape[1]
+        if t.ndim == 0:
+            t = t.repeat(batch)
+
+        t = self.time_embed(t)
+        x, cnn_cache = self.input_embed.forward_chunk(x, cond, mu, spks, cnn_cache)
+
+        position = torch.arange(seq_len, device=x.device) + (offset.unsqueeze(dim=1) if isinstance(offset, torch.Tensor) else offset)
+        rope = self.rotary_embed(position)
+
+        if self.long_skip_connection is not None:
+            residual = x
+
+        # cached frames are always visible, the chunks of x are aligned since offset is a multiple of static_chunk_size
+        attn_mask = torch.concat([torch.ones(seq_len, att_cache.shape[4], dtype=torch.bool, device=x.device),
+                                  subsequent_chunk_mask(seq_len, self.static_chunk_size, device=x.device)], dim=1)
+        attn_mask = attn_mask.unsqueeze(dim=0).unsqueeze(dim=0)
+        if cache_lens is not None:
+            key_mask = torch.concat([torch.arange(att_cache.shape[4], device=x.device) < cache_lens.unsqueeze(dim=1),
+                                     torch.arange(seq_len, device=x.device) < x_lens.unsqueeze(dim=1)], dim=1)
+            attn_mask = attn_mask & key_mask.unsqueeze(dim=1).unsqueeze(dim=1)
+
+        new_att_cache = []
+        for i, block in enumerate(self.transformer_blocks):
+            x, this_att_cache = block.forward_chunk(x, t, att_cache[i], mask=attn_mask, rope=rope)
+            new_att_cache.append(this_att_cache)
+
+        if self.long_skip_connection is not None:
+            x = self.long_skip_connection(torch.cat((x, residual), dim=-1))
+
+        x = self.norm_out(x, t)
+        output = self.proj_out(x).transpose(1, 2)
+        return output, torch.stack(new_att_cache), cnn_cache
@@ -143,6 +143,17 @@ class CausalConvPositionEmbedding(nn.Module):
 
         return out
 
+    def forward_chunk(self, x: float["b n d"], cnn_cache: float["2 b d k"]):  # noqa: F722
+        """cnn_cache holds the last kernel_size - 1 inputs of conv1 and conv2 before x,
+        returns the output and the padded inputs of conv1 and conv2 (2, b, d, kernel_size - 1 + n)"""
+        x = x.permute(0, 2, 1)
+        conv1_input = torch.concat([cnn_cache[0], x], dim=2)
+        x = self.conv1(conv1_input)
+        conv2_input = torch.concat([cnn_cache[1], x], dim=2)
+        x = self.conv2(conv2_input)
+        out = x.permute(0, 2, 1)
+        return out, torch.stack([conv1_input, conv2_input])
+
 
 # rotary positional embedding related
 
@@ -342,6 +353,42 @@ class Attention(nn.Module):
         else:
             return self.processor(self, x, mask=mask, rope=rope)
 
+    def forward_chunk(
+        self,
+        x: float["b n d"],  # noised input x  # noqa: F722
+        att_cache: float["2 b h c d"],  # rope applied key and value of the cached frames  # noqa: F722
+        mask: bool["b 1 n m"] | None = None,  # noqa: F722
+        rope=None,  # rotary position embedding up to the last frame of x
+    ):
+        batch_size = x.shape[0]
+
+        query = self.to_q(x)
+        key = self.to_k(x)
+        value = self.to_v(x)
+
+        # apply_rotary_pos_emb uses the last seq_len positions of freqs
+        if rope is not None:
+            freqs, xpos_scale = rope
+            q_xpos_scale, k_xpos_scale = (xpos_scale, xpos_scale**-1.0) if xpos_scale is not None else (1.0, 1.0)
+
+            query = apply_rotary_pos_emb(query, freqs, q_xpos_scale)
+            key = apply_rotary_pos_emb(key, freqs, k_xpos_scale)
+
+        head_dim = self.inner_dim // self.heads
+        query = query.view(batch_size, -1, self.heads, head_dim).transpose(1, 2)
+        key = key.view(batch_size, -1, self.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, self.heads, head_dim).transpose(1, 2)
+        key = torch.concat([att_cache[0].to(key.dtype), key], dim=2)
+        value = torch.concat([att_cache[1].to(value.dtype), value], dim=2)
+
+        x = F.scaled_dot_product_attention(query, key, value, attn_mask=mask, dropout_p=0.0, is_causal=False)
+        x = x.transpose(1, 2).reshape(batch_size, -1, self.heads * head_dim)
+        x = x.to(query.dtype)
+
+        x = self.to_out[0](x)
+        x = self.to_out[1](x)
+        return x, torch.stack([key, value])
+
 
 # Attention processor
 
@@ -529,6 +576,19 @@ class DiTBlock(nn.Module):
 
         return x
 
+    def forward_chunk(self, x, t, att_cache, mask=None, rope=None):
+        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t)
+
+        attn_output, att_cache = self.attn.forward_chunk(x=norm, att_cache=att_cache, mask=mask, rope=rope)
+
+        x = x + gate_msa.unsqueeze(1) * attn_output
+
+        ff_norm = self.ff_norm(x) * (1 + scale_mlp[:, None]) + shift_mlp[:, None]
+        ff_output = self.ff(ff_norm)
+        x = x + gate_mlp.unsqueeze(1) * ff_output
+
+        return x, att_cache
+
 
 # MMDiT Block https://arxiv.org/abs/2403.03206
 
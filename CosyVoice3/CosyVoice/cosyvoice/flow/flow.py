@@ -17,6 +17,7 @@ from typing import Dict, Optional
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
+from torch.nn.utils.rnn import pad_sequence
 from omegaconf import DictConfig
 from cosyvoice.utils.mask import make_pad_mask
 
@@ -402,6 +403,106 @@ class CausalMaskedDiffWithDiT(torch.nn.Module):
         assert feat.shape[2] == mel_len2
         return feat.float(), None
 
+    @torch.inference_mode()
+    def setup_cache(self, prompt_token, prompt_feat, embedding, n_timesteps=10, max_cache_len=None):
+        """Create the streaming cache of inference_chunk for one utterance.
+
+        max_cache_len: if not None, only keep the prompt frames and the last max_cache_len generated frames in the
+            estimator att_cache, which bounds memory and compute for long utterances at the cost of output drifting from
+            the full left context path. None keeps all frames so that inference_chunk equals inference(streaming=True).
+        """
+        assert prompt_token.shape[0] == 1
+        assert self.decoder.estimator.static_chunk_size % self.token_mel_ratio == 0
+        # xvec projection
+        embedding = F.normalize(embedding, dim=1)
+        embedding = self.spk_embed_affine_layer(embedding)
+        att_cache, cnn_cache = self.decoder.init_cache(n_timesteps, device=embedding.device, dtype=embedding.dtype)
+        # offset: absolute mel position (prompt included) of the first frame which is not in att_cache/cnn_cache
+        return {'prompt_token': prompt_token, 'prompt_feat': prompt_feat, 'embedding': embedding,
+                'n_timesteps': n_timesteps, 'max_cache_len': max_cache_len, 'offset': 0,
+                'att_cache': att_cache, 'cnn_cache': cnn_cache}
+
+    @torch.inference_mode()
+    def inference_chunk(self, token, token_offset, cache, finalize):
+        """Streaming counterpart of inference(streaming=True), returns feat[:, :, token_offset * token_mel_ratio:].
+
+        Only the frames after cache['offset'] are computed, the estimator attends to the cached key/value of the
+        frames before, frames of complete chunks are moved into the cache for the next call.
+        """
+        feats, caches = self.inference_chunk_batch([token], [token_offset], [cache], [finalize])
+        return feats[0], caches[0]
+
+    @torch.inference_mode()
+    def inference_chunk_batch(self, tokens, token_offsets, caches, finalizes):
+        """inference_chunk of several utterances with one estimator call per euler step.
+
+        The new frames and the att_cache of every utterance are right padded to the longest ones and masked out in
+        the estimator, so every output equals the one of its own inference_chunk call.
+        """
+        mus, conds, offsets = [], [], []
+        for token, token_offset, cache, finalize in zip(tokens, token_offsets, caches, finalizes):
+            assert token.shape[0] == 1
+            prompt_token, prompt_feat = cache['prompt_token'], cache['prompt_feat']
+            offset, mel_len1 = cache['offset'], prompt_feat.shape[1]
+            assert offset <= mel_len1 + token_offset * self.token_mel_ratio
+
+            # h of token i depends on token[i - conv2.kernel_size + 1: i + pre_lookahead_len + 1], only encode from the first uncached token
+            token = torch.concat([prompt_token, token], dim=1)
+            start = offset // self.token_mel_ratio
+            left = max(start - (self.pre_lookahead_layer.conv2.kernel_size[0] - 1), 0)
+            token = self.input_embedding(torch.clamp(token[:, left:], min=0))
+            if finalize is True:
+                h = self.pre_lookahead_layer(token)
+            else:
+                h = self.pre_lookahead_layer(token[:, :-self.pre_lookahead_len], context=token[:, -self.pre_lookahead_len:])
+            h = h[:, start - left:].repeat_interleave(self.token_mel_ratio, dim=1)
+
+            # get conditions
+            cond = torch.zeros([1, h.shape[1], self.output_size], device=token.device).to(h.dtype)
+            if offset < mel_len1:
+                cond[:, :mel_len1 - offset] = prompt_feat[:, offset:]
+            mus.append(h[0])
+            conds.append(cond[0])
+            offsets.append(offset)
+
+        # rows are [utt_0, ..., utt_n-1] for the conditional and [utt_0, ..., utt_n-1] for the cfg part of the estimator batch
+        batch_size = len(caches)
+        x_lens = torch.tensor([mu.shape[0] for mu in mus], device=mus[0].device)
+        cache_lens = torch.tensor([cache['att_cache'].shape[5] for cache in caches], device=mus[0].device)
+        max_cache_len = int(cache_lens.max())
+        att_cache = torch.concat([F.pad(cache['att_cache'][:, :, :, i:i + 1], (0, 0, 0, max_cache_len - cache['att_cache'].shape[5]))
+                                  for i in range(2) for cache in caches], dim=3)
+        cnn_cache = torch.concat([cache['cnn_cache'][:, :, i:i + 1] for i in range(2) for cache in caches], dim=2)
+        feat, att_cache, cnn_cache = self.decoder.forward_chunk(
+            mu=pad_sequence(mus, batch_first=True).transpose(1, 2).contiguous(),
+            spks=torch.concat([cache['embedding'] for cache in caches], dim=0),
+            cond=pad_sequence(conds, batch_first=True).transpose(1, 2).contiguous(),
+            offset=torch.tensor(offsets, device=mus[0].device),
+            att_cache=att_cache,
+            cnn_cache=cnn_cache,
+            n_timesteps=caches[0]['n_timesteps'],
+            cache_lens=cache_lens if batch_size > 1 else None,
+            x_lens=x_lens if batch_size > 1 else None
+        )
+
+        feats = []
+        for i, (token_offset, cache, finalize) in enumerate(zip(token_offsets, caches, finalizes)):
+            offset, mel_len1, x_len = cache['offset'], cache['prompt_feat'].shape[1], mus[i].shape[0]
+            if finalize is False:
+                # frames of complete chunks will not change in later calls
+                static_chunk_size = self.decoder.estimator.static_chunk_size
+                commit_len = (offset + x_len) // static_chunk_size * static_chunk_size - offset
+                this_att_cache = att_cache[:, :, :, [i, batch_size + i]]
+                this_att_cache = torch.concat([this_att_cache[:, :, :, :, :, :int(cache_lens[i])],
+                                               this_att_cache[:, :, :, :, :, max_cache_len:max_cache_len + commit_len]], dim=5)
+                if cache['max_cache_len'] is not None and this_att_cache.shape[5] > mel_len1 + cache['max_cache_len']:
+                    this_att_cache = torch.concat([this_att_cache[:, :, :, :, :, :mel_len1], this_att_cache[:, :, :, :, :, -cache['max_cache_len']:]], dim=5)
+                cache['att_cache'] = this_att_cache
+                cache['cnn_cache'] = cnn_cache[:, :, [i, batch_size + i], :, commit_len:commit_len + cache['cnn_cache'].shape[4]]
+                cache['offset'] = offset + commit_len
+            feats.append(feat[i:i + 1, :, mel_len1 + token_offset * self.token_mel_ratio - offset:x_len].float())
+        return feats, caches
+
 
 if __name__ == '__main__':
     torch.backends.cudnn.deterministic = True
@@ -430,3 +531,8 @@ if __name__ == '__main__':
                                         prompt_token, prompt_token_len, prompt_feat, prompt_feat_len, prompt_embedding, streaming=True, finalize=finalize)
         pred_chunk = pred_chunk[:, :, i * model.token_mel_ratio:]
         print((pred_gt[:, :, i * model.token_mel_ratio: i * model.token_mel_ratio + pred_chunk.shape[2]] - pred_chunk).abs().max().item())
+    cache = model.setup_cache(prompt_token, prompt_feat, prompt_embedding)
+    for i in range(0, max_len, chunk_size):
+        finalize = True if i + chunk_size + context_size >= max_len else False
+        pred_chunk, cache = model.inference_chunk(token[:, :i + chunk_size + context_size], i, cache, finalize=finalize)
+        print((pred_gt[:, :, i * model.token_mel_ratio: i * model.token_mel_ratio + pred_chunk.shape[2]] - pred_chunk).abs().max().item())
@@ -226,3 +226,66 @@ class CausalConditionalCFM(ConditionalCFM):
         if self.t_scheduler == 'cosine':
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
         return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, streaming=streaming), None
+
+    def init_cache(self, n_timesteps, device=None, dtype=None):
+        """Empty estimator caches of forward_chunk, one per euler step, with batch size 2 for classifier-free guidance"""
+        att_cache, cnn_cache = self.estimator.init_cache(2, device=device, dtype=dtype)
+        return att_cache.unsqueeze(dim=0).repeat_interleave(n_timesteps, dim=0), cnn_cache.unsqueeze(dim=0).repeat_interleave(n_timesteps, dim=0)
+
+    @torch.inference_mode()
+    def forward_chunk(self, mu, spks, cond, offset, att_cache, cnn_cache, n_timesteps, temperature=1.0, cache_lens=None, x_lens=None):
+        """Streaming forward diffusion of the frames following the cached ones
+
+        Args:
+            mu (torch.Tensor): output of encoder of frames [offset, offset + n)
+                shape: (1, n_feats, n)
+            spks (torch.Tensor): speaker embedding
+                shape: (1, spk_emb_dim)
+            cond (torch.Tensor): prompt feat of frames [offset, offset + n)
+                shape: (1, n_feats, n)
+            offset (int or torch.Tensor): absolute position of the first frame of mu, (batch_size,) tensor for batched rows
+            att_cache, cnn_cache (torch.Tensor): estimator caches of every euler step, see init_cache
+            cache_lens, x_lens (torch.Tensor): optional valid length of att_cache and mu of right padded rows,
+                shape: (batch_size,)
+
+        Returns:
+            sample: generated mel-spectrogram of frames [offset, offset + n)
+                shape: (1, n_feats, n)
+            att_cache, cnn_cache: estimator caches including the n frames, see DiT.forward_chunk
+        """
+        assert isinstance(self.estimator, torch.nn.Module), 'forward_chunk is not supported by trt estimator'
+        if isinstance(offset, torch.Tensor):
+            # every row takes the noise of its own frames, the same as unbatched calls
+            index = torch.clamp(offset.cpu().unsqueeze(dim=1) + torch.arange(mu.size(2)), max=self.rand_noise.shape[2] - 1)
+            x = self.rand_noise[0][:, index].transpose(0, 1).to(mu.device).to(mu.dtype) * temperature
+            offset = torch.concat([offset, offset], dim=0)
+            cache_lens = torch.concat([cache_lens, cache_lens], dim=0) if cache_lens is not None else None
+            x_lens = torch.concat([x_lens, x_lens], dim=0) if x_lens is not None else None
+        else:
+            x = self.rand_noise[:, :, offset:offset + mu.size(2)].to(mu.device).to(mu.dtype) * temperature
+        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=mu.dtype)
+        if self.t_scheduler == 'cosine':
+            t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
+        t, dt = t_span[0].unsqueeze(dim=0), t_span[1] - t_span[0]
+
+        mu_in = torch.concat([mu, torch.zeros_like(mu)], dim=0).to(spks.dtype)
+        spks_in = torch.concat([spks, torch.zeros_like(spks)], dim=0)
+        cond_in = torch.concat([cond, torch.zeros_like(cond)], dim=0).to(spks.dtype)
+        new_att_cache, new_cnn_cache = [], []
+        for step in range(1, len(t_span)):
+            dphi_dt, this_att_cache, this_cnn_cache = self.estimator.forward_chunk(
+                torch.concat([x, x], dim=0).to(spks.dtype), mu_in,
+                t.repeat(2 * x.size(0)).to(spks.dtype),
+                spks_in, cond_in, offset,
+                att_cache[step - 1], cnn_cache[step - 1],
+                cache_lens=cache_lens, x_lens=x_lens
+            )
+            new_att_cache.append(this_att_cache)
+            new_cnn_cache.append(this_cnn_cache)
+            dphi_dt, cfg_dphi_dt = torch.split(dphi_dt, [x.size(0), x.size(0)], dim=0)
+            dphi_dt = ((1.0 + self.inference_cfg_rate) * dphi_dt - self.inference_cfg_rate * cfg_dphi_dt)
+            x = x + dt * dphi_dt
+            t = t + dt
+            if step < len(t_span) - 1:
+                dt = t_span[step + 1] - t
+        return x.float(), torch.stack(new_att_cache), torch.stack(new_cnn_cache)
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from typing import Dict, Optional
 import torch
 import torch.nn as nn
 try:
@@ -101,3 +102,28 @@ class CausalConvRNNF0Predictor(nn.Module):
             x = self.condnet[i](x)
         x = x.transpose(1, 2)
         return torch.abs(self.classifier(x).squeeze(-1))
+
+    def forward_chunk(self, x: torch.Tensor, cache: Optional[Dict[str, torch.Tensor]] = None, finalize: bool = True):
+        """Streaming forward, x only contains the mel frames after the previous call.
+
+        cache holds the lookahead mel frames of condnet[0] and the left context of the other condnet convs,
+        returns f0 of the frames whose lookahead is available and the new cache.
+        """
+        if cache is None:
+            cache = {'mel': x[:, :, :0]}
+        x = torch.concat([cache['mel'], x], dim=2)
+        causal_padding = self.condnet[0].causal_padding
+        if finalize is True:
+            x, cache['mel'] = self.condnet[0](x), x[:, :, x.shape[2]:]
+        else:
+            if x.shape[2] <= causal_padding:
+                cache['mel'] = x
+                return x.new_zeros(x.shape[0], 0), cache
+            x, cache['mel'] = self.condnet[0](x[:, :, :-causal_padding], x[:, :, -causal_padding:]), x[:, :, -causal_padding:]
+        for i in range(1, len(self.condnet)):
+            if isinstance(self.condnet[i], CausalConv1d):
+                x, cache[str(i)] = self.condnet[i].forward_chunk(x, cache.get(str(i), torch.zeros(0, 0, 0)))
+            else:
+                x = self.condnet[i](x)
+        x = x.transpose(1, 2)
+        return torch.abs(self.classifier(x).squeeze(-1)), cache
@@ -14,7 +14,7 @@
 
 """HIFI-GAN"""
 
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 import numpy as np
 from scipy.signal import get_window
 import torch
@@ -116,6 +116,20 @@ class ResBlock(torch.nn.Module):
             x = xt + x
         return x
 
+    def forward_chunk(self, x: torch.Tensor, cache: Optional[List[torch.Tensor]] = None) -> Tuple[torch.Tensor, List[torch.Tensor]]:
+        """Streaming forward of causal ResBlock, cache holds the left context of convs1[0], convs2[0], convs1[1], ..."""
+        assert self.causal is True
+        new_cache = []
+        for idx in range(len(self.convs1)):
+            xt = self.activations1[idx](x)
+            xt, conv_cache = self.convs1[idx].forward_chunk(xt, cache[2 * idx] if cache is not None else torch.zeros(0, 0, 0))
+            new_cache.append(conv_cache)
+            xt = self.activations2[idx](xt)
+            xt, conv_cache = self.convs2[idx].forward_chunk(xt, cache[2 * idx + 1] if cache is not None else torch.zeros(0, 0, 0))
+            new_cache.append(conv_cache)
+            x = xt + x
+        return x, new_cache
+
     def remove_weight_norm(self):
         for idx in range(len(self.convs1)):
             remove_weight_norm(self.convs1[idx])
@@ -316,6 +330,33 @@ class SineGen2(torch.nn.Module):
         sine_waves = sine_waves * uv + noise
         return sine_waves, uv, noise
 
+    def forward_chunk(self, f0, offset, rad_cumsum):
+        """ sine_tensor, uv, noise, rad_cumsum = forward_chunk(f0, offset, rad_cumsum)
+        causal inference of f0 samples [offset, offset + length) of an utterance, offset is a multiple of upsample_scale
+        rad_cumsum: tensor(batchsize=1, 1, dim), instantaneous phase / (2 * pi) at the end of the previous chunk
+        """
+        assert self.training is False and self.causal is True and self.flag_for_pulse is False
+        fn = torch.multiply(f0, torch.FloatTensor([[range(1, self.harmonic_num + 2)]]).to(f0.device))
+
+        rad_values = (fn / self.sampling_rate) % 1
+        if offset == 0:
+            rad_values[:, 0, :] = rad_values[:, 0, :] + self.rand_ini.to(rad_values.device)
+        rad_values = torch.nn.functional.interpolate(rad_values.transpose(1, 2),
+                                                     scale_factor=1 / self.upsample_scale,
+                                                     mode="linear").transpose(1, 2)
+        # continue the cumsum of the previous chunks
+        rad_cumsum = torch.cumsum(torch.concat([rad_cumsum.to(rad_values), rad_values], dim=1), dim=1)[:, 1:]
+        phase = rad_cumsum * 2 * np.pi
+        phase = torch.nn.functional.interpolate(phase.transpose(1, 2) * self.upsample_scale,
+                                                scale_factor=self.upsample_scale, mode="nearest").transpose(1, 2)
+        sine_waves = torch.sin(phase) * self.sine_amp
+
+        uv = self._f02uv(f0)
+        noise_amp = uv * self.noise_std + (1 - uv) * self.sine_amp / 3
+        noise = noise_amp * self.sine_waves[:, offset:offset + sine_waves.shape[1]].to(sine_waves.device)
+        sine_waves = sine_waves * uv + noise
+        return sine_waves, uv, noise, rad_cumsum[:, -1:]
+
 
 class SourceModuleHnNSF(torch.nn.Module):
     """ SourceModule for hn-nsf
@@ -374,6 +415,18 @@ class SourceModuleHnNSF(torch.nn.Module):
             noise = torch.randn_like(uv) * self.sine_amp / 3
         return sine_merge, noise, uv
 
+    def forward_chunk(self, x, offset, rad_cumsum):
+        """
+        Sine_source, noise_source, uv, rad_cumsum = SourceModuleHnNSF.forward_chunk(F0_sampled, offset, rad_cumsum)
+        causal inference of samples [offset, offset + length) of an utterance, see SineGen2.forward_chunk
+        """
+        assert self.causal is True
+        with torch.no_grad():
+            sine_wavs, uv, _, rad_cumsum = self.l_sin_gen.forward_chunk(x, offset, rad_cumsum)
+        sine_merge = self.l_tanh(self.l_linear(sine_wavs))
+        noise = self.uv[:, offset:offset + uv.shape[1]] * self.sine_amp / 3
+        return sine_merge, noise, uv, rad_cumsum
+
 
 class HiFTGenerator(nn.Module):
     """
@@ -725,6 +778,178 @@ class CausalHiFTGenerator(HiFTGenerator):
             generated_speech = self.decode(x=speech_feat[:, :, :-self.f0_predictor.condnet[0].causal_padding], s=s, finalize=finalize)
         return generated_speech, s
 
+    def _istft_chunk(self, magnitude, phase, cache, finalize):
+        """Overlap-add of the new stft frames, cache['istft'] holds the overlap which is not complete yet"""
+        n_fft, hop_len = self.istft_params["n_fft"], self.istft_params["hop_len"]
+        assert n_fft % hop_len == 0 and n_fft // 2 % hop_len == 0
+        magnitude = torch.clip(magnitude, max=1e2)
+        real = magnitude * torch.cos(phase)
+        img = magnitude * torch.sin(phase)
+        window = self.stft_window.to(magnitude.device)
+        frames = torch.fft.irfft(torch.complex(real, img), n=n_fft, dim=1) * window[None, :, None]
+        # frame j covers output blocks [j, j + n_fft // hop_len) of hop_len samples
+        num_blocks, num_frames = n_fft // hop_len, frames.shape[2]
+        y = frames.new_zeros(frames.shape[0], hop_len, num_frames + num_blocks - 1)
+        for b in range(num_blocks):
+            y[:, :, b:b + num_frames] += frames[:, b * hop_len:(b + 1) * hop_len]
+        if cache['istft'] is not None:
+            y[:, :, :num_blocks - 1] += cache['istft']
+        frame_offset = cache['istft_offset']
+        cache['istft_offset'] += num_frames
+        # blocks before frame_offset + num_frames are complete, the last frame ends one block later in finalize, see torch.istft
+        emit_len = num_frames + 1 if finalize is True else num_frames
+        cache['istft'] = y[:, :, num_frames:]
+        block = torch.arange(frame_offset, frame_offset + emit_len, device=y.device)
+        b = torch.arange(num_blocks, device=y.device)
+        valid = ((block[None] - b[:, None]) >= 0) & ((block[None] - b[:, None]) < cache['istft_offset'])
+        window_envelop = (window.pow(2).view(num_blocks, hop_len, 1) * valid[:, None, :]).sum(dim=0)
+        y = y[:, :, :emit_len] / window_envelop
+        # center padding of torch.stft
+        trim = max(n_fft // 2 // hop_len - frame_offset, 0)
+        y = y[:, :, trim:]
+        return y.transpose(1, 2).reshape(y.shape[0], -1)
+
+    def _decode_conv_chunk(self, x: torch.Tensor, s_stft: torch.Tensor, cache: dict) -> Tuple[torch.Tensor, torch.Tensor]:
+        conv_cache = cache['conv']
+        for i in range(self.num_upsamples):
+            x = F.leaky_relu(x, self.lrelu_slope)
+            x, conv_cache['ups.{}'.format(i)] = self.ups[i].forward_chunk(x, conv_cache.get('ups.{}'.format(i), torch.zeros(0, 0, 0)))
+
+            if i == self.num_upsamples - 1 and 'reflection_pad' not in cache:
+                x = self.reflection_pad(x)
+                cache['reflection_pad'] = True
+
+            # fusion
+            si, conv_cache['source_downs.{}'.format(i)] = self.source_downs[i].forward_chunk(s_stft, conv_cache.get('source_downs.{}'.format(i), torch.zeros(0, 0, 0)))
+            si, conv_cache['source_resblocks.{}'.format(i)] = self.source_resblocks[i].forward_chunk(si, conv_cache.get('source_resblocks.{}'.format(i)))
+            x = x + si
+
+            xs = None
+            for j in range(self.num_kernels):
+                idx = i * self.num_kernels + j
+                xj, conv_cache['resblocks.{}'.format(idx)] = self.resblocks[idx].forward_chunk(x, conv_cache.get('resblocks.{}'.format(idx)))
+                xs = xj if xs is None else xs + xj
+            x = xs / self.num_kernels
+
+        x = F.leaky_relu(x)
+        x, conv_cache['conv_post'] = self.conv_post.forward_chunk(x, conv_cache.get('conv_post', torch.zeros(0, 0, 0)))
+        magnitude = torch.exp(x[:, :self.istft_params["n_fft"] // 2 + 1, :])
+        phase = torch.sin(x[:, self.istft_params["n_fft"] // 2 + 1:, :])  # actually, sin is redundancy
+        return magnitude, phase
+
+    def _prepare_chunk(self, speech_feat: torch.Tensor, cache: Optional[dict], finalize: bool) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor], dict]:
+        """f0, source and conv_pre of the new mel frames, returns the conv_pre output and the source stft to decode"""
+        assert speech_feat.shape[0] == 1
+        if cache is None:
+            cache = {'f0_predictor': None, 'mel': speech_feat[:, :, :0], 'rad_cumsum': torch.zeros(1, 1, self.nb_harmonics + 1),
+                     'source': speech_feat.new_zeros(1, 1, 0), 'source_offset': 0, 'mel_offset': 0, 'stft_offset': 0,
+                     'istft': None, 'istft_offset': 0, 'conv': {}}
+        # mel->f0 NOTE f0_predictor precision is crucial for causal inference, move self.f0_predictor to cpu if necessary
+        self.f0_predictor.to('cpu')
+        f0, cache['f0_predictor'] = self.f0_predictor.forward_chunk(speech_feat.cpu(), cache['f0_predictor'], finalize=finalize)
+        f0 = f0.to(speech_feat)
+        # f0->source
+        if f0.shape[1] != 0:
+            s = self.f0_upsamp(f0[:, None]).transpose(1, 2)  # bs,n,t
+            s, _, _, cache['rad_cumsum'] = self.m_source.forward_chunk(s, cache['source_offset'], cache['rad_cumsum'])
+            cache['source_offset'] += s.shape[1]
+            cache['source'] = torch.concat([cache['source'], s.transpose(1, 2)], dim=2)
+
+        # conv_pre needs conv_pre_look_right frames after the last decoded frame, which should also have f0
+        upsample_scale = int(np.prod(self.upsample_rates))
+        mel = torch.concat([cache['mel'], speech_feat], dim=2)
+        if finalize is True:
+            num_frames = mel.shape[2]
+            x = self.conv_pre(mel)
+        else:
+            num_frames = cache['source_offset'] // (upsample_scale * self.istft_params['hop_len']) - self.conv_pre_look_right - cache['mel_offset']
+            if num_frames <= 0:
+                cache['mel'] = mel
+                return None, None, cache
+            x = self.conv_pre(mel[:, :, :num_frames], mel[:, :, num_frames:num_frames + self.conv_pre_look_right])
+        cache['mel'], cache['mel_offset'] = mel[:, :, num_frames:], cache['mel_offset'] + num_frames
+
+        # stft frame j is centered at source sample j * hop_len, the first call also computes frame 0 for the reflection_pad
+        source = cache['source']
+        if cache['stft_offset'] == 0:
+            source = F.pad(source, (self.istft_params['n_fft'] // 2, 0), mode='reflect')
+        if finalize is True:
+            source = F.pad(source, (0, self.istft_params['n_fft'] // 2), mode='reflect')
+        stft_end = cache['mel_offset'] * upsample_scale + 1
+        num_stft_frames = stft_end - cache['stft_offset']
+        s_stft = torch.stft(source[:, 0, :(num_stft_frames - 1) * self.istft_params['hop_len'] + self.istft_params['n_fft']],
+                            self.istft_params["n_fft"], self.istft_params["hop_len"], self.istft_params["n_fft"],
+                            window=self.stft_window.to(source.device), center=False, return_complex=True)
+        s_stft = torch.view_as_real(s_stft)
+        s_stft = torch.cat([s_stft[..., 0], s_stft[..., 1]], dim=1)
+        cache['source'] = source[:, :, num_stft_frames * self.istft_params['hop_len']:]
+        cache['stft_offset'] = stft_end
+        return x, s_stft, cache
+
+    @torch.inference_mode()
+    def inference_chunk(self, speech_feat: torch.Tensor, cache: Optional[dict] = None, finalize: bool = True) -> Tuple[torch.Tensor, dict]:
+        """Incremental counterpart of inference, speech_feat only contains the mel frames after the previous call.
+
+        cache carries the lookahead mel frames, f0_predictor state, source phase and sample offset, the source
+        samples of the next stft frames, the left context of every causal conv and the istft overlap, so every call
+        only processes the new frames. Concatenated outputs match inference on the whole mel with finalize=True.
+        """
+        x, s_stft, cache = self._prepare_chunk(speech_feat, cache, finalize)
+        if x is None:
+            return speech_feat.new_zeros(1, 0), cache
+        magnitude, phase = self._decode_conv_chunk(x, s_stft, cache)
+        generated_speech = torch.clamp(self._istft_chunk(magnitude, phase, cache, finalize), -self.audio_limit, self.audio_limit)
+        return generated_speech, cache
+
+    @torch.inference_mode()
+    def inference_chunk_batch(self, speech_feats: List[torch.Tensor], caches: List[Optional[dict]], finalizes: List[bool]) -> Tuple[List[torch.Tensor], List[dict]]:
+        """inference_chunk of several utterances, the upsample/resblock convs of utterances whose new frames and conv
+        caches have the same shape run as one batch, f0, source and istft stay per utterance."""
+        prepared = [self._prepare_chunk(speech_feat, cache, finalize) for speech_feat, cache, finalize in zip(speech_feats, caches, finalizes)]
+        caches = [cache for _, _, cache in prepared]
+        groups = {}
+        for i, (x, s_stft, cache) in enumerate(prepared):
+            if x is not None:
+                key = (x.shape, s_stft.shape, 'reflection_pad' in cache, _cache_shape(cache['conv']))
+                groups.setdefault(key, []).append(i)
+        outputs = [speech_feat.new_zeros(1, 0) for speech_feat in speech_feats]
+        for group in groups.values():
+            batch_cache = {'conv': _cache_concat([caches[i]['conv'] for i in group])}
+            if 'reflection_pad' in caches[group[0]]:
+                batch_cache['reflection_pad'] = True
+            magnitude, phase = self._decode_conv_chunk(torch.concat([prepared[i][0] for i in group], dim=0),
+                                                       torch.concat([prepared[i][1] for i in group], dim=0), batch_cache)
+            for j, i in enumerate(group):
+                caches[i]['conv'] = _cache_select(batch_cache['conv'], j)
+                caches[i]['reflection_pad'] = True
+                outputs[i] = torch.clamp(self._istft_chunk(magnitude[j:j + 1], phase[j:j + 1], caches[i], finalizes[i]), -self.audio_limit, self.audio_limit)
+        return outputs, caches
+
+
+def _cache_shape(cache):
+    if isinstance(cache, dict):
+        return tuple((k, _cache_shape(v)) for k, v in cache.items())
+    if isinstance(cache, (list, tuple)):
+        return tuple(_cache_shape(v) for v in cache)
+    return tuple(cache.shape) if isinstance(cache, torch.Tensor) else cache
+
+
+def _cache_concat(caches):
+    """Concat the same structured nested conv caches of several utterances along the batch dim"""
+    if isinstance(caches[0], dict):
+        return {k: _cache_concat([c[k] for c in caches]) for k in caches[0]}
+    if isinstance(caches[0], (list, tuple)):
+        return [_cache_concat([c[i] for c in caches]) for i in range(len(caches[0]))]
+    return torch.concat(caches, dim=0) if isinstance(caches[0], torch.Tensor) else caches[0]
+
+
+def _cache_select(cache, index):
+    if isinstance(cache, dict):
+        return {k: _cache_select(v, index) for k, v in cache.items()}
+    if isinstance(cache, (list, tuple)):
+        return [_cache_select(v, index) for v in cache]
+    return cache[index:index + 1] if isinstance(cache, torch.Tensor) else cache
+
 
 if __name__ == '__main__':
     torch.backends.cudnn.deterministic = True
@@ -744,3 +969,9 @@ if __name__ == '__main__':
         pred_chunk, _ = model.inference(mel[:, :, : i + chunk_size + context_size], finalize=finalize)
         pred_chunk = pred_chunk[:, i * 480:]
         print((pred_gt[:, i * 480:i * 480 + pred_chunk.shape[1]] - pred_chunk).abs().max().item())
+    cache, speech_offset = None, 0
+    for i in range(0, max_len, chunk_size):
+        finalize = True if i + chunk_size >= max_len else False
+        pred_chunk, cache = model.inference_chunk(mel[:, :, i:i + chunk_size], cache, finalize=finalize)
+        print((pred_gt[:, speech_offset:speech_offset + pred_chunk.shape[1]] - pred_chunk).abs().max().item())
+        speech_offset += pred_chunk.shape[1]
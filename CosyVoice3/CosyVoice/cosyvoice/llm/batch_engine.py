@@ -0,0 +1,200 @@
+# Copyright (c) 2025 Alibaba Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import queue
+import threading
+from contextlib import nullcontext
+import torch
+import torch.nn.functional as F
+from transformers.models.qwen2.modeling_qwen2 import apply_rotary_pos_emb
+from cosyvoice.utils.file_utils import logging
+
+
+class BatchRequest:
+    """One decode request of LLMBatchEngine, sampled tokens are put into output_queue, None marks the end."""
+
+    def __init__(self, lm_input, sampling, min_len, max_len):
+        self.lm_input = lm_input
+        self.sampling = sampling
+        self.min_len = min_len
+        self.max_len = max_len
+        self.output_queue = queue.Queue()
+        self.out_tokens = []
+        self.slot = None
+        self.seq_len = 0
+        self.cancelled = False
+
+
+class LLMBatchEngine:
+    """Continuous batching decode engine of Qwen2LM/CosyVoice3LM without vllm.
+
+    Every active sequence owns one slot of a padded kv cache of shape
+    (num_layers, 2, max_batch_size, num_key_value_heads, max_seq_len, head_dim). A background thread admits waiting
+    requests between decode steps (prefill one by one), then steps all active sequences together with a single
+    batched forward, samples each sequence with lm.sampling_ids and streams the tokens back to its session.
+    """
+
+    def __init__(self, lm, max_batch_size=8, max_seq_len=2048, fp16=False):
+        self.lm = lm
+        self.model = lm.llm.model.model
+        config = lm.llm.model.config
+        self.num_heads = config.num_attention_heads
+        self.num_kv_heads = config.num_key_value_heads
+        self.head_dim = getattr(config, 'head_dim', None) or config.hidden_size // config.num_attention_heads
+        self.max_batch_size = max_batch_size
+        self.max_seq_len = max_seq_len
+        self.fp16 = fp16
+        param = next(self.model.parameters())
+        self.device = param.device
+        self.kv_cache = torch.zeros(len(self.model.layers), 2, max_batch_size, self.num_kv_heads, max_seq_len, self.head_dim,
+                                    device=self.device, dtype=param.dtype)
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.active = []
+        self.free_slots = list(range(max_batch_size))
+        self.num_steps, self.num_step_tokens = 0, 0
+        self.thread = threading.Thread(target=self.loop, name='llm_batch_engine', daemon=True)
+        self.thread.start()
+
+    def add_request(self, lm_input, sampling, min_len, max_len):
+        assert lm_input.shape[0] == 1
+        if lm_input.shape[1] >= self.max_seq_len:
+            raise ValueError('lm_input length {} exceeds max_seq_len {}'.format(lm_input.shape[1], self.max_seq_len))
+        if lm_input.shape[1] + max_len > self.max_seq_len:
+            logging.warning('max_len {} exceeds max_seq_len {}, truncate to {}'.format(max_len, self.max_seq_len, self.max_seq_len - lm_input.shape[1]))
+            max_len = self.max_seq_len - lm_input.shape[1]
+        request = BatchRequest(lm_input.to(self.device), sampling, min_len, max_len)
+        with self.cond:
+            self.waiting.append(request)
+            self.cond.notify()
+        return request
+
+    def generate(self, lm_input, sampling, min_len, max_len):
+        request = self.add_request(lm_input, sampling, min_len, max_len)
+        try:
+            while True:
+                top_ids = request.output_queue.get()
+                if top_ids is None:
+                    break
+                if isinstance(top_ids, Exception):
+                    raise top_ids
+                yield top_ids
+        finally:
+            # the engine releases the slot before its next step if the session stops early
+            request.cancelled = True
+
+    def stats(self):
+        with self.cond:
+            return {'active': len(self.active), 'waiting': len(self.waiting), 'max_batch_size': self.max_batch_size,
+                    'steps': self.num_steps, 'avg_batch_size': round(self.num_step_tokens / max(self.num_steps, 1), 2)}
+
+    def loop(self):
+        while True:
+            with self.cond:
+                while len(self.waiting) == 0 and len(self.active) == 0:
+                    self.cond.wait()
+                admitted = []
+                while len(self.waiting) != 0 and len(self.free_slots) != 0:
+                    request = self.waiting.pop(0)
+                    request.slot = self.free_slots.pop(0)
+                    admitted.append(request)
+            try:
+                with torch.inference_mode(), torch.cuda.amp.autocast(self.fp16) if torch.cuda.is_available() else nullcontext():
+                    for request in admitted:
+                        self.active.append(request)
+                        self.prefill(request)
+                    self.release(lambda r: r.cancelled)
+                    if len(self.active) != 0:
+                        self.step()
+            except Exception as e:
+                logging.error('llm batch engine step failed {}'.format(e))
+                for request in self.active:
+                    request.output_queue.put(e)
+                self.release(lambda r: True)
+
+    def release(self, condition):
+        with self.cond:
+            for request in [r for r in self.active if condition(r)]:
+                self.active.remove(request)
+                self.free_slots.append(request.slot)
+                self.free_slots.sort()
+
+    def forward(self, xs, position_ids, slots, attn_mask):
+        """Run the qwen2 decoder layers on xs (b, t, d) whose kv are written to kv_cache[:, :, slots] at position_ids"""
+        b, t = xs.shape[0], xs.shape[1]
+        kv_len = attn_mask.shape[-1]
+        position_embeddings = self.model.rotary_emb(xs, position_ids)
+        for i, layer in enumerate(self.model.layers):
+            residual = xs
+            xs = layer.input_layernorm(xs)
+            q = layer.self_attn.q_proj(xs).view(b, t, self.num_heads, self.head_dim).transpose(1, 2)
+            k = layer.self_attn.k_proj(xs).view(b, t, self.num_kv_heads, self.head_dim).transpose(1, 2)
+            v = layer.self_attn.v_proj(xs).view(b, t, self.num_kv_heads, self.head_dim).transpose(1, 2)
+            q, k = apply_rotary_pos_emb(q, k, *position_embeddings)
+            # (b, t) advanced indices are moved to the front, so the written value is (b, t, kv_heads, head_dim)
+            self.kv_cache[i, 0, slots[:, None], :, position_ids] = k.transpose(1, 2).to(self.kv_cache.dtype)
+            self.kv_cache[i, 1, slots[:, None], :, position_ids] = v.transpose(1, 2).to(self.kv_cache.dtype)
+            k = self.kv_cache[i, 0, slots, :, :kv_len].to(q.dtype).repeat_interleave(self.num_heads // self.num_kv_heads, dim=1)
+            v = self.kv_cache[i, 1, slots, :, :kv_len].to(q.dtype).repeat_interleave(self.num_heads // self.num_kv_heads, dim=1)
+            xs = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+            xs = layer.self_attn.o_proj(xs.transpose(1, 2).reshape(b, t, self.num_heads * self.head_dim))
+            xs = residual + xs
+            residual = xs
+            xs = layer.post_attention_layernorm(xs)
+            xs = layer.mlp(xs)
+            xs = residual + xs
+        return self.model.norm(xs)
+
+    def prefill(self, request):
+        seq_len = request.lm_input.shape[1]
+        position_ids = torch.arange(seq_len, device=self.device).unsqueeze(dim=0)
+        slots = torch.tensor([request.slot], device=self.device)
+        attn_mask = torch.tril(torch.ones(seq_len, seq_len, dtype=torch.bool, device=self.device)).unsqueeze(dim=0).unsqueeze(dim=0)
+        xs = self.forward(request.lm_input, position_ids, slots, attn_mask)
+        request.seq_len = seq_len
+        self.sample([request], self.lm.llm_decoder(xs[:, -1]).log_softmax(dim=-1))
+
+    def step(self):
+        requests = list(self.active)
+        slots = torch.tensor([r.slot for r in requests], device=self.device)
+        position_ids = torch.tensor([[r.seq_len] for r in requests], device=self.device)
+        xs = self.lm.speech_embedding.weight[torch.tensor([r.out_tokens[-1] for r in requests], device=self.device)].unsqueeze(dim=1)
+        kv_len = int(position_ids.max()) + 1
+        attn_mask = (torch.arange(kv_len, device=self.device)[None] <= position_ids).unsqueeze(dim=1).unsqueeze(dim=1)
+        xs = self.forward(xs, position_ids, slots, attn_mask)
+        for r in requests:
+            r.seq_len += 1
+        self.num_steps += 1
+        self.num_step_tokens += len(requests)
+        self.sample(requests, self.lm.llm_decoder(xs[:, -1]).log_softmax(dim=-1))
+
+    def sample(self, requests, logp):
+        finished = []
+        for request, this_logp in zip(requests, logp):
+            try:
+                top_ids = self.lm.sampling_ids(this_logp, request.out_tokens, request.sampling,
+                                               ignore_eos=True if len(request.out_tokens) < request.min_len else False)
+            except Exception as e:
+                request.output_queue.put(e)
+                finished.append(request)
+                continue
+            if top_ids in self.lm.stop_token_ids:
+                request.output_queue.put(None)
+                finished.append(request)
+                continue
+            request.out_tokens.append(top_ids)
+            request.output_queue.put(top_ids)
+            if len(request.out_tokens) == request.max_len:
+                request.output_queue.put(None)
+                finished.append(request)
+        self.release(lambda r: r in finished)
@@ -22,6 +22,7 @@ import torch
 from torch import nn
 import torch.nn.functional as F
 from transformers import Qwen2ForCausalLM
+from transformers.models.qwen2.modeling_qwen2 import apply_rotary_pos_emb
 from torch.nn.utils.rnn import pad_sequence, unpad_sequence
 from cosyvoice.utils.common import IGNORE_ID
 from cosyvoice.transformer.label_smoothing_loss import LabelSmoothingLoss
@@ -257,6 +258,52 @@ class Qwen2Encoder(torch.nn.Module):
         new_cache = outs.past_key_values
         return xs, new_cache
 
+    def init_static_cache(self, max_len, device, dtype):
+        """Preallocated key/value of every layer and rope table of max_len positions for forward_one_step_static"""
+        config = self.model.config
+        head_dim = getattr(config, 'head_dim', None) or config.hidden_size // config.num_attention_heads
+        cos, sin = self.model.model.rotary_emb(torch.zeros(1, device=device, dtype=dtype), torch.arange(max_len, device=device).unsqueeze(dim=0))
+        return {'kv': torch.zeros(config.num_hidden_layers, 2, 1, config.num_key_value_heads, max_len, head_dim, device=device, dtype=dtype),
+                'cos': cos, 'sin': sin}
+
+    def forward_one_step_static(self, xs, cache, offset: int):
+        """forward_one_step with the static cache of init_static_cache, xs (1, T, D) are the inputs at [offset, offset + T).
+
+        T > 1 is only allowed for the prompt at offset 0, a single decode step attends to every cached position so that
+        no mask is built, query heads of a key/value group are viewed as its queries instead of repeating the key/value.
+        """
+        config = self.model.config
+        num_heads, num_kv_heads = config.num_attention_heads, config.num_key_value_heads
+        seq_len, head_dim = xs.shape[1], cache['kv'].shape[5]
+        assert offset == 0 or seq_len == 1
+        cos, sin = cache['cos'][:, offset:offset + seq_len], cache['sin'][:, offset:offset + seq_len]
+        for i, layer in enumerate(self.model.model.layers):
+            residual = xs
+            xs = layer.input_layernorm(xs)
+            q = layer.self_attn.q_proj(xs).view(1, seq_len, num_heads, head_dim).transpose(1, 2)
+            k = layer.self_attn.k_proj(xs).view(1, seq_len, num_kv_heads, head_dim).transpose(1, 2)
+            v = layer.self_attn.v_proj(xs).view(1, seq_len, num_kv_heads, head_dim).transpose(1, 2)
+            q, k = apply_rotary_pos_emb(q, k, cos, sin)
+            cache['kv'][i, 0, :, :, offset:offset + seq_len] = k
+            cache['kv'][i, 1, :, :, offset:offset + seq_len] = v
+            k, v = cache['kv'][i, 0, :, :, :offset + seq_len], cache['kv'][i, 1, :, :, :offset + seq_len]
+            if seq_len == 1:
+                xs = F.scaled_dot_product_attention(q.reshape(1, num_kv_heads, num_heads // num_kv_heads, head_dim), k, v)
+            else:
+                xs = F.scaled_dot_product_attention(q, k.repeat_interleave(num_heads // num_kv_heads, dim=1),
+                                                    v.repeat_interleave(num_heads // num_kv_heads, dim=1), is_causal=True)
+            xs = layer.self_attn.o_proj(xs.reshape(1, num_heads, seq_len, head_dim).transpose(1, 2).reshape(1, seq_len, num_heads * head_dim))
+            xs = residual + xs
+            residual = xs
+            xs = layer.post_attention_layernorm(xs)
+            xs = layer.mlp(xs)
+            xs = residual + xs
+        return self.model.model.norm(xs)
+
+    def compile_static_step(self):
+        # dynamic shapes so that the growing kv length does not trigger a recompilation every step
+        self.forward_one_step_static = torch.compile(self.forward_one_step_static, dynamic=True)
+
 
 class Qwen2LM(TransformerLM):
     def __init__(
@@ -508,13 +555,16 @@ class Qwen2LM(TransformerLM):
                 time.sleep(0.001)
             with self.lock:
                 self.vllm_output_queue.pop(uuid)
+        elif hasattr(self, 'batch_engine'):
+            for top_ids in self.batch_engine.generate(lm_input, sampling, min_len, max_len):
+                yield top_ids
         else:
             out_tokens = []
-            cache = None
+            dtype = torch.get_autocast_gpu_dtype() if lm_input.is_cuda and torch.is_autocast_enabled() else lm_input.dtype
+            cache, offset = self.llm.init_static_cache(lm_input.shape[1] + max_len, lm_input.device, dtype), 0
             for i in range(max_len):
-                y_pred, cache = self.llm.forward_one_step(lm_input,
-                                                          masks=torch.tril(torch.ones((1, lm_input.shape[1], lm_input.shape[1]), device=lm_input.device)).to(torch.bool),
-                                                          cache=cache)
+                y_pred = self.llm.forward_one_step_static(lm_input, cache, offset)
+                offset += lm_input.shape[1]
                 logp = self.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
                 top_ids = self.sampling_ids(logp.squeeze(dim=0), out_tokens, sampling, ignore_eos=True if i < min_len else False)
                 if top_ids in self.stop_token_ids:
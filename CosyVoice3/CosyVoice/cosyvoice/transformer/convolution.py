@@ -186,6 +186,14 @@ class CausalConv1d(torch.nn.Conv1d):
         assert x.shape[2] == input_timestep
         return x
 
+    def forward_chunk(self, x: torch.Tensor, cache: torch.Tensor = torch.zeros(0, 0, 0)) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Streaming forward of left causal conv, cache holds the last causal_padding inputs before x"""
+        assert self.causal_type == 'left'
+        if cache.size(2) == 0:
+            cache = torch.zeros(x.shape[0], x.shape[1], self.causal_padding).to(x)
+        x = torch.concat([cache, x], dim=2)
+        return super(CausalConv1d, self).forward(x), x[:, :, x.shape[2] - self.causal_padding:]
+
 
 class CausalConv1dDownSample(torch.nn.Conv1d):
     def __init__(
@@ -220,6 +228,16 @@ class CausalConv1dDownSample(torch.nn.Conv1d):
         x = super(CausalConv1dDownSample, self).forward(x)
         return x
 
+    def forward_chunk(self, x: torch.Tensor, cache: torch.Tensor = torch.zeros(0, 0, 0)) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Streaming forward, cache holds the inputs which are not consumed by a full stride yet"""
+        if cache.size(2) == 0:
+            cache = torch.zeros(x.shape[0], x.shape[1], self.causal_padding).to(x)
+        x = torch.concat([cache, x], dim=2)
+        if x.shape[2] < self.kernel_size[0]:
+            return x.new_zeros(x.shape[0], self.out_channels, 0), x
+        y = super(CausalConv1dDownSample, self).forward(x)
+        return y, x[:, :, y.shape[2] * self.stride[0]:]
+
 
 class CausalConv1dUpsample(torch.nn.Conv1d):
     def __init__(
@@ -256,3 +274,11 @@ class CausalConv1dUpsample(torch.nn.Conv1d):
         x = super(CausalConv1dUpsample, self).forward(x)
         assert input_timestep == x.shape[2]
         return x
+
+    def forward_chunk(self, x: torch.Tensor, cache: torch.Tensor = torch.zeros(0, 0, 0)) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Streaming forward, cache holds the last causal_padding upsampled inputs before x"""
+        x = self.upsample(x)
+        if cache.size(2) == 0:
+            cache = torch.zeros(x.shape[0], x.shape[1], self.causal_padding).to(x)
+        x = torch.concat([cache, x], dim=2)
+        return super(CausalConv1dUpsample, self).forward(x), x[:, :, x.shape[2] - self.causal_padding:]
@@ -15,7 +15,9 @@
 # limitations under the License.
 
 import os
+import io
 import json
+from functools import lru_cache
 import torch
 import torchaudio
 import logging
@@ -41,12 +43,41 @@ def read_json_lists(list_file):
     return results
 
 
+def decode_wav(wav):
+    """Decode wav into a mono (1, T) float tensor and its sample rate.
+
+    wav can be a path or file object readable by torchaudio, the encoded bytes of an audio file, a (speech, sample_rate)
+    tuple, or a speech tensor which is taken as 16k audio, the rate every caller in cosyvoice passes tensors at.
+    """
+    if isinstance(wav, tuple):
+        speech, sample_rate = wav
+    elif isinstance(wav, torch.Tensor):
+        speech, sample_rate = wav, 16000
+    else:
+        if isinstance(wav, (bytes, bytearray, memoryview)):
+            wav = io.BytesIO(wav)
+        speech, sample_rate = torchaudio.load(wav, backend='soundfile')
+    speech = speech.float().reshape(-1, speech.shape[-1]).mean(dim=0, keepdim=True)
+    return speech, sample_rate
+
+
+@lru_cache(maxsize=None)
+def get_resampler(orig_sr, target_sr):
+    # building the sinc kernel of Resample costs more than applying it to a prompt, so keep one per rate pair
+    return torchaudio.transforms.Resample(orig_freq=orig_sr, new_freq=target_sr)
+
+
+def resample(speech, orig_sr, target_sr):
+    if orig_sr == target_sr:
+        return speech
+    return get_resampler(orig_sr, target_sr)(speech)
+
+
 def load_wav(wav, target_sr, min_sr=16000):
-    speech, sample_rate = torchaudio.load(wav, backend='soundfile')
-    speech = speech.mean(dim=0, keepdim=True)
+    speech, sample_rate = decode_wav(wav)
     if sample_rate != target_sr:
         assert sample_rate >= min_sr, 'wav sample rate {} must be greater than {}'.format(sample_rate, target_sr)
-        speech = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=target_sr)(speech)
+        speech = resample(speech, sample_rate, target_sr)
     return speech
 
 
@@ -69,12 +69,6 @@ def split_paragraph(text: str, tokenize, lang="zh", token_max_n=80, token_min_n=
         else:
             return len(tokenize(_text))
 
-    def should_merge(_text: str):
-        if lang == "zh":
-            return len(_text) < merge_len
-        else:
-            return len(tokenize(_text)) < merge_len
-
     if lang == "zh":
         pounc = ['。', '？', '！', '；', '：', '、', '.', '?', '!', ';']
     else:
@@ -101,18 +95,22 @@ def split_paragraph(text: str, tokenize, lang="zh", token_max_n=80, token_min_n=
             else:
                 st = i + 1
 
+    # NOTE every sentence is measured once and the length of the current utterance is the sum of its sentences,
+    # re-tokenizing the growing utterance made long english inputs quadratic
     final_utts = []
-    cur_utt = ""
+    cur_utt, cur_len = [], 0
     for utt in utts:
-        if calc_utt_length(cur_utt + utt) > token_max_n and calc_utt_length(cur_utt) > token_min_n:
-            final_utts.append(cur_utt)
-            cur_utt = ""
-        cur_utt = cur_utt + utt
+        utt_len = calc_utt_length(utt)
+        if cur_len + utt_len > token_max_n and cur_len > token_min_n:
+            final_utts.append("".join(cur_utt))
+            cur_utt, cur_len = [], 0
+        cur_utt.append(utt)
+        cur_len += utt_len
     if len(cur_utt) > 0:
-        if should_merge(cur_utt) and len(final_utts) != 0:
-            final_utts[-1] = final_utts[-1] + cur_utt
+        if cur_len < merge_len and len(final_utts) != 0:
+            final_utts[-1] = final_utts[-1] + "".join(cur_utt)
         else:
-            final_utts.append(cur_utt)
+            final_utts.append("".join(cur_utt))
 
     return final_utts
 
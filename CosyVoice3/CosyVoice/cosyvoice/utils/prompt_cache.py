@@ -0,0 +1,234 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import torch
+from cosyvoice.utils.file_utils import logging
+
+
+class PromptFeatureCache:
+    """LRU cache of prompt audio features keyed by audio content hash.
+
+    Audio features (speech_token, speech_feat, embedding) are keyed by (sha1 of the audio, resample_rate),
+    prompt text tokens are keyed by the normalized prompt text. When cache_dir is given, audio features are
+    persisted as one file per entry and an url -> sha1 index is appended to url_index.jsonl, so repeated prompt
+    urls can skip both the download and the feature extractors across restarts. The feature files are kept under
+    max_disk_bytes by evicting the least recently used ones, the url and local path indexes keep at most
+    max_url_entries / max_path_entries entries, and url_index.jsonl is rewritten once most of its lines are stale.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, cache_dir=None, max_text_entries=4096, device='cpu',
+                 max_disk_bytes=4 * 1024 * 1024 * 1024, max_url_entries=65536, max_path_entries=4096):
+        self.max_bytes = max_bytes
+        self.max_text_entries = max_text_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_url_entries = max_url_entries
+        self.max_path_entries = max_path_entries
+        self.cache_dir = cache_dir
+        self.device = device
+        self.lock = threading.Lock()
+        self.feat_dict = OrderedDict()
+        self.feat_bytes = 0
+        self.text_dict = OrderedDict()
+        self.url_index = OrderedDict()
+        self.url_index_lines = 0
+        # (path, mtime, size) -> sha1, avoid re-hashing the same local file
+        self.path_index = OrderedDict()
+        # feature file name -> size, least recently used first
+        self.disk_dict = OrderedDict()
+        self.disk_bytes = 0
+        self.hits, self.misses, self.disk_hits = 0, 0, 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            url_index_path = os.path.join(cache_dir, 'url_index.jsonl')
+            if os.path.exists(url_index_path):
+                with open(url_index_path, 'r', encoding='utf8') as f:
+                    for line in f:
+                        item = json.loads(line)
+                        self.url_index.pop(item['url'], None)
+                        self.url_index[item['url']] = item['sha1']
+                        self.url_index_lines += 1
+                while len(self.url_index) > self.max_url_entries:
+                    self.url_index.popitem(last=False)
+            entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith('.pt')]
+            for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+                self.disk_dict[entry.name] = entry.stat().st_size
+                self.disk_bytes += entry.stat().st_size
+            with self.lock:
+                self._evict_disk()
+            logging.info('prompt cache dir {}, {} indexed urls, {} feature files ({} bytes)'.format(
+                cache_dir, len(self.url_index), len(self.disk_dict), self.disk_bytes))
+
+    @staticmethod
+    def _tensor_bytes(value):
+        return sum(v.element_size() * v.nelement() for v in value.values() if isinstance(v, torch.Tensor))
+
+    def _feat_path(self, key):
+        return os.path.join(self.cache_dir, '{}_{}.pt'.format(*key))
+
+    def audio_hash(self, prompt_wav):
+        """Return the content hash of prompt_wav (url, local path, tensor, (tensor, sample_rate) or bytes), None if unknown."""
+        if isinstance(prompt_wav, tuple):
+            speech, sample_rate = prompt_wav
+            return hashlib.sha1(speech.detach().cpu().contiguous().numpy().tobytes() + str(sample_rate).encode()).hexdigest()
+        if isinstance(prompt_wav, torch.Tensor):
+            return hashlib.sha1(prompt_wav.detach().cpu().contiguous().numpy().tobytes()).hexdigest()
+        if isinstance(prompt_wav, (bytes, bytearray, memoryview)):
+            return hashlib.sha1(prompt_wav).hexdigest()
+        if isinstance(prompt_wav, str):
+            if prompt_wav in self.url_index:
+                return self.url_index[prompt_wav]
+            if os.path.isfile(prompt_wav):
+                stat = os.stat(prompt_wav)
+                path_key = (prompt_wav, stat.st_mtime_ns, stat.st_size)
+                with self.lock:
+                    if path_key in self.path_index:
+                        self.path_index.move_to_end(path_key)
+                        return self.path_index[path_key]
+                sha1 = hashlib.sha1()
+                with open(prompt_wav, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        sha1.update(chunk)
+                with self.lock:
+                    self.path_index[path_key] = sha1.hexdigest()
+                    while len(self.path_index) > self.max_path_entries:
+                        self.path_index.popitem(last=False)
+                return sha1.hexdigest()
+        return None
+
+    def register_url(self, url, prompt_wav):
+        """Record that url points to the content of prompt_wav, return its hash."""
+        sha1 = self.audio_hash(prompt_wav)
+        with self.lock:
+            if self.url_index.get(url) == sha1:
+                self.url_index.move_to_end(url)
+                return sha1
+            self.url_index.pop(url, None)
+            self.url_index[url] = sha1
+            while len(self.url_index) > self.max_url_entries:
+                self.url_index.popitem(last=False)
+            if self.cache_dir is not None:
+                if self.url_index_lines >= 2 * self.max_url_entries:
+                    self._rewrite_url_index()
+                else:
+                    with open(os.path.join(self.cache_dir, 'url_index.jsonl'), 'a', encoding='utf8') as f:
+                        f.write(json.dumps({'url': url, 'sha1': sha1}, ensure_ascii=False) + '\n')
+                    self.url_index_lines += 1
+        return sha1
+
+    def _rewrite_url_index(self):
+        # called with self.lock held, drop the overwritten and evicted urls from url_index.jsonl
+        url_index_path = os.path.join(self.cache_dir, 'url_index.jsonl')
+        with open(url_index_path + '.tmp', 'w', encoding='utf8') as f:
+            for url, sha1 in self.url_index.items():
+                f.write(json.dumps({'url': url, 'sha1': sha1}, ensure_ascii=False) + '\n')
+        os.replace(url_index_path + '.tmp', url_index_path)
+        self.url_index_lines = len(self.url_index)
+
+    def get_url_feat(self, url, resample_rate):
+        """Return the cached features of url, None if it has to be downloaded.
+
+        The returned dict can be passed as prompt_wav, so later evictions do not affect the request holding it.
+        """
+        with self.lock:
+            sha1 = self.url_index.get(url)
+        if sha1 is None:
+            return None
+        return self.get_feat(sha1, resample_rate)
+
+    def get_feat(self, sha1, resample_rate):
+        key = (sha1, resample_rate)
+        with self.lock:
+            if key in self.feat_dict:
+                self.feat_dict.move_to_end(key)
+                self.hits += 1
+                return self.feat_dict[key]
+        value = None
+        if self.cache_dir is not None and os.path.exists(self._feat_path(key)):
+            try:
+                value = torch.load(self._feat_path(key), map_location=self.device, weights_only=True)
+            except OSError:
+                # evicted by another thread meanwhile
+                pass
+        if value is not None:
+            self._put_memory(key, value)
+            with self.lock:
+                self.hits += 1
+                self.disk_hits += 1
+                name = os.path.basename(self._feat_path(key))
+                if name in self.disk_dict:
+                    self.disk_dict.move_to_end(name)
+            return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put_feat(self, sha1, resample_rate, value):
+        key = (sha1, resample_rate)
+        self._put_memory(key, value)
+        if self.cache_dir is not None and not os.path.exists(self._feat_path(key)):
+            tmp_path = self._feat_path(key) + '.tmp{}'.format(threading.get_ident())
+            torch.save({k: v.cpu() for k, v in value.items()}, tmp_path)
+            os.replace(tmp_path, self._feat_path(key))
+            with self.lock:
+                name = os.path.basename(self._feat_path(key))
+                self.disk_bytes -= self.disk_dict.pop(name, 0)
+                self.disk_dict[name] = os.path.getsize(self._feat_path(key))
+                self.disk_bytes += self.disk_dict[name]
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # called with self.lock held
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk_dict) > 0:
+            name, size = self.disk_dict.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def _put_memory(self, key, value):
+        size = self._tensor_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.feat_dict:
+                self.feat_bytes -= self._tensor_bytes(self.feat_dict.pop(key))
+            self.feat_dict[key] = value
+            self.feat_bytes += size
+            while self.feat_bytes > self.max_bytes:
+                _, evicted = self.feat_dict.popitem(last=False)
+                self.feat_bytes -= self._tensor_bytes(evicted)
+
+    def get_text(self, text):
+        with self.lock:
+            if text in self.text_dict:
+                self.text_dict.move_to_end(text)
+                return self.text_dict[text]
+        return None
+
+    def put_text(self, text, value):
+        with self.lock:
+            self.text_dict[text] = value
+            while len(self.text_dict) > self.max_text_entries:
+                self.text_dict.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.feat_dict), 'bytes': self.feat_bytes, 'max_bytes': self.max_bytes,
+                    'text_entries': len(self.text_dict), 'urls': len(self.url_index),
+                    'disk_entries': len(self.disk_dict), 'disk_bytes': self.disk_bytes, 'max_disk_bytes': self.max_disk_bytes,
+                    'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
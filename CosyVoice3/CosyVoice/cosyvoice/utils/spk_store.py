@@ -0,0 +1,256 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+import os
+import json
+import mmap
+import struct
+import threading
+from collections import OrderedDict
+import torch
+from cosyvoice.utils.file_utils import logging
+
+
+class SpeakerStore:
+    """Persistent spk2info with one record per speaker, loaded lazily and kept in a device LRU backed by a host LRU.
+
+    The store is an append-only log, every record is a 4 byte header length, a json header {spk_id, length, deleted}
+    and `length` bytes of torch.save output. Adding or deleting a speaker appends one record instead of re-serializing
+    the whole spk2info.pt, startup only reads the headers and payloads are read through an mmap on first use. A
+    speaker lives in at most one memory tier: the max_device_entries most recently used on device, the next
+    max_host_entries on cpu, the rest only on disk. The log is compacted at startup and, in a background thread,
+    whenever the bytes of overwritten and deleted records exceed the live ones. Supports the dict operations the frontend uses on spk2info.
+    """
+
+    def __init__(self, path, device='cpu', max_device_entries=64, max_host_entries=1024, legacy_spk2info=''):
+        self.path = path
+        self.device = device
+        self.max_device_entries = max_device_entries
+        self.max_host_entries = max_host_entries
+        self.lock = threading.Lock()
+        self.compact_lock = threading.Lock()
+        self.compacting = False
+        # spk_id -> (payload offset, payload length)
+        self.index = {}
+        self.live_bytes, self.dead_bytes = 0, 0
+        self.device_dict = OrderedDict()
+        self.host_dict = OrderedDict()
+        self.mmap = None
+        self.hits, self.host_hits, self.disk_loads = 0, 0, 0
+        # NOTE only a missing log is initialized from spk2info.pt, an existing (even empty) log is the source of truth
+        if not os.path.exists(self.path) and os.path.exists(legacy_spk2info):
+            self._import_legacy(legacy_spk2info)
+        self._load_index()
+        if self.dead_bytes > self.live_bytes:
+            self.compact()
+        logging.info('speaker store {}, {} speakers'.format(path, len(self.index)))
+
+    def _load_index(self):
+        end = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                while end + 4 <= size:
+                    header_len, = struct.unpack('<I', f.read(4))
+                    if end + 4 + header_len > size:
+                        break
+                    header = json.loads(f.read(header_len))
+                    offset = end + 4 + header_len
+                    if offset + header['length'] > size:
+                        break
+                    if header['spk_id'] in self.index:
+                        self.live_bytes -= self.index[header['spk_id']][1]
+                        self.dead_bytes += self.index[header['spk_id']][1]
+                    if header.get('deleted', False):
+                        self.index.pop(header['spk_id'], None)
+                    else:
+                        self.index[header['spk_id']] = (offset, header['length'])
+                        self.live_bytes += header['length']
+                    end = offset + header['length']
+                    f.seek(end)
+            if end < size:
+                # NOTE a torn record of an interrupted write, cut it so that new records follow the last complete one
+                logging.warning('speaker store {} has {} trailing bytes of an incomplete record, truncate'.format(self.path, size - end))
+                os.truncate(self.path, end)
+        self.file = open(self.path, 'ab')
+
+    def _import_legacy(self, legacy_spk2info):
+        # the log is written aside and renamed, so an interrupted import leaves no log and is retried on next start
+        spk2info = torch.load(legacy_spk2info, map_location='cpu', weights_only=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for spk_id, value in spk2info.items():
+                f.write(self._record(spk_id, self._serialize(value))[0])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logging.info('imported {} speakers from {}'.format(len(spk2info), legacy_spk2info))
+
+    @classmethod
+    def _serialize(cls, value):
+        buffer = io.BytesIO()
+        torch.save(cls._to(value, 'cpu'), buffer)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _record(spk_id, data, deleted=False):
+        """Return the bytes of one log record and the offset of its payload within them."""
+        header = json.dumps({'spk_id': spk_id, 'length': len(data), 'deleted': deleted}, ensure_ascii=False).encode('utf8')
+        return struct.pack('<I', len(header)) + header + data, 4 + len(header)
+
+    def _append(self, spk_id, value, deleted=False):
+        data = b'' if deleted else self._serialize(value)
+        record, payload_offset = self._record(spk_id, data, deleted)
+        start = self.file.seek(0, os.SEEK_END)
+        self.file.write(record)
+        self.file.flush()
+        if spk_id in self.index:
+            self.live_bytes -= self.index[spk_id][1]
+            self.dead_bytes += self.index[spk_id][1]
+        if deleted:
+            self.index.pop(spk_id, None)
+        else:
+            self.index[spk_id] = (start + payload_offset, len(data))
+            self.live_bytes += len(data)
+        if self.dead_bytes > self.live_bytes and not self.compacting:
+            # rewriting the log is left to a background thread, the add/delete returns right away
+            self.compacting = True
+            threading.Thread(target=self._compact_in_background, name='spk_store_compact', daemon=True).start()
+
+    def _read(self, spk_id):
+        offset, length = self.index[spk_id]
+        if self.mmap is None or offset + length > len(self.mmap):
+            if self.mmap is not None:
+                self.mmap.close()
+            with open(self.path, 'rb') as f:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return torch.load(io.BytesIO(self.mmap[offset: offset + length]), map_location='cpu', weights_only=True)
+
+    @staticmethod
+    def _to(value, device):
+        return {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in value.items()}
+
+    def _put_device(self, spk_id, value):
+        self.device_dict[spk_id] = value
+        while len(self.device_dict) > self.max_device_entries:
+            evicted_id, evicted = self.device_dict.popitem(last=False)
+            self.host_dict[evicted_id] = self._to(evicted, 'cpu')
+        while len(self.host_dict) > self.max_host_entries:
+            self.host_dict.popitem(last=False)
+
+    def __getitem__(self, spk_id):
+        with self.lock:
+            if spk_id in self.device_dict:
+                self.device_dict.move_to_end(spk_id)
+                self.hits += 1
+                return self.device_dict[spk_id]
+            if spk_id in self.host_dict:
+                value = self.host_dict.pop(spk_id)
+                self.host_hits += 1
+            else:
+                value = self._read(spk_id)
+                self.disk_loads += 1
+            value = self._to(value, self.device)
+            self._put_device(spk_id, value)
+            return value
+
+    def __setitem__(self, spk_id, value):
+        with self.lock:
+            self._append(spk_id, value)
+            self.host_dict.pop(spk_id, None)
+            self._put_device(spk_id, self._to(value, self.device))
+
+    def __delitem__(self, spk_id):
+        with self.lock:
+            if spk_id not in self.index:
+                raise KeyError(spk_id)
+            self._append(spk_id, None, deleted=True)
+            self.device_dict.pop(spk_id, None)
+            self.host_dict.pop(spk_id, None)
+
+    def __contains__(self, spk_id):
+        return spk_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def compact(self):
+        """Rewrite the log with only the live records, the new log replaces the old one atomically.
+
+        The live records are copied without holding the lock, so lookups and writes go on meanwhile. The lock is only
+        taken to snapshot the index, and at the end to copy the records appended during the copy and swap the logs.
+        """
+        with self.compact_lock:
+            with self.lock:
+                self.file.flush()
+                snapshot, snapshot_end = dict(self.index), self.file.seek(0, os.SEEK_END)
+                snapshot_total = self.live_bytes + self.dead_bytes
+            tmp_path, moved = self.path + '.tmp', {}
+            with open(self.path, 'rb') as src, open(tmp_path, 'wb') as f:
+                data = mmap.mmap(src.fileno(), snapshot_end, access=mmap.ACCESS_READ) if snapshot_end > 0 else b''
+                for spk_id, (offset, length) in snapshot.items():
+                    record, payload_offset = self._record(spk_id, data[offset: offset + length])
+                    moved[spk_id] = f.tell() + payload_offset
+                    f.write(record)
+                if snapshot_end > 0:
+                    data.close()
+                f.flush()
+                os.fsync(f.fileno())
+                with self.lock:
+                    # records appended since the snapshot are complete and follow it unchanged
+                    self.file.flush()
+                    src.seek(snapshot_end)
+                    tail = src.read()
+                    tail_start = f.tell()
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    index = {}
+                    for spk_id, (offset, length) in self.index.items():
+                        # an entry before snapshot_end is the record the snapshot holds
+                        index[spk_id] = (offset - snapshot_end + tail_start if offset >= snapshot_end else moved[spk_id], length)
+                    self.file.close()
+                    if self.mmap is not None:
+                        self.mmap.close()
+                        self.mmap = None
+                    os.replace(tmp_path, self.path)
+                    self.file = open(self.path, 'ab')
+                    tail_bytes = self.live_bytes + self.dead_bytes - snapshot_total
+                    self.index = index
+                    self.dead_bytes = sum(length for _, length in snapshot.values()) + tail_bytes - self.live_bytes
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logging.error('compact speaker store {} failed: {}'.format(self.path, e))
+        finally:
+            with self.lock:
+                self.compacting = False
+
+    def stats(self):
+        with self.lock:
+            return {'speakers': len(self.index), 'device_entries': len(self.device_dict), 'host_entries': len(self.host_dict),
+                    'live_bytes': self.live_bytes, 'dead_bytes': self.dead_bytes,
+                    'hits': self.hits, 'host_hits': self.host_hits, 'disk_loads': self.disk_loads}
@@ -1,6 +1,6 @@
 import sys
 import os, io
-import json, time
+import json
 import logging, wave
 import asyncio
 from fastapi import HTTPException
@@ -21,18 +21,18 @@ from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, validator
 import requests
 from datetime import datetime
-import tempfile
+import uuid
 
 import sys
 sys.path.append('third_party/Matcha-TTS')
 from cosyvoice.cli.cosyvoice import AutoModel
-from cosyvoice.utils.file_utils import load_wav
 from cosyvoice.utils.common import set_all_random_seed
+from cosyvoice.utils.prompt_cache import PromptFeatureCache
 
 import torch
-import torchaudio
 
-from app.response import error_response,success_response
+from app.response import error_response,success_response,busy_response
+from app.executor import InferenceExecutor, InferenceBusyError
 from app.schemas import (
     ChatCompletionRequest, 
     TTSCloneRequest, 
@@ -41,7 +41,8 @@ from app.schemas import (
     TTSInstructRequest,
     TTSCrossLingualRequest
 )
-from app.utils import get_filename_from_url, download_file
+from app.utils import download_bytes
+from app.audio import MEDIA_TYPES, check_audio_format, encode_audio, iter_audio_stream
 
 Current_Dir = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(Current_Dir)
@@ -57,7 +58,12 @@ from vnet.common.tools.http_utils import multiple_download_async
 os.environ["CUDA_VISIBLE_DEVICES"] = "7"
 
 # 模型加载
-cosyvoice = AutoModel(model_dir='pretrained_models/Fun-CosyVoice3-0.5B-2512')
+cosyvoice = AutoModel(model_dir='pretrained_models/Fun-CosyVoice3-0.5B-2512',
+                      load_batch_engine=os.getenv("LLM_BATCH_ENGINE", "0") == "1")
+# 并发流式会话的 token2wav 合批执行
+if os.getenv("TOKEN2WAV_BATCH", "0") == "1" and cosyvoice.model.use_flow_cache():
+    cosyvoice.model.load_token2wav_batcher(max_batch_size=int(os.getenv("TOKEN2WAV_BATCH_SIZE", 8)),
+                                           window=float(os.getenv("TOKEN2WAV_BATCH_WINDOW_MS", 5)) / 1000)
 
 # 获取项目根目录的绝对路径，公共变量
 project_root = os.path.dirname(os.path.abspath(__file__))
@@ -66,6 +72,19 @@ upload_dir = os.path.join(project_root,"public","upload")
 sys.path.append(project_root)
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# prompt 音频特征缓存：相同 prompt 跳过下载与 speech tokenizer / campplus / mel 提取
+prompt_cache = PromptFeatureCache(max_bytes=int(os.getenv("PROMPT_CACHE_MB", 512)) * 1024 * 1024,
+                                  cache_dir=os.getenv("PROMPT_CACHE_DIR", os.path.join(project_root, "public", "prompt_cache")) or None,
+                                  max_disk_bytes=int(os.getenv("PROMPT_CACHE_DISK_MB", 4096)) * 1024 * 1024,
+                                  device=cosyvoice.frontend.device)
+cosyvoice.frontend.prompt_cache = prompt_cache
+# 音色库：最近使用的 SPK_DEVICE_CACHE 个音色常驻显存，其后 SPK_HOST_CACHE 个驻留内存，其余按需从磁盘读取
+cosyvoice.frontend.spk2info.max_device_entries = int(os.getenv("SPK_DEVICE_CACHE", 64))
+cosyvoice.frontend.spk2info.max_host_entries = int(os.getenv("SPK_HOST_CACHE", 1024))
+# 文本前端（正则化/分句/分词）多进程执行，避免与 LLM/flow 线程争抢 GIL，0 为在请求线程内执行
+if int(os.getenv("TEXT_FRONTEND_WORKERS", 0)) > 0:
+    cosyvoice.frontend.load_text_pool(int(os.getenv("TEXT_FRONTEND_WORKERS")))
+
 logger = logging.getLogger(__name__)
 
 # fastapi 框架层
@@ -97,6 +116,86 @@ def print_routes(app: FastAPI):
             methods = ", ".join(route.methods)
             print(f"{route.path} -> {methods}")
 
+# 推理执行器：固定数量的推理槽位 + 有界等待队列
+inference_executor = InferenceExecutor(num_slots=int(os.getenv("INFERENCE_SLOTS", 1)),
+                                       max_queue=int(os.getenv("INFERENCE_MAX_QUEUE", 16)))
+
+
+# 长文本分段流水线深度：>0 时下一段的前端与 LLM 解码与当前段的 token2wav 并行，0 为逐段串行
+TTS_PIPELINE = int(os.getenv("TTS_PIPELINE", 0))
+
+
+def synthesize_audio(inference_fn, response_format, sample_rate, *args, **kwargs):
+    """
+    在推理槽位中执行：收集分段音频并按 response_format / sample_rate 编码到内存，不落盘。
+
+    :return: 编码后的音频 bytes，未生成音频数据时返回 None。
+    """
+    kwargs.setdefault('pipeline', TTS_PIPELINE)
+    _segments = [j['tts_speech'] for j in inference_fn(*args, **kwargs)]
+    if len(_segments) == 0:
+        return None
+    return encode_audio(torch.cat(_segments, dim=1), cosyvoice.sample_rate, response_format, sample_rate)
+
+
+def audio_response(audio_bytes, response_format):
+    return Response(content=audio_bytes, media_type=MEDIA_TYPES[response_format])
+
+
+async def upload_audio(audio_bytes, response_format, **extra):
+    # 编码结果直接从内存上传，不写临时文件
+    upload_result = await minio_handler.upload_data_async(audio_bytes, f"tts_{uuid.uuid4().hex}.{response_format}",
+                                                          content_type=MEDIA_TYPES[response_format])
+    if upload_result.get("error"):
+        err = upload_result.get("error_str", "upload error")
+        logger.error(f"MinIO 上传失败: {err}")
+        return error_response(code=500, message=f"MinIO 上传失败: {err}")
+    minio_object_path = upload_result.get("minio_put_path")
+    minio_download_url = minio_handler.generate_download_url(minio_object_path)
+    return success_response(
+        data="ok",
+        message={
+            **extra,
+            "audio_url": minio_download_url,
+            "minio_path": minio_object_path
+        }
+    )
+
+
+async def download_prompt_file(prompt_file):
+    """
+    获取 prompt 音频：特征已缓存时直接返回特征 dict（前端直接使用，之后被淘汰也不影响本次请求），
+    否则下载到内存（不落盘）并登记 URL，返回音频 bytes。
+    """
+    prompt_feat = await asyncio.to_thread(prompt_cache.get_url_feat, prompt_file, cosyvoice.sample_rate)
+    if prompt_feat is not None:
+        logger.info(f"prompt cache hit: {prompt_file}")
+        return prompt_feat
+    prompt_bytes = await asyncio.to_thread(download_bytes, prompt_file)
+    if prompt_bytes is None:
+        return None
+    await asyncio.to_thread(prompt_cache.register_url, prompt_file, prompt_bytes)
+    return prompt_bytes
+
+
+# 推理队列状态
+@app.get("/tts/queue")
+def tts_queue_stats():
+    return success_response(data=inference_executor.stats())
+
+
+# prompt 特征缓存状态
+@app.get("/tts/prompt_cache")
+def tts_prompt_cache_stats():
+    return success_response(data=prompt_cache.stats())
+
+
+# 音色库状态
+@app.get("/tts_clone/spk/store")
+def tts_spk_store_stats():
+    return success_response(data=cosyvoice.frontend.spk2info.stats())
+
+
 # 音色列表
 @app.get("/tts_clone/spk/list")
 def tts_spk_list():
@@ -111,20 +210,23 @@ async def tts_spk_create(request: TTSCloneSpkRequest):
     voice_name = request.voice_name
     voice_id = voice_name + "_" +str(random.randint(1000, 9999))
     voice_file = request.voice_file
-    src_file_name = get_filename_from_url(voice_file)
-
-    voice_file_path = os.path.join(upload_dir,src_file_name)
-
-    if download_file(url=voice_file, destination_path=voice_file_path) == False:
+    voice_bytes = await asyncio.to_thread(download_bytes, voice_file)
+    if voice_bytes is None:
         return error_response(code=400,message=f"下载音色文件失败")
 
-    logger.info(f"spk download_file:{voice_file_path}")
+    logger.info(f"spk download_file:{voice_file}")
     logger.info(f"voice_name: {voice_name},voice_id:{voice_id}")
-    # add_zero_shot_spk 期望的是文件路径，不是 tensor
-    try:
-        assert cosyvoice.add_zero_shot_spk(input_text, voice_file_path, voice_id) is True
+
+    def add_spk():
+        # add_zero_shot_spk 直接接收内存中的音频 bytes，前端只解码一次
+        assert cosyvoice.add_zero_shot_spk(input_text, voice_bytes, voice_id) is True
         cosyvoice.save_spkinfo()
+
+    try:
+        await inference_executor.run(add_spk)
         return success_response(data="ok",message={"voice_id":voice_id,"list_spks":cosyvoice.list_available_spks()})
+    except InferenceBusyError as e:
+        return busy_response(e.retry_after)
     except Exception as e:
         logger.error(f"上传音色失败: {e}")
         return error_response(code=400,message=f"上传音色失败: {e}")
@@ -137,7 +239,8 @@ async def tts_spk_delete(request: TTSCloneDelRequest):
     if voice_id not in voices:
         return error_response(code=400,message=f"音色不存在: {voice_id}")
     try:
-        assert cosyvoice.delete_spk(voice_id) is True
+        # 删除会追加写音色库日志，放到线程中执行，不阻塞事件循环
+        assert await asyncio.to_thread(cosyvoice.delete_spk, voice_id) is True
         return success_response(data="ok",message={"list_spks":cosyvoice.list_available_spks()})
     except Exception as e:
         logger.error(f"删除音色 {e} 失败 ")
@@ -150,8 +253,12 @@ async def tts_clone_gen(request: TTSCloneRequest):
     prompt_text = request.prompt_text
     voice_id = request.voice_id
     prompt_file = request.prompt_file
+    response_format, sample_rate = request.response_format, request.sample_rate.value
     voices = cosyvoice.list_available_spks()
-    
+
+    format_error = check_audio_format(response_format, sample_rate)
+    if format_error is not None:
+        return error_response(code=400, message=format_error)
     if voice_id and voice_id not in voices:
         return error_response(code=400,message=f"音色不存在: {voice_id}")
     
@@ -159,82 +266,43 @@ async def tts_clone_gen(request: TTSCloneRequest):
     if not voice_id and not prompt_file:
         return error_response(code=400, message="需要提供 voice_id 或 prompt_file")
     
-    ts_int = int(time.time())
-    os.makedirs(download_dir, exist_ok=True)
-    tmp = tempfile.NamedTemporaryFile(prefix=f"zero_shot_{ts_int}_", suffix=".wav", dir=download_dir, delete=False)
-    WAV_FILE_PATH = tmp.name
-    tmp.close()
-
     logger.info(f"Received request with parameters: {request}")
 
-    # 收集分段音频并一次性保存，避免覆盖只保留最后一段
-    _segments = []
-    
     # 如果提供了 voice_id，使用已保存的音色
     if voice_id:
         # 使用已保存的音色，参考 example.py 中 CosyVoice2 的用法
         # 当使用 voice_id 时，prompt_text 和 prompt_wav 可以为空字符串
-        for _, j in enumerate(cosyvoice.inference_zero_shot(
-            input_text, 
-            '',  # prompt_text 为空，使用 voice_id
-            '',  # prompt_wav 为空，使用 voice_id
-            zero_shot_spk_id=voice_id, 
-            stream=False
-        )):
-            _segments.append(j['tts_speech'])
+        inference_args = (input_text, '', '')
+        inference_kwargs = {'zero_shot_spk_id': voice_id}
     else:
         # 使用 prompt_file，参考 example.py 中 CosyVoice3 的用法
-        # prompt_wav 应该传递文件路径，而不是加载后的 tensor
-        src_file_name = get_filename_from_url(prompt_file)
-        prompt_file_path = os.path.join(upload_dir, f"prompt_{ts_int}_{src_file_name}")
-        
-        if download_file(url=prompt_file, destination_path=prompt_file_path) == False:
+        # prompt_wav 为内存中的音频 bytes（或已缓存的特征 dict），不落盘
+        prompt_wav = await download_prompt_file(prompt_file)
+        if prompt_wav is None:
             return error_response(code=400, message=f"下载 prompt 文件失败")
-        
-        # 直接传递文件路径，inference_zero_shot 内部会处理
-        for _, j in enumerate(cosyvoice.inference_zero_shot(
-            input_text,
-            prompt_text,
-            prompt_file_path,  # 传递文件路径，不是 tensor
-            stream=False
-        )):
-            _segments.append(j['tts_speech'])
-    
-    if len(_segments) == 0:
-        return error_response(code=500, message="未生成任何音频数据")
-    full_audio = torch.cat(_segments, dim=1)
-    torchaudio.save(WAV_FILE_PATH, full_audio, cosyvoice.sample_rate)
+        inference_args = (input_text, prompt_text, prompt_wav)
+        inference_kwargs = {}
 
-    # 根据 output 返回
-    if getattr(request, "output", "file") == "file":
-        def iterfile():
-            with open(WAV_FILE_PATH, "rb") as f:
-                while chunk := f.read(1024):  # 逐块读取文件，每次读取 1024 字节
-                    yield chunk
-        return StreamingResponse(iterfile(), media_type="audio/wav")
-    elif request.output == "url":
-        upload_result = minio_handler.upload_file(file_path=WAV_FILE_PATH)
-        if upload_result.get("error"):
-            err = upload_result.get("error_str", "upload error")
-            logger.error(f"MinIO 上传失败: {err}")
-            return error_response(code=500, message=f"MinIO 上传失败: {err}")
-        minio_object_path = upload_result.get("minio_put_path")
-        minio_download_url = minio_handler.generate_download_url(minio_object_path)
-        return success_response(
-            data="ok",
-            message={
-                "voice_id": voice_id,
-                "audio_url": minio_download_url,
-                "minio_path": minio_object_path
-            }
-        )
+    try:
+        # 流式输出：模型每生成一个音频块就直接重采样、编码并发送，不落盘
+        if request.stream and getattr(request, "output", "file") == "file":
+            audio_stream = inference_executor.stream(
+                lambda: iter_audio_stream(cosyvoice.inference_zero_shot(*inference_args, **inference_kwargs, stream=True, pipeline=TTS_PIPELINE),
+                                          cosyvoice.sample_rate, response_format, sample_rate))
+            return StreamingResponse(audio_stream, media_type=MEDIA_TYPES[response_format])
+
+        audio_bytes = await inference_executor.run(synthesize_audio, cosyvoice.inference_zero_shot, response_format, sample_rate,
+                                                   *inference_args, **inference_kwargs, stream=False)
+        if audio_bytes is None:
+            return error_response(code=500, message="未生成任何音频数据")
+    except InferenceBusyError as e:
+        return busy_response(e.retry_after)
 
+    # 根据 output 返回
+    if request.output == "url":
+        return await upload_audio(audio_bytes, response_format, voice_id=voice_id)
     # 兜底：默认返回文件
-    def iterfile():
-        with open(WAV_FILE_PATH, "rb") as f:
-            while chunk := f.read(1024):
-                yield chunk
-    return StreamingResponse(iterfile(), media_type="audio/wav")
+    return audio_response(audio_bytes, response_format)
 
 # Instruct 模式
 @app.post("/tts/instruct")
@@ -242,121 +310,112 @@ async def tts_instruct(request: TTSInstructRequest):
     input_text = request.input
     instruct_text = request.instruct_text
     prompt_file = request.prompt_file
-    
+    response_format, sample_rate = request.response_format, request.sample_rate.value
+
+    format_error = check_audio_format(response_format, sample_rate)
+    if format_error is not None:
+        return error_response(code=400, message=format_error)
     if not prompt_file:
         return error_response(code=400, message="需要提供 prompt_file")
     
-    ts_int = int(time.time())
-    os.makedirs(download_dir, exist_ok=True)
-    src_file_name = get_filename_from_url(prompt_file)
-    prompt_file_path = os.path.join(upload_dir, f"prompt_{ts_int}_{src_file_name}")
-    
-    if download_file(url=prompt_file, destination_path=prompt_file_path) == False:
+    prompt_wav = await download_prompt_file(prompt_file)
+    if prompt_wav is None:
         return error_response(code=400, message=f"下载 prompt 文件失败")
-    
-    prompt_wav = load_wav(prompt_file_path, 16000)
-    
-    tmp = tempfile.NamedTemporaryFile(prefix=f"instruct_{ts_int}_", suffix=".wav", dir=download_dir, delete=False)
-    WAV_FILE_PATH = tmp.name
-    tmp.close()
 
     logger.info(f"Received instruct request: input={input_text}, instruct={instruct_text}")
 
-    _segments = []
-    for _, j in enumerate(cosyvoice.inference_instruct2(
-        input_text,
-        instruct_text,
-        prompt_wav,
-        stream=False
-    )):
-        _segments.append(j['tts_speech'])
-    
-    if len(_segments) == 0:
-        return error_response(code=500, message="未生成任何音频数据")
-    full_audio = torch.cat(_segments, dim=1)
-    torchaudio.save(WAV_FILE_PATH, full_audio, cosyvoice.sample_rate)
+    def synthesize():
+        # prompt_wav 传递音频 bytes（或已缓存的特征 dict），前端内部解码一次并提取特征
+        return synthesize_audio(cosyvoice.inference_instruct2, response_format, sample_rate,
+                                input_text, instruct_text, prompt_wav, stream=False)
+
+    try:
+        audio_bytes = await inference_executor.run(synthesize)
+        if audio_bytes is None:
+            return error_response(code=500, message="未生成任何音频数据")
+    except InferenceBusyError as e:
+        return busy_response(e.retry_after)
 
     if request.output == "url":
-        upload_result = minio_handler.upload_file(file_path=WAV_FILE_PATH)
-        if upload_result.get("error"):
-            err = upload_result.get("error_str", "upload error")
-            logger.error(f"MinIO 上传失败: {err}")
-            return error_response(code=500, message=f"MinIO 上传失败: {err}")
-        minio_object_path = upload_result.get("minio_put_path")
-        minio_download_url = minio_handler.generate_download_url(minio_object_path)
-        return success_response(
-            data="ok",
-            message={
-                "audio_url": minio_download_url,
-                "minio_path": minio_object_path
-            }
-        )
-    
-    def iterfile():
-        with open(WAV_FILE_PATH, "rb") as f:
-            while chunk := f.read(1024):
-                yield chunk
-    return StreamingResponse(iterfile(), media_type="audio/wav")
+        return await upload_audio(audio_bytes, response_format)
+    return audio_response(audio_bytes, response_format)
 
 # Cross-lingual 模式
 @app.post("/tts/cross_lingual")
 async def tts_cross_lingual(request: TTSCrossLingualRequest):
     input_text = request.input
     prompt_file = request.prompt_file
-    
+    response_format, sample_rate = request.response_format, request.sample_rate.value
+
+    format_error = check_audio_format(response_format, sample_rate)
+    if format_error is not None:
+        return error_response(code=400, message=format_error)
     if not prompt_file:
         return error_response(code=400, message="需要提供 prompt_file")
     
-    ts_int = int(time.time())
-    os.makedirs(download_dir, exist_ok=True)
-    src_file_name = get_filename_from_url(prompt_file)
-    prompt_file_path = os.path.join(upload_dir, f"prompt_{ts_int}_{src_file_name}")
-    
-    if download_file(url=prompt_file, destination_path=prompt_file_path) == False:
+    prompt_wav = await download_prompt_file(prompt_file)
+    if prompt_wav is None:
         return error_response(code=400, message=f"下载 prompt 文件失败")
-    
-    prompt_wav = load_wav(prompt_file_path, 16000)
-    
-    tmp = tempfile.NamedTemporaryFile(prefix=f"cross_lingual_{ts_int}_", suffix=".wav", dir=download_dir, delete=False)
-    WAV_FILE_PATH = tmp.name
-    tmp.close()
 
     logger.info(f"Received cross_lingual request: input={input_text}")
 
-    _segments = []
-    for _, j in enumerate(cosyvoice.inference_cross_lingual(
-        input_text,
-        prompt_wav,
-        stream=False
-    )):
-        _segments.append(j['tts_speech'])
-    
-    if len(_segments) == 0:
-        return error_response(code=500, message="未生成任何音频数据")
-    full_audio = torch.cat(_segments, dim=1)
-    torchaudio.save(WAV_FILE_PATH, full_audio, cosyvoice.sample_rate)
+    def synthesize():
+        # prompt_wav 传递音频 bytes（或已缓存的特征 dict），前端内部解码一次并提取特征
+        return synthesize_audio(cosyvoice.inference_cross_lingual, response_format, sample_rate,
+                                input_text, prompt_wav, stream=False)
+
+    try:
+        audio_bytes = await inference_executor.run(synthesize)
+        if audio_bytes is None:
+            return error_response(code=500, message="未生成任何音频数据")
+    except InferenceBusyError as e:
+        return busy_response(e.retry_after)
 
     if request.output == "url":
-        upload_result = minio_handler.upload_file(file_path=WAV_FILE_PATH)
-        if upload_result.get("error"):
-            err = upload_result.get("error_str", "upload error")
-            logger.error(f"MinIO 上传失败: {err}")
-            return error_response(code=500, message=f"MinIO 上传失败: {err}")
-        minio_object_path = upload_result.get("minio_put_path")
-        minio_download_url = minio_handler.generate_download_url(minio_object_path)
-        return success_response(
-            data="ok",
-            message={
-                "audio_url": minio_download_url,
-                "minio_path": minio_object_path
-            }
-        )
-    
-    def iterfile():
-        with open(WAV_FILE_PATH, "rb") as f:
-            while chunk := f.read(1024):
-                yield chunk
-    return StreamingResponse(iterfile(), media_type="audio/wav")
+        return await upload_audio(audio_bytes, response_format)
+    return audio_response(audio_bytes, response_format)
+
+# OpenAI 兼容语音合成，voice 为已保存的音色ID（兼容 "模型:音色ID" 写法）
+@app.post("/v1/audio/speech")
+async def audio_speech(request: ChatCompletionRequest):
+    input_text = request.input
+    voice_id = request.voice.split(":")[-1]
+    response_format, sample_rate = request.response_format, request.sample_rate.value
+
+    # OpenAI SDK 按 HTTP 状态码判断失败，错误不能以 200 返回，否则会被当作音频写入文件
+    format_error = check_audio_format(response_format, sample_rate)
+    if format_error is not None:
+        raise HTTPException(status_code=400, detail=format_error)
+    if not input_text:
+        raise HTTPException(status_code=400, detail="input 不能为空")
+    if voice_id not in cosyvoice.list_available_spks():
+        raise HTTPException(status_code=400, detail=f"音色不存在: {request.voice}")
+
+    logger.info(f"Received speech request with parameters: {request}")
+    gain = 10 ** (request.gain / 20)
+
+    def inference(stream=True, pipeline=TTS_PIPELINE):
+        # seed 为 0 时不固定随机种子
+        if request.seed:
+            set_all_random_seed(request.seed)
+        # 变速只支持非流式推理：speed != 1 时按文本分段推理，每段生成后仍立即编码发送
+        for j in cosyvoice.inference_zero_shot(input_text, '', '', zero_shot_spk_id=voice_id, stream=stream and request.speed == 1,
+                                               speed=request.speed, pipeline=pipeline):
+            yield {'tts_speech': (j['tts_speech'] * gain).clamp(-1, 1) if request.gain else j['tts_speech']}
+
+    try:
+        # 流式输出：首个 token_hop_len 音频块声码完成即编码为 mp3/opus 帧发送，不等整句合成结束
+        if request.stream:
+            audio_stream = inference_executor.stream(
+                lambda: iter_audio_stream(inference(), cosyvoice.sample_rate, response_format, sample_rate))
+            return StreamingResponse(audio_stream, media_type=MEDIA_TYPES[response_format])
+
+        audio_bytes = await inference_executor.run(synthesize_audio, inference, response_format, sample_rate, stream=False)
+    except InferenceBusyError as e:
+        return busy_response(e.retry_after)
+    if audio_bytes is None:
+        raise HTTPException(status_code=500, detail="未生成任何音频数据")
+    return audio_response(audio_bytes, response_format)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Response encoding of the api service, the previous wav temp file vs app.audio in memory encoding.
+
+A --seconds long 24k harmonic signal with a moving pitch stands for the model output. Reports the time and size of
+writing the native wav to a temp file and reading it back, of encode_audio for every response_format and sample rate,
+and of the incremental AudioEncoder fed with token_hop_len sized chunks (time to the first bytes and in total).
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import soundfile as sf
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.audio import AudioEncoder, encode_audio
+
+
+def model_output(seconds, sample_rate):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    f0 = 150 + 50 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    speech = sum(np.sin(k * phase) / k for k in range(1, 8)) * 0.2 * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+    return torch.from_numpy(speech.astype('float32')).reshape(1, -1)
+
+
+def wav_temp_file(speech, sample_rate):
+    # synthesize_to_file + wav_file_response before: save to disk, read it back to stream it
+    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
+        path = tmp.name
+    sf.write(path, speech.numpy().reshape(-1), sample_rate)
+    with open(path, 'rb') as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+def timeit(fn, repeat):
+    start_time = time.time()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.time() - start_time) / repeat
+
+
+def main(args):
+    sample_rate = 24000
+    speech = model_output(args.seconds, sample_rate)
+    data, cost = timeit(lambda: wav_temp_file(speech, sample_rate), args.repeat)
+    baseline = len(data)
+    print('{:24s} {:8.2f} ms {:8d} bytes'.format('wav 24000 temp file', cost * 1000, len(data)))
+    for response_format in ['wav', 'pcm', 'mp3', 'opus']:
+        for target_sample_rate in args.sample_rate:
+            if response_format == 'opus' and target_sample_rate not in (16000, 24000, 48000):
+                continue
+            data, cost = timeit(lambda: encode_audio(speech, sample_rate, response_format, target_sample_rate), args.repeat)
+            print('{:24s} {:8.2f} ms {:8d} bytes, {:5.1f}x smaller'.format('{} {} memory'.format(response_format, target_sample_rate),
+                                                                        cost * 1000, len(data), baseline / len(data)))
+    # CosyVoice3 token_hop_len 25 tokens -> 1 s of audio per chunk
+    chunk = int(args.chunk_seconds * sample_rate)
+    for response_format in ['wav', 'mp3', 'opus']:
+        encoder = AudioEncoder(response_format, sample_rate, 16000)
+        start_time, first, pieces = time.time(), None, []
+        for i in range(0, speech.shape[1], chunk):
+            pieces.append(encoder.encode(speech[:, i: i + chunk]))
+            if first is None and len(pieces[-1]) > 0:
+                first = time.time() - start_time
+        pieces.append(encoder.flush())
+        cost = time.time() - start_time
+        decoded, rate = sf.read(io.BytesIO(b''.join(pieces))) if response_format != 'mp3' else (None, 16000)
+        print('{:24s} first bytes {:.2f} ms, total {:.2f} ms, {} bytes{}'.format(
+            '{} 16000 stream'.format(response_format), first * 1000, cost * 1000, sum(len(p) for p in pieces),
+            '' if decoded is None else ', decoded {:.2f} s'.format(len(decoded) / rate)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--chunk_seconds', type=float, default=1)
+    parser.add_argument('--sample_rate', type=int, nargs='+', default=[24000, 16000])
+    parser.add_argument('--repeat', type=int, default=5)
+    main(parser.parse_args())
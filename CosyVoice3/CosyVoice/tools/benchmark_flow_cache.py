@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming token2wav flow cost, CausalMaskedDiffWithDiT.inference vs inference_chunk.
+
+Uses a randomly initialized flow (the default sizes are much smaller than Fun-CosyVoice3-0.5B so that it runs on cpu),
+reports the max abs difference of every chunk against the non-cached path and the time spent per utterance.
+"""
+import argparse
+import os
+import sys
+import time
+import torch
+from omegaconf import DictConfig
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.flow.flow import CausalMaskedDiffWithDiT
+from cosyvoice.flow.flow_matching import CausalConditionalCFM
+from cosyvoice.flow.DiT.dit import DiT
+from cosyvoice.transformer.upsample_encoder import PreLookaheadLayer
+
+
+def build_flow(args):
+    cfm_params = DictConfig({'sigma_min': 1e-06, 'solver': 'euler', 't_scheduler': 'cosine',
+                             'training_cfg_rate': 0.2, 'inference_cfg_rate': 0.7, 'reg_loss_type': 'l1'})
+    estimator = DiT(dim=args.dim, depth=args.depth, heads=args.heads, dim_head=args.dim // args.heads, ff_mult=2, mel_dim=80, mu_dim=80,
+                    spk_dim=80, out_channels=80, static_chunk_size=args.chunk_size * 2, num_decoding_left_chunks=-1)
+    decoder = CausalConditionalCFM(in_channels=240, cfm_params=cfm_params, n_spks=1, spk_emb_dim=80, estimator=estimator)
+    flow = CausalMaskedDiffWithDiT(input_size=80, output_size=80, spk_embed_dim=192, vocab_size=6561, input_frame_rate=25, token_mel_ratio=2,
+                                   pre_lookahead_len=3, pre_lookahead_layer=PreLookaheadLayer(in_channels=80, channels=args.dim, pre_lookahead_len=3),
+                                   decoder=decoder)
+    return flow.eval()
+
+
+def main(args):
+    torch.manual_seed(0)
+    flow = build_flow(args)
+    chunk_size, context_size = args.chunk_size, flow.pre_lookahead_len
+    token = torch.randint(0, 6561, size=(1, args.token_len))
+    prompt_token = torch.randint(0, 6561, size=(1, args.prompt_len))
+    prompt_feat = torch.rand(1, args.prompt_len * 2, 80)
+    embedding = torch.rand(1, 192)
+    # same chunking as CosyVoice2Model.tts, the first chunk is padded so that later chunks are aligned to static_chunk_size
+    prompt_token_pad = (chunk_size - args.prompt_len % chunk_size) % chunk_size
+    chunks, token_offset = [], 0
+    while True:
+        hop = chunk_size + prompt_token_pad if token_offset == 0 else chunk_size
+        if token_offset + hop + context_size > args.token_len:
+            break
+        chunks.append((token_offset, token_offset + hop + context_size, False))
+        token_offset += hop
+    chunks.append((token_offset, args.token_len, True))
+
+    outputs = {}
+    for name in ['inference', 'inference_chunk']:
+        start_time = time.time()
+        outputs[name], cache = [], None
+        for token_offset, token_end, finalize in chunks:
+            this_token = token[:, :token_end]
+            if name == 'inference':
+                feat, _ = flow.inference(this_token, torch.tensor([this_token.shape[1]]), prompt_token, torch.tensor([prompt_token.shape[1]]),
+                                         prompt_feat, torch.tensor([prompt_feat.shape[1]]), embedding, streaming=True, finalize=finalize)
+                feat = feat[:, :, token_offset * flow.token_mel_ratio:]
+            else:
+                if cache is None:
+                    cache = flow.setup_cache(prompt_token, prompt_feat, embedding, max_cache_len=args.max_cache_len)
+                feat, cache = flow.inference_chunk(this_token, token_offset, cache, finalize=finalize)
+            outputs[name].append(feat)
+        print('{:16s} {} chunks, {:.3f} s'.format(name, len(chunks), time.time() - start_time))
+    diff = max((a - b).abs().max().item() for a, b in zip(outputs['inference'], outputs['inference_chunk']))
+    print('max abs diff {:.3e}'.format(diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--heads', type=int, default=4)
+    parser.add_argument('--chunk_size', type=int, default=25, help='token hop len, static_chunk_size is chunk_size * token_mel_ratio')
+    parser.add_argument('--prompt_len', type=int, default=60)
+    parser.add_argument('--token_len', type=int, default=500)
+    parser.add_argument('--max_cache_len', type=int, default=None)
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Llm decode throughput vs concurrency, Qwen2LM.inference_wrapper with and without LLMBatchEngine.
+
+Uses a randomly initialized CosyVoice3LM whose qwen2 backbone is much smaller than Fun-CosyVoice3-0.5B so that it
+runs on cpu. Greedy decoding of both paths is compared first, then every session decodes exactly max_len tokens
+with ras_sampling and the aggregated tokens/s is reported for each concurrency.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.llm.llm import CosyVoice3LM, Qwen2Encoder
+from cosyvoice.llm.batch_engine import LLMBatchEngine
+from cosyvoice.utils.common import ras_sampling
+
+
+def build_llm(args, pretrain_path):
+    config = Qwen2Config(vocab_size=1024, hidden_size=args.hidden_size, intermediate_size=args.hidden_size * 4,
+                         num_hidden_layers=args.num_layers, num_attention_heads=args.num_heads, num_key_value_heads=args.num_kv_heads,
+                         max_position_embeddings=4096, tie_word_embeddings=False)
+    Qwen2ForCausalLM(config).save_pretrained(pretrain_path)
+    llm = CosyVoice3LM(llm_input_size=args.hidden_size, llm_output_size=args.hidden_size, speech_token_size=6561,
+                       llm=Qwen2Encoder(pretrain_path), sampling=ras_sampling)
+    return llm.eval()
+
+
+def greedy_sampling(weighted_scores, decoded_tokens, sampling):
+    return weighted_scores.argmax().item()
+
+
+def decode(llm, lm_input, min_len, max_len, uuid, results):
+    results[uuid] = list(llm.inference_wrapper(lm_input, 25, min_len, max_len, uuid))
+
+
+def run(llm, lm_inputs, min_len, max_len):
+    results = {}
+    threads = [threading.Thread(target=decode, args=(llm, lm_input, min_len, max_len, str(i), results)) for i, lm_input in enumerate(lm_inputs)]
+    start_time = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [results[str(i)] for i in range(len(lm_inputs))], time.time() - start_time
+
+
+def main(args):
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as pretrain_path:
+        llm = build_llm(args, pretrain_path)
+    lm_inputs = [torch.randn(1, args.prompt_len + i * 7, args.hidden_size) for i in range(max(args.concurrency))]
+    engine = LLMBatchEngine(llm, max_batch_size=max(args.concurrency), max_seq_len=args.prompt_len + max(args.concurrency) * 7 + args.max_len)
+
+    llm.sampling = greedy_sampling
+    reference, _ = run(llm, lm_inputs[:4], 0, args.max_len)
+    llm.batch_engine = engine
+    batched, _ = run(llm, lm_inputs[:4], 0, args.max_len)
+    del llm.batch_engine
+    print('greedy decode {} sessions, tokens identical {}, lengths {}'.format(len(reference), reference == batched, [len(r) for r in reference]))
+
+    llm.sampling = ras_sampling
+    for concurrency in args.concurrency:
+        for name in ['inference_wrapper', 'batch_engine']:
+            if name == 'batch_engine':
+                llm.batch_engine = engine
+            outputs, cost = run(llm, lm_inputs[:concurrency], args.max_len, args.max_len)
+            if name == 'batch_engine':
+                del llm.batch_engine
+            token_num = sum(len(o) for o in outputs)
+            print('{:18s} concurrency {:2d} {} tokens, {:.3f} s, {:.1f} tokens/s'.format(name, concurrency, token_num, cost, token_num / cost))
+    print('engine stats {}'.format(engine.stats()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hidden_size', type=int, default=256)
+    parser.add_argument('--num_layers', type=int, default=4)
+    parser.add_argument('--num_heads', type=int, default=4)
+    parser.add_argument('--num_kv_heads', type=int, default=2)
+    parser.add_argument('--prompt_len', type=int, default=200)
+    parser.add_argument('--max_len', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    main(parser.parse_args())
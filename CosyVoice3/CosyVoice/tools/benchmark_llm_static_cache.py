@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Single session llm decode speed on cpu, HF past_key_values vs the static kv cache of Qwen2Encoder.
+
+Uses the same randomly initialized CosyVoice3LM as benchmark_llm_batch_engine.py, greedy decodes max_len tokens with
+eos ignored and reports tokens/s of forward_one_step (the previous inference_wrapper loop), forward_one_step_static and
+forward_one_step_static under torch.compile, together with whether the decoded tokens are identical.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark_llm_batch_engine import build_llm
+
+
+def decode_dynamic(llm, lm_input, max_len):
+    out_tokens, cache = [], None
+    for i in range(max_len):
+        y_pred, cache = llm.llm.forward_one_step(lm_input,
+                                                 masks=torch.tril(torch.ones((1, lm_input.shape[1], lm_input.shape[1]), device=lm_input.device)).to(torch.bool),
+                                                 cache=cache)
+        top_ids = llm.llm_decoder(y_pred[:, -1]).argmax(dim=-1).item()
+        out_tokens.append(top_ids)
+        lm_input = llm.speech_embedding.weight[top_ids].reshape(1, 1, -1)
+    return out_tokens
+
+
+def decode_static(llm, lm_input, max_len):
+    out_tokens = []
+    cache, offset = llm.llm.init_static_cache(lm_input.shape[1] + max_len, lm_input.device, lm_input.dtype), 0
+    for i in range(max_len):
+        y_pred = llm.llm.forward_one_step_static(lm_input, cache, offset)
+        offset += lm_input.shape[1]
+        top_ids = llm.llm_decoder(y_pred[:, -1]).argmax(dim=-1).item()
+        out_tokens.append(top_ids)
+        lm_input = llm.speech_embedding.weight[top_ids].reshape(1, 1, -1)
+    return out_tokens
+
+
+def main(args):
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as pretrain_path:
+        llm = build_llm(args, pretrain_path)
+    lm_input = torch.randn(1, args.prompt_len, args.hidden_size)
+    names = ['forward_one_step', 'forward_one_step_static'] + (['forward_one_step_static_compile'] if args.compile else [])
+    outputs = {}
+    with torch.inference_mode():
+        for name in names:
+            if name == 'forward_one_step_static_compile':
+                llm.llm.compile_static_step()
+                decode_static(llm, lm_input, 8)
+            decode_fn = decode_dynamic if name == 'forward_one_step' else decode_static
+            start_time = time.time()
+            outputs[name] = decode_fn(llm, lm_input, args.max_len)
+            cost = time.time() - start_time
+            print('{:32s} {} tokens, {:.3f} s, {:.1f} tokens/s, tokens identical {}'.format(
+                name, args.max_len, cost, args.max_len / cost, outputs[name] == outputs['forward_one_step']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hidden_size', type=int, default=256)
+    parser.add_argument('--num_layers', type=int, default=4)
+    parser.add_argument('--num_heads', type=int, default=4)
+    parser.add_argument('--num_kv_heads', type=int, default=2)
+    parser.add_argument('--prompt_len', type=int, default=200)
+    parser.add_argument('--max_len', type=int, default=500)
+    parser.add_argument('--compile', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Multi segment synthesis time of CosyVoice.synthesis with pipeline=0 (serial) and pipeline>0.
+
+The llm/flow/hift are the fixed cost modules of benchmark_stream_latency.py, the token number of every segment
+depends on its text length so that the output order can be checked.
+"""
+import argparse
+import os
+import sys
+import time
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.cli.cosyvoice import CosyVoice2
+from cosyvoice.cli.model import CosyVoice2Model
+from benchmark_stream_latency import FakeFlow, FakeHift
+
+
+class FakeLLM(torch.nn.Module):
+
+    def __init__(self, token_interval):
+        super().__init__()
+        self.token_interval = token_interval
+
+    def inference(self, text, **kwargs):
+        for i in range(text.shape[1] * 5):
+            time.sleep(self.token_interval)
+            yield i % 4096
+
+
+def main(args):
+    cosyvoice = object.__new__(CosyVoice2)
+    cosyvoice.sample_rate = 24000
+    cosyvoice.model = CosyVoice2Model(FakeLLM(args.token_interval), FakeFlow(args.flow_cost), FakeHift(args.hift_cost))
+    segments = ['segment {}'.format(i) * (i % 3 + 2) for i in range(args.segment_num)]
+
+    def frontend_fn(text):
+        time.sleep(args.frontend_cost)
+        return {'text': torch.zeros(1, len(text), dtype=torch.int32)}
+
+    lengths = {}
+    for pipeline in args.pipeline:
+        start_time = time.time()
+        lengths[pipeline] = [o['tts_speech'].shape[1] for o in cosyvoice.synthesis(segments, frontend_fn, stream=args.stream, pipeline=pipeline)]
+        print('pipeline {} stream {} {} segments {:.3f} s, same output order {}'.format(
+            pipeline, args.stream, len(segments), time.time() - start_time, lengths[pipeline] == lengths[args.pipeline[0]]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segment_num', type=int, default=8)
+    parser.add_argument('--token_interval', type=float, default=0.002)
+    parser.add_argument('--frontend_cost', type=float, default=0.02)
+    parser.add_argument('--flow_cost', type=float, default=0.2)
+    parser.add_argument('--hift_cost', type=float, default=0.05)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--pipeline', type=int, nargs='+', default=[0, 1, 2])
+    main(parser.parse_args())
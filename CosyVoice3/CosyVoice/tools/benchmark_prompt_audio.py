@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Prompt audio preprocessing time, three load_wav calls with a fresh Resample each vs CosyVoiceFrontEnd._load_prompt_wav.
+
+A random stereo prompt is written to a wav file at every sample rate in --sample_rate, then the 16k and 24k views are
+produced by the previous frontend loading (decode + downmix + new Resample per extractor) and by the single decode with
+cached resampler kernels, from the file path and from the encoded bytes. Reports the time per prompt and the max abs
+difference of the views.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import torch
+import torchaudio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.cli.frontend import CosyVoiceFrontEnd
+
+
+def load_wav_reference(wav, target_sr):
+    speech, sample_rate = torchaudio.load(wav, backend='soundfile')
+    speech = speech.mean(dim=0, keepdim=True)
+    if sample_rate != target_sr:
+        speech = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=target_sr)(speech)
+    return speech
+
+
+def load_reference(wav):
+    # _extract_speech_feat, _extract_speech_token and _extract_spk_embedding each loaded the prompt
+    speech_24k = load_wav_reference(wav, 24000)
+    speech_16k = load_wav_reference(wav, 16000)
+    load_wav_reference(wav, 16000)
+    return speech_16k, speech_24k
+
+
+def main(args):
+    torch.manual_seed(0)
+    frontend = object.__new__(CosyVoiceFrontEnd)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for sample_rate in args.sample_rate:
+            path = os.path.join(tmp_dir, '{}.wav'.format(sample_rate))
+            torchaudio.save(path, torch.rand(2, int(args.duration * sample_rate)) * 0.2 - 0.1, sample_rate, backend='soundfile')
+            with open(path, 'rb') as f:
+                data = f.read()
+            results = {}
+            for name, load_fn, wav in [('load_wav x3', load_reference, path),
+                                       ('_load_prompt_wav path', frontend._load_prompt_wav, path),
+                                       ('_load_prompt_wav bytes', frontend._load_prompt_wav, data)]:
+                load_fn(wav)
+                start_time = time.time()
+                for _ in range(args.repeat):
+                    results[name] = load_fn(wav)
+                cost = (time.time() - start_time) / args.repeat
+                diff = max((a - b).abs().max().item() for a, b in zip(results[name], results['load_wav x3']))
+                print('{:6d} Hz {:24s} {:.2f} ms/prompt, max abs diff {:.3e}'.format(sample_rate, name, cost * 1000, diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sample_rate', type=int, nargs='+', default=[16000, 22050, 44100, 48000])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""spk2info persistence with many cloned speakers, the previous whole-dict spk2info.pt vs SpeakerStore.
+
+Every speaker is a random frontend_zero_shot record of a --prompt_seconds prompt. Reports the time of one more
+create (torch.save of the whole dict vs one append), of a delete, of startup (torch.load of the whole dict vs
+reading the record headers), of the first and repeated access to a speaker, and checks that a reopened store returns
+the same tensors.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.utils.spk_store import SpeakerStore
+
+
+def random_speaker(prompt_seconds):
+    token_len, text_len = int(prompt_seconds * 25), int(prompt_seconds * 4)
+    return {'prompt_text': torch.randint(0, 151643, (1, text_len), dtype=torch.int32), 'prompt_text_len': torch.tensor([text_len], dtype=torch.int32),
+            'llm_prompt_speech_token': torch.randint(0, 6561, (1, token_len), dtype=torch.int32),
+            'llm_prompt_speech_token_len': torch.tensor([token_len], dtype=torch.int32),
+            'flow_prompt_speech_token': torch.randint(0, 6561, (1, token_len), dtype=torch.int32),
+            'flow_prompt_speech_token_len': torch.tensor([token_len], dtype=torch.int32),
+            'prompt_speech_feat': torch.randn(1, token_len * 2, 80), 'prompt_speech_feat_len': torch.tensor([token_len * 2], dtype=torch.int32),
+            'llm_embedding': torch.randn(1, 192), 'flow_embedding': torch.randn(1, 192)}
+
+
+def timeit(fn):
+    start_time = time.time()
+    result = fn()
+    return result, time.time() - start_time
+
+
+def main(args):
+    torch.manual_seed(0)
+    spk2info = {'spk_{}'.format(i): random_speaker(args.prompt_seconds) for i in range(args.num_speakers)}
+    new_speaker = random_speaker(args.prompt_seconds)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_path = os.path.join(tmp_dir, 'spk2info.pt')
+        torch.save(spk2info, legacy_path)
+        print('{} speakers, spk2info.pt {:.1f} MB'.format(args.num_speakers, os.path.getsize(legacy_path) / 1024 / 1024))
+
+        legacy, cost = timeit(lambda: torch.load(legacy_path, weights_only=True))
+        print('spk2info.pt   startup {:.3f} s'.format(cost))
+        legacy['new'] = new_speaker
+        _, cost = timeit(lambda: torch.save(legacy, legacy_path))
+        print('spk2info.pt   create  {:.3f} s'.format(cost))
+        del legacy['new']
+        _, cost = timeit(lambda: torch.save(legacy, legacy_path))
+        print('spk2info.pt   delete  {:.3f} s'.format(cost))
+
+        store_path = os.path.join(tmp_dir, 'spk2info.store')
+        _, cost = timeit(lambda: SpeakerStore(store_path, legacy_spk2info=legacy_path))
+        print('SpeakerStore  import of spk2info.pt {:.3f} s'.format(cost))
+        store, cost = timeit(lambda: SpeakerStore(store_path, max_device_entries=args.max_device_entries, max_host_entries=args.max_host_entries))
+        print('SpeakerStore  startup {:.3f} s'.format(cost))
+        _, cost = timeit(lambda: store.__setitem__('new', new_speaker))
+        print('SpeakerStore  create  {:.6f} s'.format(cost))
+        _, cost = timeit(lambda: store.__delitem__('new'))
+        print('SpeakerStore  delete  {:.6f} s'.format(cost))
+        _, cold = timeit(lambda: store['spk_0'])
+        _, warm = timeit(lambda: store['spk_0'])
+        print('SpeakerStore  first access {:.6f} s, repeated {:.6f} s'.format(cold, warm))
+        for i in range(args.num_speakers):
+            store['spk_{}'.format(i)]
+        print('SpeakerStore  stats after touching every speaker {}'.format(store.stats()))
+
+        reopened = SpeakerStore(store_path)
+        identical = all(torch.equal(reopened[spk_id][k], spk2info[spk_id][k]) for spk_id in spk2info for k in spk2info[spk_id])
+        print('reopened store has {} speakers, identical {}'.format(len(reopened), identical and 'new' not in reopened))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_speakers', type=int, default=1000)
+    parser.add_argument('--prompt_seconds', type=float, default=10)
+    parser.add_argument('--max_device_entries', type=int, default=64)
+    parser.add_argument('--max_host_entries', type=int, default=256)
+    main(parser.parse_args())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming first-chunk latency of CosyVoice2Model.tts on the CPU path.
+
+The llm/flow/hift are replaced by lightweight modules with a fixed per-token / per-call cost, so the numbers only
+reflect the scheduling between llm_job and token2wav. `polling` reproduces the previous 100 ms sleep loop.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import numpy as np
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.cli.model import CosyVoice2Model
+
+
+class FakeLLM(torch.nn.Module):
+
+    def __init__(self, token_num, token_interval):
+        super().__init__()
+        self.token_num = token_num
+        self.token_interval = token_interval
+
+    def inference(self, **kwargs):
+        for i in range(self.token_num):
+            time.sleep(self.token_interval)
+            yield i % 4096
+
+
+class FakeFlow(torch.nn.Module):
+    input_frame_rate = 25
+    token_mel_ratio = 2
+    pre_lookahead_len = 3
+
+    def __init__(self, call_cost):
+        super().__init__()
+        self.call_cost = call_cost
+
+    def inference(self, token, prompt_feat, **kwargs):
+        time.sleep(self.call_cost)
+        return torch.zeros(1, 80, prompt_feat.shape[1] + token.shape[1] * self.token_mel_ratio), None
+
+
+class FakeHift(torch.nn.Module):
+
+    def __init__(self, call_cost):
+        super().__init__()
+        self.call_cost = call_cost
+
+    def inference(self, speech_feat, cache_source=torch.zeros(1, 1, 0), **kwargs):
+        time.sleep(self.call_cost)
+        return torch.zeros(1, speech_feat.shape[2] * 480), torch.zeros(1, 1, speech_feat.shape[2] * 480)
+
+
+class PollingCosyVoice2Model(CosyVoice2Model):
+
+    def wait_speech_token(self, uuid, token_len):
+        time.sleep(0.1)
+
+
+def run_session(model, results):
+    start_time = time.time()
+    first_chunk = None
+    for _ in model.tts(text=torch.zeros(1, 10, dtype=torch.int32), stream=True):
+        if first_chunk is None:
+            first_chunk = time.time() - start_time
+    results.append((first_chunk, time.time() - start_time))
+
+
+def main(args):
+    for name, model_cls in [('polling', PollingCosyVoice2Model), ('event', CosyVoice2Model)]:
+        model = model_cls(FakeLLM(args.token_num, args.token_interval), FakeFlow(args.flow_cost), FakeHift(args.hift_cost))
+        results = []
+        threads = [threading.Thread(target=run_session, args=(model, results)) for _ in range(args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        first_chunk = np.array([r[0] for r in results]) * 1000
+        total = np.array([r[1] for r in results]) * 1000
+        print('{:8s} concurrency {} first chunk mean {:.1f} ms p90 {:.1f} ms, total mean {:.1f} ms'.format(
+            name, args.concurrency, first_chunk.mean(), np.percentile(first_chunk, 90), total.mean()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--token_num', type=int, default=200)
+    parser.add_argument('--token_interval', type=float, default=0.002)
+    parser.add_argument('--flow_cost', type=float, default=0.01)
+    parser.add_argument('--hift_cost', type=float, default=0.005)
+    parser.add_argument('--concurrency', type=int, default=4)
+    main(parser.parse_args())
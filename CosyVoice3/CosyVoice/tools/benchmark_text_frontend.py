@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Text frontend time on a long zh and en document, the previous split_paragraph vs the incremental one, and
+CosyVoiceFrontEnd.text_normalize / _extract_text_token on a cold and a warm cache.
+
+The whisper multilingual tiktoken tokenizer of cosyvoice.tokenizer is used so that no pretrained model is needed,
+text normalization uses wetext when it is installed. build_frontend is shared with benchmark_text_frontend_pool.py.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+from functools import partial
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.cli.frontend import CosyVoiceFrontEnd
+from cosyvoice.tokenizer.tokenizer import get_tokenizer
+from cosyvoice.utils.frontend_utils import split_paragraph
+
+ZH_SENTENCES = ['今天是2024年3月5日，天气晴朗，温度大约25度。', '我们在会议上讨论了新产品的设计方案', '你觉得这个价格合理吗？',
+                '请在明天下午三点之前把报告发给我！', '这个项目一共有12个人参与，预计需要3个月完成；']
+EN_SENTENCES = ['The meeting was moved to 3 pm on Friday because of the holiday.', 'Could you send me the report before tomorrow',
+                'It costs about 25 dollars, which is cheaper than we expected!', 'There were 12 people working on the project for 3 months;',
+                'She said "we will ship it next week."']
+
+
+def split_paragraph_reference(text, tokenize, lang="zh", token_max_n=80, token_min_n=60, merge_len=20, comma_split=False):
+    # split_paragraph before it measured every sentence once, kept to compare speed and output
+    def calc_utt_length(_text):
+        return len(_text) if lang == "zh" else len(tokenize(_text))
+
+    pounc = ['。', '？', '！', '；', '：', '、', '.', '?', '!', ';'] if lang == "zh" else ['.', '?', '!', ';', ':']
+    if comma_split:
+        pounc.extend(['，', ','])
+    if text[-1] not in pounc:
+        text += "。" if lang == "zh" else "."
+    st, utts = 0, []
+    for i, c in enumerate(text):
+        if c in pounc:
+            if len(text[st: i]) > 0:
+                utts.append(text[st: i] + c)
+            if i + 1 < len(text) and text[i + 1] in ['"', '”']:
+                utts.append(utts.pop(-1) + text[i + 1])
+                st = i + 2
+            else:
+                st = i + 1
+    final_utts, cur_utt = [], ""
+    for utt in utts:
+        if calc_utt_length(cur_utt + utt) > token_max_n and calc_utt_length(cur_utt) > token_min_n:
+            final_utts.append(cur_utt)
+            cur_utt = ""
+        cur_utt = cur_utt + utt
+    if len(cur_utt) > 0:
+        if calc_utt_length(cur_utt) < merge_len and len(final_utts) != 0:
+            final_utts[-1] = final_utts[-1] + cur_utt
+        else:
+            final_utts.append(cur_utt)
+    return final_utts
+
+
+def build_document(sentences, num_chars, separator):
+    rng, text = random.Random(0), ''
+    while len(text) < num_chars:
+        text += rng.choice(sentences) + separator
+    return text.strip()
+
+
+def build_frontend(text_pool_workers=0):
+    # skip the onnx sessions of CosyVoiceFrontEnd.__init__, only the text part is benchmarked
+    frontend = object.__new__(CosyVoiceFrontEnd)
+    frontend.get_tokenizer = partial(get_tokenizer, multilingual=True, num_languages=100, language='en', task='transcribe')
+    frontend.tokenizer = frontend.get_tokenizer()
+    frontend.allowed_special, frontend.device = 'all', 'cpu'
+    frontend.text_pool, frontend.pool_tokens = None, OrderedDict()
+    frontend._load_text_frontend()
+    if text_pool_workers > 0:
+        frontend.load_text_pool(text_pool_workers)
+    return frontend
+
+
+def timeit(fn, repeat=1):
+    start_time = time.time()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.time() - start_time) / repeat
+
+
+def main(args):
+    frontend = build_frontend()
+    tokenize = partial(frontend.tokenizer.encode, allowed_special='all')
+    print('text frontend {!r}'.format(frontend.text_frontend))
+    for lang, sentences, separator in [('zh', ZH_SENTENCES, ''), ('en', EN_SENTENCES, ' ')]:
+        text = build_document(sentences, args.num_chars, separator)
+        reference, reference_cost = timeit(lambda: split_paragraph_reference(text, tokenize, lang))
+        result, cost = timeit(lambda: split_paragraph(text, tokenize, lang))
+        print('{} {} chars split_paragraph previous {:.3f} s, incremental {:.3f} s, {} segments, identical {}'.format(
+            lang, len(text), reference_cost, cost, len(result), result == reference))
+        texts, cold_cost = timeit(lambda: frontend.text_normalize(text))
+        _, warm_cost = timeit(lambda: frontend.text_normalize(text), args.repeat)
+        print('{} text_normalize cold {:.3f} s, warm {:.6f} s'.format(lang, cold_cost, warm_cost))
+        _, cold_cost = timeit(lambda: [frontend._extract_text_token(t) for t in texts])
+        _, warm_cost = timeit(lambda: [frontend._extract_text_token(t) for t in texts], args.repeat)
+        print('{} _extract_text_token of {} segments cold {:.4f} s, warm {:.4f} s'.format(lang, len(texts), cold_cost, warm_cost))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_chars', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=10)
+    main(parser.parse_args())
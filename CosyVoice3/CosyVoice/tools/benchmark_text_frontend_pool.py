@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Concurrent text frontend throughput and decode thread stalls, text_normalize in the request threads vs TextFrontendPool.
+
+--concurrency threads each run text_normalize + _extract_text_token on their own document (so the caches never hit)
+while a decode thread runs small torch steps like the llm of CosyVoiceModel.tts. Reports the wall time of all requests,
+whether the segments and tokens are identical, and the number and mean / max step time of decode steps.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import torch
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from benchmark_text_frontend import ZH_SENTENCES, EN_SENTENCES, build_document, build_frontend
+
+
+def decode_loop(stop, step_costs):
+    x, w = torch.randn(1, 256), torch.randn(256, 256)
+    while not stop.is_set():
+        start_time = time.time()
+        for _ in range(20):
+            x = torch.tanh(x @ w)
+        step_costs.append(time.time() - start_time)
+
+
+def run(frontend, texts):
+    results = [None] * len(texts)
+
+    def request(i):
+        segments = frontend.text_normalize(texts[i])
+        results[i] = (segments, [frontend._extract_text_token(j)[0].tolist() for j in segments])
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(texts))]
+    stop, step_costs = threading.Event(), []
+    decode = threading.Thread(target=decode_loop, args=(stop, step_costs))
+    decode.start()
+    start_time = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cost = time.time() - start_time
+    stop.set()
+    decode.join()
+    return results, cost, step_costs
+
+
+def main(args):
+    torch.set_num_threads(1)
+    texts = [build_document(ZH_SENTENCES, args.num_chars, '') if i % 2 == 0 else build_document(EN_SENTENCES, args.num_chars, ' ')
+             for i in range(args.concurrency)]
+    outputs = {}
+    for workers in [0] + args.workers:
+        # a new frontend and pool for every run, so that no normalization cache is warm
+        frontend = build_frontend(workers)
+        results, cost, step_costs = run(frontend, texts)
+        outputs[workers] = results
+        name = 'request threads' if workers == 0 else 'pool {} workers'.format(workers)
+        print('{:16s} {} requests of {} chars {:.3f} s, identical {}, decode steps {} mean {:.2f} ms max {:.2f} ms'.format(
+            name, args.concurrency, args.num_chars, cost, results == outputs[0],
+            len(step_costs), sum(step_costs) / len(step_costs) * 1000, max(step_costs) * 1000))
+        if frontend.text_pool is not None:
+            frontend.text_pool.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_chars', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    main(parser.parse_args())
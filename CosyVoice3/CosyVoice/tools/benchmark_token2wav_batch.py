@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Streaming token2wav of concurrent sessions, CosyVoice3Model.tts with and without load_token2wav_batcher.
+
+The llm is replaced by a module which yields random speech tokens, flow and hift are randomly initialized and much
+smaller than Fun-CosyVoice3-0.5B so that it runs on cpu. Reports the wall time of all sessions and the max abs
+difference of every session against its unbatched output.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cosyvoice.cli.model import CosyVoice3Model
+from cosyvoice.hifigan.generator import CausalHiFTGenerator
+from cosyvoice.hifigan.f0_predictor import CausalConvRNNF0Predictor
+from benchmark_flow_cache import build_flow
+
+
+class FakeLLM(torch.nn.Module):
+
+    def __init__(self, token_num):
+        super().__init__()
+        self.token_num = token_num
+
+    def inference(self, text, **kwargs):
+        # text[0, 0] is the session index, so that every session gets the same tokens in both runs
+        generator = torch.Generator().manual_seed(int(text[0, 0]))
+        for i in torch.randint(0, 6561, size=(self.token_num,), generator=generator).tolist():
+            yield i
+
+
+def build_hift(args):
+    hift = CausalHiFTGenerator(in_channels=80, base_channels=args.hift_channels, nb_harmonics=8, sampling_rate=24000,
+                               upsample_rates=[8, 5, 3], upsample_kernel_sizes=[16, 11, 7], istft_params={'n_fft': 16, 'hop_len': 4},
+                               resblock_kernel_sizes=[3, 7, 11], resblock_dilation_sizes=[[1, 3, 5], [1, 3, 5], [1, 3, 5]],
+                               source_resblock_kernel_sizes=[7, 7, 11], source_resblock_dilation_sizes=[[1, 3, 5], [1, 3, 5], [1, 3, 5]],
+                               conv_pre_look_right=4, f0_predictor=CausalConvRNNF0Predictor(num_class=1, in_channels=80, cond_channels=args.hift_channels))
+    return hift.eval()
+
+
+def run_session(model, index, prompt_len, results):
+    generator = torch.Generator().manual_seed(1000 + index)
+    speech = []
+    for output in model.tts(text=torch.full((1, 10), index, dtype=torch.int32),
+                            flow_embedding=torch.rand(1, 192, generator=generator),
+                            flow_prompt_speech_token=torch.randint(0, 6561, size=(1, prompt_len), generator=generator),
+                            prompt_speech_feat=torch.rand(1, prompt_len * 2, 80, generator=generator),
+                            stream=True):
+        speech.append(output['tts_speech'])
+    results[index] = torch.concat(speech, dim=1)
+
+
+def main(args):
+    torch.manual_seed(0)
+    model = CosyVoice3Model(FakeLLM(args.token_num), build_flow(args), build_hift(args))
+    outputs = {}
+    for name in ['token2wav', 'token2wav_batcher']:
+        if name == 'token2wav_batcher':
+            model.load_token2wav_batcher(max_batch_size=args.concurrency, window=args.window)
+        results = {}
+        # different prompt lengths so that the cached lengths and the first chunk of every session differ
+        threads = [threading.Thread(target=run_session, args=(model, i, args.prompt_len + 7 * i, results)) for i in range(args.concurrency)]
+        start_time = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        outputs[name] = results
+        print('{:18s} concurrency {} {:.3f} s'.format(name, args.concurrency, time.time() - start_time))
+    print('batcher stats {}'.format(model.token2wav_batcher.stats()))
+    diff = max((outputs['token2wav'][i] - outputs['token2wav_batcher'][i]).abs().max().item() for i in range(args.concurrency))
+    print('max abs diff {:.3e}'.format(diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--heads', type=int, default=4)
+    parser.add_argument('--chunk_size', type=int, default=25, help='must equal CosyVoice3Model.token_hop_len')
+    parser.add_argument('--hift_channels', type=int, default=128)
+    parser.add_argument('--prompt_len', type=int, default=60)
+    parser.add_argument('--token_num', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--window', type=float, default=0.005)
+    main(parser.parse_args())
@@ -1,11 +1,10 @@
 import os
-import io
-import base64
 import time
 import random
 import uuid
 import sys
-from typing import List, Optional
+import asyncio
+from typing import List, Optional, Union
 
 import numpy as np
 from pathlib import Path
@@ -32,7 +31,8 @@ BASE_DIR= os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(BASE_DIR, 'service'))
 print(f"current Base_Dir: {BASE_DIR}")
 from prompt_utils_2512 import rewrite
-from generate import generate_image
+from scheduler import JobScheduler, QueueFullError, SUCCEEDED, FAILED
+from image_output import check_output_format, content_type, encode_images, file_extension
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, Field
 from fastapi import Request
@@ -55,6 +55,10 @@ IMAGE_OUTPUT_DIR = os.environ.get("IMAGE_OUTPUT_DIR", DEFAULT_IMAGE_DIR)
 PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", None)
 IMAGE_DOWNLOAD_URL_PREFIX = os.environ.get("IMAGE_DOWNLOAD_URL_PREFIX", None)
 MINIO_UPLOAD_DIR = os.environ.get("MINIO_UPLOAD_DIR", "qwen3-image-2512")
+# 任务队列：最多排队的任务数、同步请求的最长等待秒数、已完成任务的保留秒数；工作进程设备见 WORKER_DEVICES
+TASK_QUEUE_SIZE = int(os.environ.get("TASK_QUEUE_SIZE", 100))
+TASK_TIMEOUT = int(os.environ.get("TASK_TIMEOUT", 600))
+TASK_TTL = int(os.environ.get("TASK_TTL", 3600))
 os.makedirs(IMAGE_OUTPUT_DIR, exist_ok=True)
 
 
@@ -89,6 +93,11 @@ class Parameters(BaseModel):
 	width: Optional[int] = None
 	height: Optional[int] = None
 	aspect_ratio: Optional[str] = None
+	# 输出图片格式：png / jpeg / webp，未指定时使用 IMAGE_OUTPUT_FORMAT（默认 png）
+	output_format: Optional[str] = None
+	# jpeg/webp 质量 1-100，png 压缩级别 0-9（越低编码越快、文件越大）
+	output_quality: Optional[int] = Field(default=None, ge=1, le=100)
+	png_compress_level: Optional[int] = Field(default=None, ge=0, le=9)
 
 
 class ImageGenerationRequest(BaseModel):
@@ -135,6 +144,24 @@ class ImageGenerationResponse(BaseModel):
 	request_id: str
 
 
+class TaskOutput(BaseModel):
+	task_id: str
+	task_status: str
+	submit_time: Optional[str] = None
+	end_time: Optional[str] = None
+	queue_position: Optional[int] = None
+	eta_seconds: Optional[float] = None
+	choices: Optional[List[Choice]] = None
+	task_metric: Optional[TaskMetric] = None
+	message: Optional[str] = None
+
+
+class TaskResponse(BaseModel):
+	output: TaskOutput
+	usage: Optional[Usage] = None
+	request_id: str
+
+
 # ----------------------------------
 # 实用函数
 # ----------------------------------
@@ -160,20 +187,6 @@ def get_image_size(aspect_ratio: Optional[str], size: Optional[str]) -> (int, in
 		return 1024, 1024
 
 
-def pil_to_b64(image: Image.Image) -> str:
-	buf = io.BytesIO()
-	image.save(buf, format="PNG")
-	b = base64.b64encode(buf.getvalue()).decode("utf-8")
-	return b
-
-def save_image(image: Image.Image, output_dir: str) -> str:
-	import uuid
-	os.makedirs(output_dir, exist_ok=True)
-	filename = f"{uuid.uuid4().hex}.png"
-	filepath = os.path.join(output_dir, filename)
-	image.save(filepath, format="PNG")
-	return filename
-
 # ----------------------------------
 # FastAPI 应用
 # ----------------------------------
@@ -184,11 +197,22 @@ os.makedirs(IMAGE_OUTPUT_DIR, exist_ok=True)
 app.mount("/images", StaticFiles(directory=IMAGE_OUTPUT_DIR), name="images")
 
 # 在应用启动时初始化一次（放在 app 定义之后，避免未定义引用）
+scheduler = JobScheduler(model_repo_id, queue_size=TASK_QUEUE_SIZE, job_ttl=TASK_TTL)
+
+
+@app.on_event("startup")
+async def startup_event():
+	scheduler.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+	scheduler.stop()
 
 
 @app.get("/healthz")
 async def healthz():
-	return {"status": "ok", "model": model_repo_id}
+	return {"status": "ok", "model": model_repo_id, "queue": scheduler.stats()}
 
 
 @app.get("/v1/models")
@@ -201,7 +225,69 @@ async def list_models():
 	}
 
 
-@app.post("/v1/images/generations", response_model=ImageGenerationResponse)
+async def build_response(images: List[Image.Image], params: Parameters, width: int, height: int, request_id: str) -> ImageGenerationResponse:
+	"""
+	在编码线程池中并行编码 n 张图片；url 格式直接把编码后的字节上传到 MinIO，不写本地文件。
+	"""
+	errors: List[str] = []
+	contents: List[ImageContent] = []
+	response_format = (params.response_format or "b64_json").lower()
+	if response_format == "url":
+		encoded = await encode_images(images, params.output_format, params.output_quality, params.png_compress_level)
+		uploads = await asyncio.gather(*(
+			minio_handler.upload_data_async(data, f"{uuid.uuid4().hex}.{file_extension(params.output_format)}",
+											upload_dir=MINIO_UPLOAD_DIR, content_type=content_type(params.output_format))
+			for data in encoded
+		))
+		for upload in uploads:
+			if upload.get("error"):
+				errors.append(upload.get("error_str", "upload failed"))
+				continue
+			download_url = minio_handler.generate_download_url(upload.get("minio_put_path"))
+			contents.append(ImageContent(image=download_url))
+	else:
+		encoded = await encode_images(images, params.output_format, params.output_quality, params.png_compress_level, b64=True)
+		contents = [ImageContent(b64_json=data) for data in encoded]
+
+	choices = [Choice(
+		finish_reason="stop",
+		message=ChoiceMessage(role="assistant", content=contents),
+	)]
+
+	task_metric = TaskMetric(FAILED=len(errors), SUCCEEDED=len(images), TOTAL=params.n)
+	usage = Usage(height=height, width=width, image_count=len(images))
+	return ImageGenerationResponse(
+		output=Output(choices=choices, task_metric=task_metric),
+		usage=usage,
+		request_id=request_id,
+	)
+
+
+def format_time(t: Optional[float]) -> Optional[str]:
+	return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) if t else None
+
+
+def task_response(job) -> TaskResponse:
+	eta = scheduler.eta(job)
+	output = TaskOutput(
+		task_id=job.id,
+		task_status=job.status,
+		submit_time=format_time(job.submit_time),
+		end_time=format_time(job.end_time),
+		queue_position=scheduler.position(job),
+		eta_seconds=round(eta, 1) if eta is not None else None,
+	)
+	usage = None
+	if job.status == SUCCEEDED:
+		output.choices = job.result.output.choices
+		output.task_metric = job.result.output.task_metric
+		usage = job.result.usage
+	elif job.status == FAILED:
+		output.message = job.error
+	return TaskResponse(output=output, usage=usage, request_id=job.id)
+
+
+@app.post("/v1/images/generations", response_model=Union[ImageGenerationResponse, TaskResponse])
 async def create_image(req: ImageGenerationRequest, request: Request):
 	# 校验模型
 	accepted_models = {m.lower() for m in [MODEL_NAME, os.environ.get("OPENAI_MODEL", "") if os.environ.get("OPENAI_MODEL") else None] if m}
@@ -213,8 +299,11 @@ async def create_image(req: ImageGenerationRequest, request: Request):
 	if not messages or not messages[0].content:
 		raise HTTPException(status_code=400, detail="Invalid request: missing input.messages.content.text")
 	original_prompt = messages[0].content[0].text
+	format_error = check_output_format(params.output_format)
+	if format_error:
+		raise HTTPException(status_code=400, detail=format_error)
 	use_rewrite = params.prompt_extend if params.prompt_extend is not None else True
-	prompt = rewrite(original_prompt) if use_rewrite else original_prompt
+	prompt = await asyncio.to_thread(rewrite, original_prompt) if use_rewrite else original_prompt
 
 	# 分辨率解析：width/height 优先，其次 size/aspect_ratio
 	if params.width and params.height:
@@ -222,64 +311,52 @@ async def create_image(req: ImageGenerationRequest, request: Request):
 	else:
 		width, height = get_image_size(params.aspect_ratio, params.size)
 
-	images: List[Image.Image] = []
-	errors: List[str] = []
-
 	base_seed = params.seed if params.seed is not None else random.randint(0, MAX_SEED)
 
-	for i in range(params.n):
-		seed_i = base_seed + i
-		try:
-			img = generate_image(
-				model_repo_id,
-				prompt,
-				params.negative_prompt or "",
-				width,
-				height,
-				params.num_inference_steps,
-				params.guidance_scale,
-				seed_i,
-			)
-			images.append(img)
-		except Exception as e:
-			errors.append(str(e))
-
-	if not images:
-		raise HTTPException(status_code=500, detail=f"Inference failed: {'; '.join(errors)}")
-
-	response_format = (params.response_format or "b64_json").lower()
-	contents: List[ImageContent] = []
-	if response_format == "url":
-			for img in images:
-				filename = save_image(img, IMAGE_OUTPUT_DIR)
-				local_path = os.path.join(IMAGE_OUTPUT_DIR, filename)
-				upload = minio_handler.upload_file(local_path, upload_dir=MINIO_UPLOAD_DIR)
-				if upload.get("error"):
-					errors.append(upload.get("error_str", "upload failed"))
-					continue
-				download_url = minio_handler.generate_download_url(upload.get("minio_put_path"))
-				contents.append(ImageContent(image=download_url))
-				try:
-					os.remove(local_path)
-				except Exception:
-					pass
-	else:
-		for img in images:
-			contents.append(ImageContent(b64_json=pil_to_b64(img)))
-
-	choices = [Choice(
-		finish_reason="stop",
-		message=ChoiceMessage(role="assistant", content=contents),
-	)]
+	async def finalize(job, images):
+		return await build_response(images, params, width, height, job.id)
 
-	task_metric = TaskMetric(FAILED=len(errors), SUCCEEDED=len(images), TOTAL=params.n)
-	usage = Usage(height=height, width=width, image_count=len(images))
-	resp = ImageGenerationResponse(
-		output=Output(choices=choices, task_metric=task_metric),
-		usage=usage,
-		request_id=uuid.uuid4().hex,
-	)
-	return resp
+	# 推理在工作进程中执行；第 i 张图使用种子 base_seed + i，n 张图按显存预算分批在同一次管线调用中生成
+	try:
+		job = scheduler.submit(
+			finalize=finalize,
+			prompt=prompt,
+			negative_prompt=params.negative_prompt or "",
+			width=width,
+			height=height,
+			num_inference_steps=params.num_inference_steps,
+			guidance_scale=params.guidance_scale,
+			seeds=[base_seed + i for i in range(params.n)],
+		)
+	except QueueFullError as e:
+		raise HTTPException(status_code=429, detail=str(e))
+	except RuntimeError as e:
+		raise HTTPException(status_code=503, detail=str(e))
+
+	# 异步调用（与 DashScope 一致）：立即返回 task_id，客户端通过 /v1/tasks/{task_id} 查询状态与结果
+	if request.headers.get("X-DashScope-Async", "").lower() == "enable":
+		return task_response(job)
+
+	# 同步调用：结果直接返回给调用方，不再保留 TASK_TTL；仅超时的任务保留，供 /v1/tasks/{task_id} 查询
+	retain = False
+	try:
+		return await job.wait(TASK_TIMEOUT)
+	except asyncio.TimeoutError:
+		retain = True
+		raise HTTPException(status_code=504, detail=f"Task timeout, query /v1/tasks/{job.id} for the result")
+	except RuntimeError as e:
+		raise HTTPException(status_code=500, detail=f"Inference failed: {e}")
+	finally:
+		if not retain:
+			scheduler.release(job)
+
+
+@app.get("/v1/tasks/{task_id}", response_model=TaskResponse)
+async def get_task(task_id: str):
+	job = scheduler.get(task_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail=f"Task not found: {task_id}")
+	return task_response(job)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+"""
+图片输出编码基准：不同格式、压缩参数与分辨率下的编码耗时和体积，以及 n 张图串行与线程池并行编码的耗时。
+
+默认使用合成图（渐变 + 噪声 + 色块，接近生成图的压缩难度），也可用 --image 指定一张真实生成图（按各尺寸缩放）。
+并行加速取决于 CPU 核数：Pillow 编码时释放 GIL，核数 >= n 时 n 张图的总耗时接近单张耗时。
+
+用法：python Qwen-Image-2512/benchmarks/benchmark_image_output.py --n 4 --repeat 3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "service"))
+import image_output
+
+SIZES = [(1024, 1024), (1328, 1328), (1664, 928), (1472, 1140)]
+# (名称, output_format, quality, compress_level)
+CASES = [
+    ("png-1", "png", None, 1),
+    ("png-6", "png", None, 6),
+    ("png-9", "png", None, 9),
+    ("jpeg-90", "jpeg", 90, None),
+    ("webp-90", "webp", 90, None),
+]
+
+
+def synthetic_image(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    base += rng.normal(0, 12, base.shape)
+    image = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x1, y1 = x0 + int(rng.integers(20, width // 3)), y0 + int(rng.integers(20, height // 3))
+        draw.ellipse((x0, y0, x1, y1), fill=tuple(int(c) for c in rng.integers(0, 255, 3)))
+    return image
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=4, help="每个请求的图片数")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最快一次")
+    parser.add_argument("--image", default=None, help="用真实图片代替合成图")
+    args = parser.parse_args()
+
+    source = Image.open(args.image).convert("RGB") if args.image else None
+    print(f"cpu {os.cpu_count()}, encode workers {image_output.ENCODE_WORKERS}, n={args.n}, best of {args.repeat}")
+    print(f"{'size':<10} {'format':<8} {'encode ms':>9} {'KB':>7} {'b64 KB':>7} "
+          f"{'n serial ms':>11} {'n parallel ms':>13}")
+    for width, height in SIZES:
+        images = [source.resize((width, height)) if source else synthetic_image(width, height, seed=i) for i in range(args.n)]
+        for name, output_format, quality, compress_level in CASES:
+            single, data = timed(lambda: image_output.encode_image(images[0], output_format, quality, compress_level),
+                                 args.repeat)
+            serial, _ = timed(lambda: [image_output.encode_image(image, output_format, quality, compress_level)
+                                       for image in images], args.repeat)
+            parallel = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                await image_output.encode_images(images, output_format, quality, compress_level, b64=True)
+                elapsed = time.perf_counter() - start
+                parallel = elapsed if parallel is None else min(parallel, elapsed)
+            print(f"{width}x{height:<5} {name:<8} {single * 1000:9.1f} {len(data) / 1024:7.0f} "
+                  f"{(len(data) + 2) // 3 * 4 / 1024:7.0f} {serial * 1000:11.1f} {parallel * 1000:13.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,27 +1,104 @@
+import os
+import threading
+
 from modelscope import DiffusionPipeline
 import torch
 
 # Lazy-loaded pipeline to avoid repeated initialization
 _PIPE = None
 _DEVICE = None
+# The pipeline is not thread-safe, calls from concurrent requests run one at a time
+_PIPE_LOCK = threading.Lock()
+
+# Memory budget of one pipeline call, in output megapixels (batch size * width * height).
+# Larger requests are split into several calls; 8 MP fits n=4 at 1328x1328.
+MAX_BATCH_MEGAPIXELS = float(os.environ.get("MAX_BATCH_MEGAPIXELS", "8"))
 
 
-def _get_pipe(model_name: str) -> DiffusionPipeline:
+def _get_pipe(model_name: str, device: str | None = None) -> DiffusionPipeline:
+    """Load the pipeline once per process, on `device` ("cuda", "cuda:1", "cpu") or on cuda when available."""
     global _PIPE, _DEVICE
     if _PIPE is not None:
         return _PIPE
 
-    if torch.cuda.is_available():
-        torch_dtype = torch.bfloat16
-        _DEVICE = "cuda"
-    else:
-        torch_dtype = torch.float32
-        _DEVICE = "cpu"
+    _DEVICE = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    torch_dtype = torch.float32 if _DEVICE == "cpu" else torch.bfloat16
 
     _PIPE = DiffusionPipeline.from_pretrained(model_name, torch_dtype=torch_dtype).to(_DEVICE)
     return _PIPE
 
 
+def load_pipe(model_name: str, device: str | None = None) -> DiffusionPipeline:
+    with _PIPE_LOCK:
+        return _get_pipe(model_name, device)
+
+
+def _make_generator(device: str, seed: int | None) -> torch.Generator:
+    generator = torch.Generator(device=device)
+    if seed is None:
+        generator.seed()
+    else:
+        generator.manual_seed(seed)
+    return generator
+
+
+def _max_batch_size(width: int, height: int) -> int:
+    return max(1, int(MAX_BATCH_MEGAPIXELS * 1e6 // (width * height)))
+
+
+def _run_batch(pipe, device: str, seeds: list, **kwargs) -> list:
+    """Run one pipeline call for len(seeds) images, halving the batch on CUDA OOM."""
+    try:
+        return pipe(
+            num_images_per_prompt=len(seeds),
+            generator=[_make_generator(device, seed) for seed in seeds],
+            **kwargs,
+        ).images
+    except torch.cuda.OutOfMemoryError:
+        if len(seeds) == 1:
+            raise
+        torch.cuda.empty_cache()
+        half = len(seeds) // 2
+        return _run_batch(pipe, device, seeds[:half], **kwargs) + _run_batch(pipe, device, seeds[half:], **kwargs)
+
+
+def generate_images(
+    model_name: str,
+    prompt: str,
+    negative_prompt: str,
+    width: int,
+    height: int,
+    num_inference_steps: int,
+    guidance_scale: float,
+    seeds: list,
+    device: str | None = None,
+):
+    """Generate len(seeds) images of one prompt and return a list of PIL.Image.
+
+    Images are generated in batches with one generator per image, so the image for a given seed does not
+    depend on n or on how the request is split. A batch is capped by MAX_BATCH_MEGAPIXELS.
+    """
+
+    with _PIPE_LOCK:
+        pipe = _get_pipe(model_name, device)
+        device = _DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+        batch_size = _max_batch_size(width, height)
+        images = []
+        for start in range(0, len(seeds), batch_size):
+            images += _run_batch(
+                pipe,
+                device,
+                seeds[start:start + batch_size],
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                width=width,
+                height=height,
+                num_inference_steps=num_inference_steps,
+                true_cfg_scale=guidance_scale,
+            )
+    return images
+
+
 def generate_image(
     model_name: str,
     prompt: str,
@@ -34,18 +111,5 @@ def generate_image(
 ):
     """Generate a single image and return a PIL.Image."""
 
-    pipe = _get_pipe(model_name)
-    device = _DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
-    generator = torch.Generator(device=device).manual_seed(seed) if seed is not None else None
-
-    image = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        width=width,
-        height=height,
-        num_inference_steps=num_inference_steps,
-        true_cfg_scale=guidance_scale,
-        generator=generator,
-    ).images[0]
-
-    return image
+    return generate_images(model_name, prompt, negative_prompt, width, height, num_inference_steps, guidance_scale,
+                           [seed])[0]
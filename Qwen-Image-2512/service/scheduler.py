@@ -0,0 +1,324 @@
+import os
+import time
+import queue
+import uuid
+import asyncio
+import logging
+import threading
+import multiprocessing as mp
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, SUCCEEDED, FAILED = "PENDING", "RUNNING", "SUCCEEDED", "FAILED"
+
+# How often the result thread checks that the workers are alive and drops expired jobs
+WORKER_CHECK_INTERVAL = 5
+# Weight of the newest job in the moving average of seconds per cost unit
+ETA_SMOOTHING = 0.3
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def default_devices() -> list:
+    """WORKER_DEVICES ("cuda:0,cuda:1" or "cpu,cpu"), otherwise one worker per visible GPU, or one cpu worker."""
+    devices = os.environ.get("WORKER_DEVICES")
+    if devices:
+        return [d.strip() for d in devices.split(",") if d.strip()]
+    import torch
+    if torch.cuda.is_available():
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    return ["cpu"]
+
+
+def _worker_main(worker_id: int, device: str, model_name: str, task_queue, result_queue, current_job):
+    """Worker process: load the pipeline on `device`, then run jobs from task_queue until a None arrives.
+
+    current_job holds the id of the running job in shared memory, the scheduler reads it if the process dies before
+    its queued messages are flushed. It is set right after the job is taken from task_queue.
+    """
+    from generate import load_pipe, generate_images
+
+    try:
+        load_pipe(model_name, device)
+    except Exception as e:
+        result_queue.put(("init_failed", worker_id, f"{type(e).__name__}: {e}"))
+        return
+    result_queue.put(("ready", worker_id, None))
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        current_job.value = task[0].encode()
+        job_id, kwargs = task
+        result_queue.put(("started", job_id, worker_id))
+        try:
+            images = generate_images(model_name, device=device, **kwargs)
+            result_queue.put(("done", job_id, images))
+        except Exception as e:
+            result_queue.put(("error", job_id, f"{type(e).__name__}: {e}"))
+        current_job.value = b""
+
+
+class Job:
+    def __init__(self, job_id: str, kwargs: dict, finalize=None):
+        self.id = job_id
+        self.kwargs = kwargs
+        self.finalize = finalize
+        self.status = PENDING
+        self.worker_id = None
+        self.result = None
+        self.error = None
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.future = asyncio.get_running_loop().create_future()
+        # Jobs submitted asynchronously may fail with nobody awaiting them
+        self.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    @property
+    def cost(self) -> float:
+        """Work units of the job: images * steps * megapixels, denoising time is roughly proportional to it."""
+        kwargs = self.kwargs
+        return len(kwargs["seeds"]) * kwargs["num_inference_steps"] * kwargs["width"] * kwargs["height"] / 1e6
+
+    async def wait(self, timeout: float = None):
+        """Wait for the job result; a timeout leaves the job running and queryable."""
+        return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+
+
+class JobScheduler:
+    """Bounded job queue in front of a pool of worker processes, one per device.
+
+    Workers pull jobs from a shared queue, so a free device takes the next job. A result thread forwards worker
+    messages to the event loop with call_soon_threadsafe; job state is only touched on the loop. A job's `finalize`
+    coroutine (encoding, upload) runs on the loop after the worker returns, so the worker is free meanwhile.
+    Finished jobs stay queryable for job_ttl seconds unless released, expired jobs are dropped every
+    WORKER_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, model_name: str, devices: list = None, queue_size: int = 100, job_ttl: float = 3600):
+        self.model_name = model_name
+        self.devices = devices or default_devices()
+        self.queue_size = queue_size
+        self.job_ttl = job_ttl
+        self.context = mp.get_context("spawn")
+        self.task_queue = self.context.Queue()
+        self.result_queue = self.context.Queue()
+        # worker id (index in devices) -> process and its shared current job id, and the ids of workers whose model has loaded
+        self.workers = {}
+        self.current_jobs = {}
+        self.ready = set()
+        self.jobs = {}
+        # Jobs waiting for a worker in submission order, and jobs running on a worker
+        self.pending = OrderedDict()
+        self.running = {}
+        # Ids of taken pending jobs that no live worker owned at the last check, see _fail_lost_jobs
+        self.lost_suspects = set()
+        # Moving average of seconds per cost unit on one worker, None until a job has finished
+        self.seconds_per_unit = None
+        self.loop = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for worker_id in range(len(self.devices)):
+            self._spawn(worker_id)
+        self.result_thread = threading.Thread(target=self._drain_results, daemon=True)
+        self.result_thread.start()
+        logger.info(f"Job scheduler started with workers {self.devices}, queue size {self.queue_size}")
+
+    def _spawn(self, worker_id: int):
+        self.current_jobs[worker_id] = self.context.Array("c", 64, lock=False)
+        process = self.context.Process(target=_worker_main, daemon=True,
+                                       args=(worker_id, self.devices[worker_id], self.model_name, self.task_queue,
+                                             self.result_queue, self.current_jobs[worker_id]))
+        process.start()
+        self.workers[worker_id] = process
+
+    def _drain_results(self):
+        last_check = time.time()
+        while not self.stop_event.is_set():
+            try:
+                message = self.result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+                self.loop.call_soon_threadsafe(self._on_message, *message)
+            except queue.Empty:
+                pass
+            except (EOFError, OSError):
+                break
+            if time.time() - last_check >= WORKER_CHECK_INTERVAL:
+                last_check = time.time()
+                self.loop.call_soon_threadsafe(self._check_workers)
+                self.loop.call_soon_threadsafe(self._expire)
+
+    def _on_message(self, kind: str, key: str, value):
+        if kind == "ready":
+            self.ready.add(key)
+            logger.info(f"Worker {key} ({self.devices[key]}) ready")
+        elif kind == "init_failed":
+            logger.error(f"Worker {key} ({self.devices[key]}) failed to load the model: {value}")
+        elif kind == "started":
+            job = self.pending.pop(key, None)
+            if job is not None:
+                job.status, job.worker_id, job.start_time = RUNNING, value, time.time()
+                self.running[key] = job
+        elif kind in ("done", "error"):
+            job = self.running.pop(key, None) or self.pending.pop(key, None)
+            if job is None:
+                return
+            if kind == "done":
+                self._update_eta(job)
+                asyncio.ensure_future(self._finish(job, value))
+            else:
+                self._fail(job, value)
+
+    def _check_workers(self):
+        # A worker killed by the OS (e.g. OOM) fails its running job and is restarted if its model had loaded
+        for worker_id, process in list(self.workers.items()):
+            if process.is_alive() or self.stop_event.is_set():
+                continue
+            error = f"Worker {worker_id} ({self.devices[worker_id]}) exited with code {process.exitcode}"
+            logger.error(error)
+            job_id = self.current_jobs[worker_id].value.decode()
+            job = self.running.pop(job_id, None) or self.pending.pop(job_id, None)
+            if job is not None:
+                self._fail(job, error)
+            del self.workers[worker_id]
+            if worker_id in self.ready:
+                self.ready.discard(worker_id)
+                self._spawn(worker_id)
+        if not self.workers:
+            for job in list(self.pending.values()):
+                self._fail(job, "No worker is available")
+            self.pending.clear()
+        self._fail_lost_jobs()
+
+    def _fail_lost_jobs(self):
+        # A worker that dies while taking a job from task_queue, before it records the job id, loses the job without
+        # a trace. Workers take jobs in submission order, so the pending jobs ahead of the ones still queued are on a
+        # worker; one that no live worker owns at two consecutive checks (a done/started message in flight is handled
+        # within one interval) was lost.
+        if self.stop_event.is_set():
+            return
+        try:
+            queued = self.task_queue.qsize()
+        except NotImplementedError:
+            return
+        owned = {self.current_jobs[worker_id].value.decode() for worker_id, process in self.workers.items() if process.is_alive()}
+        taken = list(self.pending)[:max(0, len(self.pending) - queued)]
+        suspects = {job_id for job_id in taken if job_id not in owned}
+        for job_id in suspects & self.lost_suspects:
+            logger.error(f"Job {job_id} was taken by a worker that exited before starting it")
+            self._fail(self.pending.pop(job_id), "Job was lost by a worker that exited")
+        self.lost_suspects = suspects - self.lost_suspects
+
+    def _update_eta(self, job: Job):
+        if job.start_time is None or job.cost <= 0:
+            return
+        seconds_per_unit = (time.time() - job.start_time) / job.cost
+        if self.seconds_per_unit is None:
+            self.seconds_per_unit = seconds_per_unit
+        else:
+            self.seconds_per_unit += ETA_SMOOTHING * (seconds_per_unit - self.seconds_per_unit)
+
+    async def _finish(self, job: Job, images):
+        try:
+            job.result = await job.finalize(job, images) if job.finalize else images
+        except Exception as e:
+            self._fail(job, f"{type(e).__name__}: {e}")
+            return
+        job.status, job.end_time = SUCCEEDED, time.time()
+        if not job.future.done():
+            job.future.set_result(job.result)
+
+    def _fail(self, job: Job, error: str):
+        job.status, job.error, job.end_time = FAILED, error, time.time()
+        if not job.future.done():
+            job.future.set_exception(RuntimeError(error))
+
+    def _expire(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.end_time and now - job.end_time > self.job_ttl]:
+            del self.jobs[job_id]
+
+    def submit(self, finalize=None, **kwargs) -> Job:
+        """Queue a generate_images call (without model_name and device); `await job.wait()` returns its result.
+
+        :param finalize: optional coroutine function called as finalize(job, images), its return value is the job result.
+        :raises QueueFullError: when queue_size jobs are already waiting.
+        """
+        self._expire()
+        if len(self.pending) >= self.queue_size:
+            raise QueueFullError(f"Task queue is full ({self.queue_size} waiting)")
+        if not self.workers:
+            raise RuntimeError("No worker is available")
+        job = Job(uuid.uuid4().hex, kwargs, finalize)
+        self.jobs[job.id] = job
+        self.pending[job.id] = job
+        self.task_queue.put((job.id, kwargs))
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def release(self, job: Job):
+        """Stop keeping the job for get(), e.g. once a synchronous caller has its result.
+
+        The job still runs to the end if it has not finished, only its result is no longer retained for job_ttl.
+        """
+        self.jobs.pop(job.id, None)
+
+    def _worker_count(self) -> int:
+        return max(1, len(self.ready) or len(self.workers))
+
+    def position(self, job: Job) -> int | None:
+        """0-based position of a pending job in the queue."""
+        for i, job_id in enumerate(self.pending):
+            if job_id == job.id:
+                return i
+        return None
+
+    def eta(self, job: Job) -> float | None:
+        """Estimated seconds until the job finishes, assuming the work ahead is spread evenly across the workers."""
+        if self.seconds_per_unit is None or job.status in (SUCCEEDED, FAILED):
+            return None
+        now = time.time()
+        if job.status == RUNNING:
+            return max(0.0, job.cost * self.seconds_per_unit - (now - job.start_time))
+        ahead = sum(max(0.0, j.cost * self.seconds_per_unit - (now - j.start_time)) for j in self.running.values())
+        for job_id, j in self.pending.items():
+            if job_id == job.id:
+                break
+            ahead += j.cost * self.seconds_per_unit
+        return ahead / self._worker_count() + job.cost * self.seconds_per_unit
+
+    def stats(self) -> dict:
+        backlog = None
+        if self.seconds_per_unit is not None:
+            now = time.time()
+            work = sum(j.cost * self.seconds_per_unit for j in self.pending.values())
+            work += sum(max(0.0, j.cost * self.seconds_per_unit - (now - j.start_time)) for j in self.running.values())
+            backlog = round(work / self._worker_count(), 1)
+        return {
+            "workers": len(self.workers),
+            "ready_workers": len(self.ready),
+            "queue_size": self.queue_size,
+            "pending": len(self.pending),
+            "running": len(self.running),
+            "backlog_seconds": backlog,
+        }
+
+    def stop(self):
+        self.stop_event.set()
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for process in self.workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for job in list(self.pending.values()) + list(self.running.values()):
+            self._fail(job, "Scheduler stopped")
+        self.pending.clear()
+        self.running.clear()
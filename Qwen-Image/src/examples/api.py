@@ -1,9 +1,9 @@
 import os
-import io
-import base64
 import time
 import random
+import uuid
 import queue
+import asyncio
 import threading
 from typing import List, Optional
 
@@ -26,7 +26,7 @@ os.environ['OPENAI_MODEL'] = 'Qwen3-235B-A22B-Instruct-2507'
 
 import torch
 import torch.multiprocessing as mp
-from multiprocessing import Process, Queue, Event
+from multiprocessing import Process, Queue, Event, Array
 from diffusers import DiffusionPipeline
 from PIL import Image
 
@@ -36,6 +36,8 @@ from fastapi import Request
 from fastapi.staticfiles import StaticFiles
 
 from vnet.common.storage.dal.minio.minio_conn import minio_process
+from tools.shm_ring import SharedImageRing
+from tools.image_output import check_output_format, content_type, encode_images, file_extension
 # 兼容 Pydantic v2：动态导入 pydantic_settings，避免静态检查报未安装告警
 from importlib import import_module
 try:
@@ -100,12 +102,14 @@ print(f"Config: Model '{model_repo_id}', Using GPU NUMS {torch.cuda.device_count
 # 多 GPU Worker 与管理器（参考 demo.py，移除 Gradio 依赖）
 # ----------------------------------
 class GPUWorker:
-	def __init__(self, gpu_id, model_repo_id, task_queue, result_queue, stop_event):
+	def __init__(self, gpu_id, model_repo_id, task_queue, result_queue, stop_event, cancel_flags, image_ring):
 		self.gpu_id = gpu_id
 		self.model_repo_id = model_repo_id
 		self.task_queue = task_queue
 		self.result_queue = result_queue
 		self.stop_event = stop_event
+		self.cancel_flags = cancel_flags
+		self.image_ring = image_ring
 		self.device = f"cuda:{gpu_id}" if torch.cuda.is_available() else "cpu"
 		self.pipe = None
 
@@ -128,6 +132,7 @@ class GPUWorker:
 	def process_task(self, task):
 		try:
 			task_id = task['task_id']
+			slot = task['cancel_slot']
 			prompt = task['prompt']
 			negative_prompt = task.get('negative_prompt', "")
 			seed = task['seed']
@@ -136,7 +141,14 @@ class GPUWorker:
 			guidance_scale = task['guidance_scale']
 			num_inference_steps = task['num_inference_steps']
 
+			# 排队期间已超时取消的任务直接跳过
+			if self.cancel_flags[slot]:
+				return {'task_id': task_id, 'success': False, 'error': 'Task cancelled', 'gpu_id': self.gpu_id}
+
 			def step_callback(pipe, i, t, callback_kwargs):
+				# 推理中被取消时中断去噪循环，剩余步数不再执行
+				if self.cancel_flags[slot]:
+					pipe._interrupt = True
 				return callback_kwargs
 
 			generator = torch.Generator(device=self.device)
@@ -168,12 +180,20 @@ class GPUWorker:
 					callback_on_step_end=step_callback
 				).images[0]
 
-			return {
+			if self.cancel_flags[slot]:
+				return {'task_id': task_id, 'success': False, 'error': 'Task cancelled', 'gpu_id': self.gpu_id}
+			result = {
 				'task_id': task_id,
-				'image': image,
 				'success': True,
 				'gpu_id': self.gpu_id
 			}
+			# 图片写入共享内存，队列只传描述信息；没有空闲槽位时仍随结果一起传递
+			descriptor = self.image_ring.write(image) if self.image_ring is not None else None
+			if descriptor is not None:
+				result['shm'] = descriptor
+			else:
+				result['image'] = image
+			return result
 		except Exception as e:
 			return {
 				'task_id': task_id,
@@ -186,26 +206,34 @@ class GPUWorker:
 		if not self.initialize_model():
 			return
 		print(f"GPU {self.gpu_id} worker starting")
+		# 阻塞等待任务，任务到达即处理；停止时由 stop() 放入 None 唤醒
 		while not self.stop_event.is_set():
 			try:
-				task = self.task_queue.get(timeout=1)
+				task = self.task_queue.get()
 				if task is None:
 					break
 				result = self.process_task(task)
 				self.result_queue.put(result)
-			except queue.Empty:
-				continue
 			except Exception as e:
 				print(f"GPU {self.gpu_id} worker exception: {e}")
 				continue
 		print(f"GPU {self.gpu_id} worker stopping")
 
 
-def gpu_worker_process(gpu_id, model_repo_id, task_queue, result_queue, stop_event):
-	worker = GPUWorker(gpu_id, model_repo_id, task_queue, result_queue, stop_event)
+def gpu_worker_process(gpu_id, model_repo_id, task_queue, result_queue, stop_event, cancel_flags, image_ring):
+	worker = GPUWorker(gpu_id, model_repo_id, task_queue, result_queue, stop_event, cancel_flags, image_ring)
 	worker.run()
 
 
+# 共享内存中的取消标志槽位数，按任务序号取模；远大于排队与执行中的任务数，槽位不会被仍在进行的任务复用
+CANCEL_SLOTS = 65536
+
+
+def _resolve_future(future, result):
+	if not future.done():
+		future.set_result(result)
+
+
 class MultiGPUManager:
 	def __init__(self, model_repo_id, num_gpus=None, task_queue_size=100):
 		self.model_repo_id = model_repo_id
@@ -213,8 +241,17 @@ class MultiGPUManager:
 		self.task_queue = Queue(maxsize=task_queue_size)
 		self.result_queue = Queue()
 		self.stop_event = Event()
+		self.cancel_flags = Array('b', CANCEL_SLOTS, lock=False)
+		try:
+			self.image_ring = SharedImageRing()
+		except Exception as e:
+			print(f"Shared memory image ring unavailable, images are sent through the result queue: {e}")
+			self.image_ring = None
 		self.worker_processes = []
+		# task_counter 与 pending_tasks 会被事件循环与结果线程同时访问
+		self.lock = threading.Lock()
 		self.task_counter = 0
+		# task_id -> (loop, future, cancel_slot)
 		self.pending_tasks = {}
 		print(f"Initializing Multi-GPU Manager with {self.num_gpus} GPUs, queue size {task_queue_size}")
 
@@ -222,7 +259,7 @@ class MultiGPUManager:
 		for gpu_id in range(self.num_gpus):
 			process = Process(target=gpu_worker_process,
 							args=(gpu_id, self.model_repo_id, self.task_queue,
-								  self.result_queue, self.stop_event))
+								  self.result_queue, self.stop_event, self.cancel_flags, self.image_ring))
 			process.start()
 			self.worker_processes.append(process)
 
@@ -232,31 +269,46 @@ class MultiGPUManager:
 		print(f"All {self.num_gpus} GPU workers have started")
 
 	def _process_results(self):
-		while not self.stop_event.is_set():
+		# 阻塞等待结果，到达后立即在提交任务的事件循环中完成对应的 future；stop() 放入 None 结束
+		while True:
 			try:
-				result = self.result_queue.get(timeout=1)
-				task_id = result['task_id']
-				if task_id in self.pending_tasks:
-					self.pending_tasks[task_id]['result'] = result
-					self.pending_tasks[task_id]['event'].set()
-			except queue.Empty:
-				continue
+				result = self.result_queue.get()
+				if result is None:
+					break
+				if result.get('shm'):
+					# 取出图片并立即归还槽位，已超时的任务同样需要归还
+					result['image'] = self.image_ring.take(result.pop('shm'))
+				with self.lock:
+					entry = self.pending_tasks.pop(result['task_id'], None)
+				if entry is None:
+					# 已超时或取消的任务
+					continue
+				loop, future, _ = entry
+				loop.call_soon_threadsafe(_resolve_future, future, result)
 			except Exception as e:
 				print(f"Result processing thread exception: {e}")
 				continue
 
-	def submit_task(self, prompt, negative_prompt="", seed=42, width=1024, height=1024,
-					guidance_scale=4.0, num_inference_steps=50, timeout=300):
-		return self.submit_task_with_progress(prompt, negative_prompt, seed, width, height,
-												guidance_scale, num_inference_steps, timeout)
-
-	def submit_task_with_progress(self, prompt, negative_prompt="", seed=42, width=1024, height=1024,
-											guidance_scale=4.0, num_inference_steps=50, timeout=300):
-		task_id = f"task_{self.task_counter}_{time.time()}"
-		self.task_counter += 1
+	def submit(self, prompt, negative_prompt="", seed=42, width=1024, height=1024,
+			   guidance_scale=4.0, num_inference_steps=50):
+		"""
+		提交任务，返回在当前事件循环中完成的 asyncio.Future，结果为 {'success', 'image' 或 'error', ...}。
+
+		取消该 future（包括 asyncio.wait_for 超时）会同时取消工作进程中的任务：排队中的任务被跳过，执行中的任务中断去噪。
+		"""
+		loop = asyncio.get_running_loop()
+		future = loop.create_future()
+		with self.lock:
+			seq = self.task_counter
+			self.task_counter += 1
+			task_id = f"task_{seq}_{time.time()}"
+			slot = seq % CANCEL_SLOTS
+			self.cancel_flags[slot] = 0
+			self.pending_tasks[task_id] = (loop, future, slot)
 
 		task = {
 			'task_id': task_id,
+			'cancel_slot': slot,
 			'prompt': prompt,
 			'negative_prompt': negative_prompt,
 			'seed': seed,
@@ -266,44 +318,52 @@ class MultiGPUManager:
 			'num_inference_steps': num_inference_steps,
 		}
 
-		result_event = threading.Event()
-		self.pending_tasks[task_id] = {
-			'event': result_event,
-			'result': None,
-			'submitted_time': time.time()
-		}
-
 		try:
-			self.task_queue.put(task, timeout=10)
-			start_time = time.time()
-			while not result_event.is_set():
-				if result_event.wait(timeout=1):
-					break
-				if time.time() - start_time > timeout:
-					del self.pending_tasks[task_id]
-					return {'success': False, 'error': 'Task timeout'}
-			result = self.pending_tasks[task_id]['result']
-			del self.pending_tasks[task_id]
-			return result
+			self.task_queue.put_nowait(task)
 		except queue.Full:
-			del self.pending_tasks[task_id]
-			return {'success': False, 'error': 'Task queue is full'}
-		except Exception as e:
-			if task_id in self.pending_tasks:
-				del self.pending_tasks[task_id]
-			return {'success': False, 'error': str(e)}
+			with self.lock:
+				self.pending_tasks.pop(task_id, None)
+			future.set_result({'success': False, 'error': 'Task queue is full'})
+			return future
+		future.add_done_callback(lambda f: f.cancelled() and self.cancel(task_id))
+		return future
+
+	def cancel(self, task_id):
+		with self.lock:
+			entry = self.pending_tasks.pop(task_id, None)
+		if entry is None:
+			return False
+		loop, future, slot = entry
+		self.cancel_flags[slot] = 1
+		loop.call_soon_threadsafe(future.cancel)
+		return True
+
+	async def submit_task(self, prompt, negative_prompt="", seed=42, width=1024, height=1024,
+						  guidance_scale=4.0, num_inference_steps=50, timeout=300):
+		future = self.submit(prompt, negative_prompt, seed, width, height, guidance_scale, num_inference_steps)
+		try:
+			return await asyncio.wait_for(future, timeout)
+		except asyncio.TimeoutError:
+			# wait_for 超时会取消 future，进而取消工作进程中的任务
+			return {'success': False, 'error': 'Task timeout'}
 
 	def get_queue_status(self):
+		with self.lock:
+			pending_tasks = len(self.pending_tasks)
 		return {
 			'task_queue_size': self.task_queue.qsize(),
 			'result_queue_size': self.result_queue.qsize(),
-			'pending_tasks': len(self.pending_tasks),
+			'pending_tasks': pending_tasks,
 			'active_workers': len(self.worker_processes)
 		}
 
 	def stop(self):
 		print("Stopping Multi-GPU Manager...")
 		self.stop_event.set()
+		with self.lock:
+			task_ids = list(self.pending_tasks)
+		for task_id in task_ids:
+			self.cancel(task_id)
 		for _ in range(self.num_gpus):
 			try:
 				self.task_queue.put(None, timeout=1)
@@ -313,6 +373,10 @@ class MultiGPUManager:
 			process.join(timeout=5)
 			if process.is_alive():
 				process.terminate()
+		self.result_queue.put(None)
+		self.result_thread.join(timeout=5)
+		if self.image_ring is not None:
+			self.image_ring.close()
 		print("Multi-GPU Manager has stopped")
 
 
@@ -358,6 +422,9 @@ class ImageGenerationRequest(BaseModel):
 	guidance_scale: float = 4.0
 	num_inference_steps: int = Field(default=50, ge=1, le=50)
 	aspect_ratio: Optional[str] = Field(default=None, description="可选：1:1, 16:9, 9:16, 4:3, 3:4。若提供将覆盖 size")
+	output_format: Optional[str] = Field(default=None, description="输出图片格式：png / jpeg / webp，默认 IMAGE_OUTPUT_FORMAT（png）")
+	output_quality: Optional[int] = Field(default=None, ge=1, le=100, description="jpeg/webp 质量，默认 IMAGE_OUTPUT_QUALITY（90）")
+	png_compress_level: Optional[int] = Field(default=None, ge=0, le=9, description="png 压缩级别，越低编码越快、文件越大，默认 PNG_COMPRESS_LEVEL（6）")
 '''
 扩展参数（非 OpenAI 标准，但保持兼容；均已在接口中支持）：
 negative_prompt: 负向提示词，用于抑制不希望出现的元素或风格，例如 "blurry, low quality, watermark"。
@@ -370,6 +437,8 @@ aspect_ratio: 宽高比快捷选项，提供固定分辨率映射，若设置将
 "9:16" → 928x1664
 "4:3" → 1472x1140
 "3:4" → 1140x1472
+output_format / output_quality / png_compress_level: 输出编码。png 无损，级别 1 比 6 快数倍、体积略大；
+jpeg/webp 有损，体积约为 png 的 1/10，适合预览和移动端。n 张图在编码线程池中并行编码。
 '''
 
 
@@ -408,20 +477,6 @@ def get_image_size(aspect_ratio: Optional[str], size: Optional[str]) -> (int, in
 		return 1024, 1024
 
 
-def pil_to_b64(image: Image.Image) -> str:
-	buf = io.BytesIO()
-	image.save(buf, format="PNG")
-	b = base64.b64encode(buf.getvalue()).decode("utf-8")
-	return b
-
-def save_image(image: Image.Image, output_dir: str) -> str:
-	import uuid
-	os.makedirs(output_dir, exist_ok=True)
-	filename = f"{uuid.uuid4().hex}.png"
-	filepath = os.path.join(output_dir, filename)
-	image.save(filepath, format="PNG")
-	return filename
-
 # ----------------------------------
 # FastAPI 应用
 # ----------------------------------
@@ -464,27 +519,34 @@ async def create_image(req: ImageGenerationRequest, request: Request):
 		# 简单校验：仅允许当前模型
 		raise HTTPException(status_code=400, detail=f"Model not available: {MODEL_NAME}")
 
+	format_error = check_output_format(req.output_format)
+	if format_error:
+		raise HTTPException(status_code=400, detail=format_error)
+
 	width, height = get_image_size(req.aspect_ratio, req.size)
 	original_prompt = req.prompt
-	prompt = rewrite(req.prompt) if ENABLE_PROMPT_REWRITE else req.prompt
+	prompt = await asyncio.to_thread(rewrite, req.prompt) if ENABLE_PROMPT_REWRITE else req.prompt
 
 	images: List[Image.Image] = []
 	errors: List[str] = []
 
 	base_seed = req.seed if req.seed is not None else random.randint(0, MAX_SEED)
 
-	for i in range(req.n):
-		seed_i = base_seed + i
-		result = gpu_manager.submit_task(
+	# n 张图同时提交，由空闲的 GPU 并行处理
+	results = await asyncio.gather(*[
+		gpu_manager.submit_task(
 			prompt=prompt,
 			negative_prompt=req.negative_prompt or "",
-			seed=seed_i,
+			seed=base_seed + i,
 			width=width,
 			height=height,
 			guidance_scale=req.guidance_scale,
 			num_inference_steps=req.num_inference_steps,
 			timeout=TASK_TIMEOUT,
 		)
+		for i in range(req.n)
+	])
+	for result in results:
 		if result.get('success'):
 			images.append(result['image'])
 		else:
@@ -493,33 +555,28 @@ async def create_image(req: ImageGenerationRequest, request: Request):
 	if not images:
 		raise HTTPException(status_code=500, detail=f"Inference failed: {'; '.join(errors)}")
 
-	# 根据 response_format 返回 b64 或 URL
+	# 根据 response_format 返回 b64 或 URL；n 张图在编码线程池中并行编码
 	if (req.response_format or "b64_json").lower() == "url":
-		# 生成可访问 URL
-		base = PUBLIC_BASE_URL.rstrip('/') + '/' if PUBLIC_BASE_URL else str(request.base_url)
-		if not base.endswith('/'):
-			base += '/'
+		# 编码后的字节直接上传 MinIO，不写本地文件
+		encoded = await encode_images(images, req.output_format, req.output_quality, req.png_compress_level)
+		uploads = await asyncio.gather(*[
+			asyncio.to_thread(minio_handler.upload_data, data, f"{uuid.uuid4().hex}.{file_extension(req.output_format)}",
+							  content_type=content_type(req.output_format))
+			for data in encoded
+		])
 		urls: List[ImageData] = []
-		for img in images:
-			filename = save_image(img, IMAGE_OUTPUT_DIR)
-			local_path = os.path.join(IMAGE_OUTPUT_DIR, filename)
-			try:
-				upload_result = minio_handler.upload_file(file_path=local_path)
-				if upload_result.get("error"):
-					errors.append(f"upload failed: {upload_result.get('error_str')}")
-					continue
-				minio_key = upload_result.get("minio_put_path")
-				download_url = minio_handler.generate_download_url(minio_key)
-				urls.append(ImageData(url=download_url))
-			except Exception as e:
-				errors.append(f"upload exception: {e}")
+		for upload_result in uploads:
+			if upload_result.get("error"):
+				errors.append(f"upload failed: {upload_result.get('error_str')}")
 				continue
+			download_url = minio_handler.generate_download_url(upload_result.get("minio_put_path"))
+			urls.append(ImageData(url=download_url))
 		if not urls:
 			raise HTTPException(status_code=500, detail=f"Upload failed: {'; '.join(errors)}")
 		return ImageGenerationResponse(created=int(time.time()), data=urls)
 	else:
-		data_items = [ImageData(b64_json=pil_to_b64(img)) for img in images]
-		return ImageGenerationResponse(created=int(time.time()), data=data_items)
+		encoded = await encode_images(images, req.output_format, req.output_quality, req.png_compress_level, b64=True)
+		return ImageGenerationResponse(created=int(time.time()), data=[ImageData(b64_json=data) for data in encoded])
 
 
 @app.on_event("shutdown")
@@ -17,6 +17,7 @@ mp.set_start_method('spawn', force=True)
 from diffusers import DiffusionPipeline
 import torch
 from tools.prompt_utils import rewrite
+from tools.shm_ring import SharedImageRing
 
 # Make model repo/path configurable via environment variables
 model_repo_id = os.environ.get("MODEL_PATH", os.environ.get("MODEL_REPO_ID", "Qwen/Qwen-Image"))
@@ -44,12 +45,13 @@ python src/examples/demo.py
 ''')
 
 class GPUWorker:
-    def __init__(self, gpu_id, model_repo_id, task_queue, result_queue, stop_event):
+    def __init__(self, gpu_id, model_repo_id, task_queue, result_queue, stop_event, image_ring):
         self.gpu_id = gpu_id
         self.model_repo_id = model_repo_id
         self.task_queue = task_queue
         self.result_queue = result_queue
         self.stop_event = stop_event
+        self.image_ring = image_ring
         self.device = f"cuda:{gpu_id}"
         self.pipe = None
         
@@ -101,12 +103,18 @@ class GPUWorker:
                     callback_on_step_end=step_callback
                 ).images[0]
             
-            return {
+            result = {
                 'task_id': task_id,
-                'image': image,
                 'success': True,
                 'gpu_id': self.gpu_id
             }
+            # Hand the pixels over through shared memory, only fall back to pickling when no slot is free
+            descriptor = self.image_ring.write(image) if self.image_ring is not None else None
+            if descriptor is not None:
+                result['shm'] = descriptor
+            else:
+                result['image'] = image
+            return result
         except Exception as e:
             return {
                 'task_id': task_id,
@@ -144,8 +152,8 @@ class GPUWorker:
         print(f"GPU {self.gpu_id} worker stopping")
 
 # Global GPU worker function for spawn mode
-def gpu_worker_process(gpu_id, model_repo_id, task_queue, result_queue, stop_event):
-    worker = GPUWorker(gpu_id, model_repo_id, task_queue, result_queue, stop_event)
+def gpu_worker_process(gpu_id, model_repo_id, task_queue, result_queue, stop_event, image_ring):
+    worker = GPUWorker(gpu_id, model_repo_id, task_queue, result_queue, stop_event, image_ring)
     worker.run()
 
 # Multi-GPU Manager Class
@@ -156,6 +164,11 @@ class MultiGPUManager:
         self.task_queue = Queue(maxsize=task_queue_size)  
         self.result_queue = Queue()  
         self.stop_event = Event()
+        try:
+            self.image_ring = SharedImageRing()
+        except Exception as e:
+            print(f"Shared memory image ring unavailable, images are sent through the result queue: {e}")
+            self.image_ring = None
         self.workers = []
         self.worker_processes = []
         self.task_counter = 0
@@ -169,7 +182,7 @@ class MultiGPUManager:
             # Use global function instead of instance method to ensure proper operation in spawn mode
             process = Process(target=gpu_worker_process, 
                             args=(gpu_id, self.model_repo_id, self.task_queue, 
-                                  self.result_queue, self.stop_event))
+                                  self.result_queue, self.stop_event, self.image_ring))
             process.start()
             
             self.worker_processes.append(process)
@@ -187,6 +200,9 @@ class MultiGPUManager:
             try:
                 result = self.result_queue.get(timeout=1)
                 task_id = result['task_id']
+                if result.get('shm'):
+                    # Copy the image out and free the slot right away, also for tasks that already timed out
+                    result['image'] = self.image_ring.take(result.pop('shm'))
                 
                 if task_id in self.pending_tasks:
                     # Pass the result to the waiting task
@@ -297,6 +313,9 @@ class MultiGPUManager:
             if process.is_alive():
                 process.terminate()
         
+        if self.image_ring is not None:
+            self.image_ring.close()
+        
         print("Multi-GPU Manager has stopped")
 
 # Global Multi-GPU Manager instance
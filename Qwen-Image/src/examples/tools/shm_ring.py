@@ -0,0 +1,87 @@
+import os
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+SHM_SLOTS = int(os.environ.get("SHM_SLOTS", 8))
+# 6 MB holds the largest preset (1472x1140 RGB, 5.0 MB)
+SHM_SLOT_MB = float(os.environ.get("SHM_SLOT_MB", 6))
+
+
+class SharedImageRing:
+    """Fixed-size slots in one shared memory block for handing images from worker processes to the main process.
+
+    A worker takes a free slot, copies the pixels in and sends only a small descriptor through the result queue
+    instead of the pickled image. The main process reads the slot as a numpy view without copying (array) or takes
+    it as a PIL image and frees the slot (take). When no slot is free or the image does not fit, write() returns
+    None and the caller falls back to sending the image itself.
+    """
+
+    def __init__(self, slots=SHM_SLOTS, slot_size=int(SHM_SLOT_MB * 1024 * 1024)):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        try:
+            # Reserve the pages now, a tmpfs /dev/shm that is too small fails here instead of SIGBUS on first write
+            os.posix_fallocate(self.shm._fd, 0, self.shm.size)
+        except OSError:
+            self.shm.close()
+            self.shm.unlink()
+            raise
+        self.free_slots = mp.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+        self.owner = True
+
+    def __getstate__(self):
+        return {"name": self.shm.name, "slots": self.slots, "slot_size": self.slot_size, "free_slots": self.free_slots}
+
+    def __setstate__(self, state):
+        self.slots, self.slot_size, self.free_slots = state["slots"], state["slot_size"], state["free_slots"]
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self.owner = False
+
+    def write(self, image: Image.Image):
+        """Copy the image into a free slot and return its descriptor, or None when it has to be sent another way."""
+        array = np.asarray(image)
+        if array.dtype != np.uint8 or array.nbytes > self.slot_size:
+            return None
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            return None
+        view = np.ndarray(array.shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_size)
+        view[...] = array
+        return {"slot": slot, "mode": image.mode, "size": image.size, "nbytes": array.nbytes}
+
+    def array(self, descriptor) -> np.ndarray:
+        """Zero-copy view of the slot, valid until release(descriptor)."""
+        width, height = descriptor["size"]
+        shape = (height, width) if descriptor["nbytes"] == width * height else (height, width, descriptor["nbytes"] // (width * height))
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=descriptor["slot"] * self.slot_size)
+
+    def take(self, descriptor) -> Image.Image:
+        """PIL image of the slot, the slot is free again on return.
+
+        PIL keeps RGB padded to 4 bytes per pixel and cannot wrap the packed slot, so this costs one copy.
+        """
+        start = descriptor["slot"] * self.slot_size
+        with self.shm.buf[start: start + descriptor["nbytes"]] as buffer:
+            image = Image.frombytes(descriptor["mode"], descriptor["size"], buffer)
+        self.release(descriptor)
+        return image
+
+    def release(self, descriptor):
+        self.free_slots.put(descriptor["slot"])
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # Images still referencing the slots keep the mapping alive until they are collected
+            pass
+        if self.owner:
+            self.shm.unlink()
@@ -1,3 +1,4 @@
+import io
 import os.path
 import time
 from datetime import datetime
@@ -103,6 +104,39 @@ class minio_process():
             err_str = str(e)
             err = True
         return {"error": err, "error_str": err_str, "minio_put_path": minio_put_path, "local_file_path": file_path}
+
+    def upload_data(self, data, object_name, content_type=None, valid=True):
+        """上传内存中的字节数据，不写本地文件；对象路径规则与 upload_file 相同。"""
+        err = False
+        err_str = None
+        minio_put_path = self.generate_object_name(object_name=object_name)
+
+        try:
+            # part_size 不小于数据长度，保证单次 PUT，ETag 即为数据的 MD5
+            wresult = self.minio_client.put_object(self.bucket_name,
+                                                   minio_put_path,
+                                                   io.BytesIO(data),
+                                                   len(data),
+                                                   content_type=content_type or "application/octet-stream",
+                                                   part_size=max(len(data), 5 * 1024 * 1024))
+            if valid:
+                etag = wresult.etag
+                cmd5 = hashlib.md5(data).hexdigest()
+                if etag != cmd5:
+                    err_str = f"ETag: {etag}, neq {object_name} hash {cmd5}"
+                    err = True
+            logger.info(f"Data [Minio]uploaded successfully as {minio_put_path} to bucket {self.bucket_name}")
+
+        except S3Error as e:
+            logger.error(f"Error: {e}")
+            err_str = str(e)
+            err = True
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            err_str = str(e)
+            err = True
+        return {"error": err, "error_str": err_str, "minio_put_path": minio_put_path}
+
     def download_file(self, local_dir,prefix: str):
         err_str = None
         err = False
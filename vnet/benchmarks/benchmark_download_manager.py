@@ -0,0 +1,151 @@
+"""
+批量异步下载基准：原 multiple_download_async 与进程级 DownloadManager 对比。
+
+模拟 Accessibility 转存请求：每批 --batch 个 URL，只有 --distinct 个不同文件且文件名都相同（不同目录），
+连续发送 --batches 批。本地 HTTP 模拟服务器为每个新连接增加 --setup_ms 的建连耗时（模拟 TCP/TLS 握手），
+统计每种方式的总耗时、服务器收到的请求数与新建连接数，以及下载结果中内容错误的文件数。
+
+用法：python vnet/benchmarks/benchmark_download_manager.py --batch 300 --distinct 30 --batches 5
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import aiofiles
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from vnet.common.tools import http_utils
+
+
+class FilesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    files = {}
+    setup_time = 0.03
+    latency = 0.01
+    lock = threading.Lock()
+    connections, requests = 0, 0
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            FilesHandler.connections += 1
+        time.sleep(self.setup_time)
+
+    def do_GET(self):
+        with self.lock:
+            FilesHandler.requests += 1
+        time.sleep(self.latency)
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+async def legacy_download_file_async(session, url, proxy=None):
+    """原 download_file_async：写到 tempfile.gettempdir()/<文件名>（放在独立目录以免影响系统临时目录）。"""
+    try:
+        file_name = os.path.basename(urlparse(url).path) or "downloaded_file"
+        temp_file_path = os.path.join(legacy_dir, file_name)
+        async with session.get(url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=http_utils.DOWNLOAD_TIMEOUT)) as response:
+            response.raise_for_status()
+            async with aiofiles.open(temp_file_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(1024 * 1024):
+                    await f.write(chunk)
+        return url, temp_file_path, None
+    except Exception as e:
+        return url, None, str(e)
+
+
+async def legacy_multiple_download_async(urls, proxy=None):
+    """原 multiple_download_async：每次调用新建 ClientSession 与 TCPConnector(limit=20)，重复 URL 重复下载。"""
+    downloaded_files = {}
+    connector = aiohttp.TCPConnector(limit=20)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        results = await asyncio.gather(*[legacy_download_file_async(session, url, proxy) for url in urls])
+        for url, path, error in results:
+            downloaded_files[url] = None if error else path
+    return downloaded_files
+
+
+legacy_dir = tempfile.mkdtemp(prefix="legacy_downloads_")
+
+
+def count_wrong(downloaded_files, expected):
+    wrong = 0
+    for url, path in downloaded_files.items():
+        with open(path, "rb") as f:
+            wrong += hashlib.sha256(f.read()).hexdigest() != expected[urlparse(url).path]
+    return wrong
+
+
+async def run(name, download_fn, release_fn, batches, expected):
+    FilesHandler.connections, FilesHandler.requests = 0, 0
+    start_time = time.time()
+    wrong = 0
+    for batch in batches:
+        downloaded_files = await download_fn(batch)
+        wrong += count_wrong(downloaded_files, expected)
+        for path in downloaded_files.values():
+            release_fn(path)
+    elapsed = time.time() - start_time
+    print(f"{name:<8} {elapsed:6.2f}s  requests {FilesHandler.requests:5d}  connections {FilesHandler.connections:4d}  "
+          f"wrong files {wrong}")
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=300, help="每批 URL 数")
+    parser.add_argument("--distinct", type=int, default=30, help="每批不同 URL 数")
+    parser.add_argument("--batches", type=int, default=5)
+    parser.add_argument("--size_kb", type=int, default=64)
+    parser.add_argument("--setup_ms", type=float, default=30)
+    args = parser.parse_args()
+
+    FilesHandler.setup_time = args.setup_ms / 1000
+    FilesHandler.files = {f"/files/{i}/image.jpg": os.urandom(args.size_kb * 1024) for i in range(args.distinct)}
+    expected = {path: hashlib.sha256(data).hexdigest() for path, data in FilesHandler.files.items()}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FilesHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    paths = list(FilesHandler.files)
+    batches = [[base + paths[i % args.distinct] for i in range(args.batch)] for _ in range(args.batches)]
+    print(f"{args.batches} batches of {args.batch} urls ({args.distinct} distinct, same file name), "
+          f"{args.size_kb} KB files, {args.setup_ms} ms connection setup")
+
+    await run("legacy", legacy_multiple_download_async, remove_file, batches, expected)
+    manager = http_utils.DownloadManager(download_dir=tempfile.mkdtemp(prefix="vnet_downloads_"))
+    await run("manager", manager.download_many, manager.release, batches, expected)
+    await manager.close()
+    shutil.rmtree(legacy_dir, ignore_errors=True)
+    shutil.rmtree(manager.download_dir, ignore_errors=True)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,182 @@
+"""
+分段下载基准：本地 HTTP 模拟服务器上对比三种下载方式。
+
+- single: download_file_via_http，单连接顺序下载；
+- legacy: 原 download_file_thread，固定 8 段写入 .partN 文件后整段读入内存合并；
+- range: RangeDownloader，按大小与实测速度决定分段数，预分配目标文件后 os.pwrite 原位写入。
+
+模拟服务器对每个连接限速（--conn_mbps，模拟 CDN 的单连接带宽）并加首字节延迟，可选择不支持 Range（--no_ranges）
+或随机中断连接（--fail_rate，验证续传）。输出耗时、Python 峰值内存以及文件内容校验结果。
+
+用法：python vnet/benchmarks/benchmark_http_download.py --size_mb 64 --conn_mbps 20
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from vnet.common.tools import http_utils
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    data = b""
+    conn_rate = 20 * 1024 * 1024
+    latency = 0.02
+    ranges = True
+    fail_rate = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _range(self):
+        value = self.headers.get("Range")
+        if not self.ranges or not value or not value.startswith("bytes="):
+            return None
+        start, _, end = value[len("bytes="):].partition("-")
+        start = int(start)
+        end = int(end) + 1 if end else len(self.data)
+        return start, min(end, len(self.data))
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.data)))
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        byte_range = self._range()
+        if byte_range is None:
+            start, end = 0, len(self.data)
+            self.send_response(200)
+        else:
+            start, end = byte_range
+            if start >= len(self.data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(self.data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(self.data)}")
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        # 按单连接限速发送，fail_rate 概率在中途断开连接
+        fail_at = random.randint(start, end) if random.random() < self.fail_rate else None
+        block = 64 * 1024
+        begin = time.time()
+        for offset in range(start, end, block):
+            if fail_at is not None and offset >= fail_at:
+                self.close_connection = True
+                return
+            self.wfile.write(self.data[offset: min(offset + block, end)])
+            delay = (offset + block - start) / self.conn_rate - (time.time() - begin)
+            if delay > 0:
+                time.sleep(delay)
+
+
+def legacy_download_file_thread(url, proxy=None):
+    """原 download_file_thread：固定 8 段，写入 .partN 后读入内存合并（临时文件放在独立目录以免与其它方式冲突）。"""
+    temp_file_path = os.path.join(tempfile.mkdtemp(prefix="legacy_"), "file.bin")
+    THREADS = 8
+    size = int(requests.head(url, timeout=http_utils.DOWNLOAD_HEAD_TIMEOUT).headers["Content-Length"])
+    chunk = size // THREADS
+
+    def download(start, end, idx):
+        headers = {"Range": f"bytes={start}-{end}"}
+        r = requests.get(url, headers=headers, stream=True, proxies=proxy, timeout=http_utils.DOWNLOAD_TIMEOUT)
+        with open(f"{temp_file_path}.part{idx}", "wb") as f:
+            for c in r.iter_content(1024 * 1024):
+                f.write(c)
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        for i in range(THREADS):
+            pool.submit(download, i * chunk, size - 1 if i == THREADS - 1 else (i + 1) * chunk - 1, i)
+
+    with open(temp_file_path, "wb") as out:
+        for i in range(THREADS):
+            with open(f"{temp_file_path}.part{i}", "rb") as f:
+                out.write(f.read())
+            os.remove(f"{temp_file_path}.part{i}")
+    return temp_file_path
+
+
+def sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def run(name, fn, url, expected):
+    tracemalloc.start()
+    start_time = time.time()
+    try:
+        path = fn(url)
+        error = None
+    except Exception as e:
+        path, error = None, e
+    elapsed = time.time() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if path is None:
+        print(f"{name:<8} failed after {elapsed:.2f}s: {error}")
+        return
+    ok = sha256_file(path) == expected
+    print(f"{name:<8} {elapsed:6.2f}s  peak python memory {peak / 1024 / 1024:7.1f} MB  content {'ok' if ok else 'MISMATCH'}")
+    # download_file_via_http 直接写在系统临时目录下，其余方式各自使用独立子目录
+    if os.path.dirname(path) == tempfile.gettempdir():
+        os.remove(path)
+    else:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size_mb", type=float, default=64)
+    parser.add_argument("--conn_mbps", type=float, default=20, help="单连接带宽 MB/s")
+    parser.add_argument("--latency_ms", type=float, default=20)
+    parser.add_argument("--no_ranges", action="store_true")
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="每个响应中途断开的概率")
+    parser.add_argument("--methods", default="single,legacy,range")
+    args = parser.parse_args()
+
+    StandInHandler.data = os.urandom(int(args.size_mb * 1024 * 1024))
+    StandInHandler.conn_rate = args.conn_mbps * 1024 * 1024
+    StandInHandler.latency = args.latency_ms / 1000
+    StandInHandler.ranges = not args.no_ranges
+    StandInHandler.fail_rate = args.fail_rate
+    expected = hashlib.sha256(StandInHandler.data).hexdigest()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/file.bin"
+    print(f"file {args.size_mb} MB, {args.conn_mbps} MB/s per connection, latency {args.latency_ms} ms, "
+          f"ranges {'off' if args.no_ranges else 'on'}, fail rate {args.fail_rate}")
+
+    methods = {"single": http_utils.download_file_via_http, "legacy": legacy_download_file_thread,
+               "range": http_utils.download_file_thread}
+    for name in args.methods.split(","):
+        run(name, methods[name], url, expected)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
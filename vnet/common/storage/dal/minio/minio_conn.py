@@ -1,5 +1,7 @@
 import os.path
+import io
 import time
+import asyncio
 from datetime import datetime
 from pathlib import Path
 from pydantic_settings import BaseSettings
@@ -33,6 +35,63 @@ def calculate_md5(file_path):
     return hash_md5.hexdigest()
 
 
+class _HashingReader:
+    """
+    包装可读对象：put_object 读取待发送数据的同时计算每个分片的 MD5，上传完成后无需重新读取即可校验 ETag。
+    """
+
+    def __init__(self, stream, part_size):
+        self.stream = stream
+        self.part_size = part_size
+        self.part_md5 = hashlib.md5()
+        self.part_remaining = part_size
+        self.part_digests = []
+
+    def read(self, size=-1):
+        data = bytes(self.stream.read(size))
+        view = memoryview(data)
+        while len(view) > 0:
+            n = min(len(view), self.part_remaining)
+            self.part_md5.update(view[:n])
+            view, self.part_remaining = view[n:], self.part_remaining - n
+            if self.part_remaining == 0:
+                self.part_digests.append(self.part_md5.digest())
+                self.part_md5, self.part_remaining = hashlib.md5(), self.part_size
+        return data
+
+    def etag(self):
+        """期望的 ETag：单次上传为数据的 MD5，分片上传为各分片 MD5 拼接后的 MD5 加 "-分片数"。"""
+        digests = self.part_digests
+        if self.part_remaining < self.part_size or len(digests) == 0:
+            digests = digests + [self.part_md5.digest()]
+        if len(digests) == 1:
+            return digests[0].hex()
+        return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+class _AsyncIteratorReader:
+    """
+    将异步分块迭代器适配为可在上传线程中阻塞读取的文件对象，每次 read 在事件循环上取下一块。
+    """
+
+    def __init__(self, iterator, loop):
+        self.iterator = iterator.__aiter__()
+        self.loop = loop
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            try:
+                self.buffer += asyncio.run_coroutine_threadsafe(self.iterator.__anext__(), self.loop).result()
+            except StopAsyncIteration:
+                self.eof = True
+        size = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
 class RunError(Exception):
     def __init__(self, ErrorInfo):
         super().__init__(self)  # 初始化父类
@@ -43,7 +102,7 @@ class RunError(Exception):
 
 
 class minio_process():
-    def __init__(self, access_key, secret_key, bucket_name, minio_server, **kwargs):
+    def __init__(self, access_key, secret_key, bucket_name, minio_server, part_size=16 * 1024 * 1024, num_parallel_uploads=4, **kwargs):
         # 配置MinIO服务器连接参数
         # 将 Minio 服务器地址添加到 NO_PROXY 环境变量，确保不走系统代理
         minio_host = minio_server.split(':')[0] if ':' in minio_server else minio_server
@@ -82,6 +141,9 @@ class minio_process():
         self.bucket_name = bucket_name
         self.minio_server = minio_server
         self.minio_host = minio_host
+        # 超过 part_size 的对象分片上传，每个对象同时上传 num_parallel_uploads 个分片
+        self.part_size = part_size
+        self.num_parallel_uploads = num_parallel_uploads
 
     @staticmethod
     def generate_object_name(user="test", object_name=None):
@@ -123,26 +185,42 @@ class minio_process():
             logger.error(f"Error: {e}")
             return []
 
+    def _object_path(self, object_name, upload_dir=None):
+        # 目标对象路径：可选目录 + 自动生成日期/时间 + 对象名
+        minio_put_path = self.generate_object_name(object_name=object_name)
+        if upload_dir:
+            minio_put_path = f"{upload_dir.rstrip('/')}/{minio_put_path}"
+        return minio_put_path
+
+    def _upload_stream(self, stream, minio_put_path, length=-1, content_type=None, valid=True):
+        """
+        上传可读对象，读取发送的同时计算 MD5；超过 part_size 时分片并行上传。
+
+        :param length: 数据长度，-1 表示未知，按 part_size 读取到 EOF。
+        :return: ETag 校验失败时返回错误信息，否则返回 None。
+        """
+        reader = _HashingReader(stream, self.part_size)
+        wresult = self.minio_client.put_object(self.bucket_name,
+                                               minio_put_path,
+                                               reader,
+                                               length,
+                                               content_type=content_type or "application/octet-stream",
+                                               part_size=self.part_size,
+                                               num_parallel_uploads=self.num_parallel_uploads)
+        if valid and wresult.etag != reader.etag():
+            return f"ETag: {wresult.etag}, neq {minio_put_path} hash {reader.etag()}"
+        return None
+
     def upload_file(self, file_path, upload_dir=None, object_name=None, valid=True):
         err = False
         err_str = None
         base_name = os.path.basename(file_path)
-
-        # 目标对象路径：可选目录 + 自动生成日期/时间 + 对象名
-        minio_put_path = self.generate_object_name(object_name=(object_name or base_name))
-        if upload_dir:
-            minio_put_path = f"{upload_dir.rstrip('/')}/{minio_put_path}"
+        minio_put_path = self._object_path(object_name or base_name, upload_dir)
 
         try:
-            wresult = self.minio_client.fput_object(self.bucket_name,
-                                                    minio_put_path,
-                                                    file_path)
-            if valid:
-                etag = wresult.etag
-                cmd5 = calculate_md5(file_path)
-                if etag != cmd5:
-                    err_str = f"ETag: {etag}, neq {file_path} hash {cmd5}"
-                    err = True
+            with open(file_path, "rb") as f:
+                err_str = self._upload_stream(f, minio_put_path, length=os.fstat(f.fileno()).st_size, valid=valid)
+            err = err_str is not None
             logger.info(f"File {file_path} [Minio]uploaded successfully as {object_name} to bucket {self.bucket_name}")
 
         except S3Error as e:
@@ -154,6 +232,65 @@ class minio_process():
             err_str = str(e)
             err = True
         return {"error": err, "error_str": err_str, "minio_put_path": minio_put_path, "local_file_path": file_path}
+
+    def upload_data(self, data, object_name, upload_dir=None, length=None, content_type=None, valid=True):
+        """
+        上传内存数据或文件对象，不落盘。
+
+        :param data: bytes / bytearray / memoryview，或带 read() 的文件对象。
+        :param object_name: 对象名，路径规则与 upload_file 相同。
+        :param length: 文件对象的数据长度，为空时读取到 EOF。
+        :param content_type: 对象的 Content-Type，为空时为 application/octet-stream。
+        """
+        err = False
+        err_str = None
+        minio_put_path = self._object_path(object_name, upload_dir)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            length = memoryview(data).nbytes
+            data = io.BytesIO(data)
+
+        try:
+            err_str = self._upload_stream(data, minio_put_path, length=-1 if length is None else length,
+                                          content_type=content_type, valid=valid)
+            err = err_str is not None
+            logger.info(f"Data [Minio]uploaded successfully as {minio_put_path} to bucket {self.bucket_name}")
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            err_str = str(e)
+            err = True
+        return {"error": err, "error_str": err_str, "minio_put_path": minio_put_path}
+
+    async def upload_data_async(self, data, object_name, upload_dir=None, length=None, content_type=None, valid=True,
+                                executor=None):
+        """
+        upload_data 的异步版本，上传在线程中进行，不阻塞事件循环。
+
+        data 还可以是异步分块迭代器（如 aiohttp 响应的 content.iter_chunked），边接收边上传。
+
+        :param executor: 执行上传的线程池，为空时使用事件循环的默认线程池。
+        """
+        loop = asyncio.get_running_loop()
+        if hasattr(data, "__aiter__"):
+            data = _AsyncIteratorReader(data, loop)
+        return await loop.run_in_executor(executor, self.upload_data, data, object_name, upload_dir, length,
+                                          content_type, valid)
+
+    async def upload_many(self, items, upload_dir=None, max_concurrency=4):
+        """
+        并发上传多个对象，同时进行的上传不超过 max_concurrency 个，结果按 items 顺序返回。
+
+        :param items: 本地文件路径，或 upload_data_async 的参数字典（至少包含 data、object_name）。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def upload(item):
+            async with semaphore:
+                if isinstance(item, dict):
+                    return await self.upload_data_async(**{"upload_dir": upload_dir, **item})
+                return await asyncio.to_thread(self.upload_file, item, upload_dir)
+
+        return await asyncio.gather(*(upload(item) for item in items))
+
     def download_file(self, local_dir,prefix: str):
         err_str = None
         err = False
@@ -195,6 +332,8 @@ class MinioSettings(BaseSettings):
         default=get_env("MINIO_SECRET_KEY", "c5gKEUpeU1oirwTOmkbLtXKl0fiDCrtlkmEU0fIt"), env="MINIO_SECRET_KEY",
     )
     Minio_Bucket_Name: str = Field(default=get_env("MINIO_BUCKET_NAME", "files"), env="MINIO_BUCKET_NAME")
+    Minio_Part_Size_MB: int = Field(default=int(get_env("MINIO_PART_SIZE_MB", "16")), env="MINIO_PART_SIZE_MB")
+    Minio_Parallel_Uploads: int = Field(default=int(get_env("MINIO_PARALLEL_UPLOADS", "4")), env="MINIO_PARALLEL_UPLOADS")
 
 
 # Instantiate MinioSettings after loading environment variables
@@ -204,7 +343,9 @@ minio_handler = minio_process(
     access_key=minio_settings.Minio_Access_Key, 
     secret_key=minio_settings.Minio_Secret_Key,
     minio_server=f"{minio_settings.Minio_IP}:{minio_settings.Minio_Upload_Port}", 
-    bucket_name=minio_settings.Minio_Bucket_Name
+    bucket_name=minio_settings.Minio_Bucket_Name,
+    part_size=minio_settings.Minio_Part_Size_MB * 1024 * 1024,
+    num_parallel_uploads=minio_settings.Minio_Parallel_Uploads
 )
 
 
@@ -1,6 +1,12 @@
 import os
+import uuid
+import shutil
+import hashlib
 import tempfile
+import threading
+import weakref
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 from concurrent.futures import ThreadPoolExecutor
 import time
@@ -12,6 +18,20 @@ import aiofiles
 DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "300"))  # 默认 300 秒 (5分钟)
 DOWNLOAD_HEAD_TIMEOUT = int(os.getenv("DOWNLOAD_HEAD_TIMEOUT", "10"))  # 默认 10 秒
 
+# 分段下载配置
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "8"))  # 单个文件最多同时下载的分段数
+DOWNLOAD_MIN_RANGE_SIZE = int(os.getenv("DOWNLOAD_MIN_RANGE_MB", "4")) * 1024 * 1024  # 每个分段的最小字节数
+DOWNLOAD_MIN_RANGE_SECONDS = float(os.getenv("DOWNLOAD_MIN_RANGE_SECONDS", "0.2"))  # 按实测速度每个分段至少的下载时长
+DOWNLOAD_PROBE_SECONDS = float(os.getenv("DOWNLOAD_PROBE_SECONDS", "0.5"))  # 首个连接的最长测速时长
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))  # 请求失败后的重试（续传）次数
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 异步下载配置
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", os.path.join(tempfile.gettempdir(), "vnet_downloads"))  # 按内容寻址的下载目录
+DOWNLOAD_CONN_LIMIT = int(os.getenv("DOWNLOAD_CONN_LIMIT", "100"))  # 全部主机的最大连接数
+DOWNLOAD_CONN_LIMIT_PER_HOST = int(os.getenv("DOWNLOAD_CONN_LIMIT_PER_HOST", "16"))  # 单个主机的最大连接数
+DOWNLOAD_KEEPALIVE_TIMEOUT = float(os.getenv("DOWNLOAD_KEEPALIVE_TIMEOUT", "60"))  # 空闲连接保持时长（秒）
+
 def download_file_via_http(url, proxy=None):
     """
     下载 HTTP 文件到临时目录，并返回临时文件路径。
@@ -50,48 +70,215 @@ def download_file_via_http(url, proxy=None):
         raise RuntimeError(f"Failed to download file: {e}")
 
 
-def download_file_thread(url,proxy=None):
-    # 解析文件名
+def _requests_proxies(proxy):
+    # requests 需要 {"http": ..., "https": ...}，兼容直接传入代理地址字符串
+    if isinstance(proxy, str):
+        return {"http": proxy, "https": proxy}
+    return proxy
+
+
+def _download_temp_path(url):
+    """
+    每次下载在临时目录下使用独立子目录，保留 URL 中的文件名，并发下载同名文件互不覆盖。
+    """
     parsed_url = urlparse(url)
     file_name = os.path.basename(parsed_url.path) or "downloaded_file"
+    return os.path.join(tempfile.mkdtemp(prefix="download_"), file_name)
 
-    # 创建临时文件
-    temp_dir = tempfile.gettempdir()
-    temp_file_path = os.path.join(temp_dir, file_name)
-    THREADS = 8
-    size = int(requests.head(url, timeout=DOWNLOAD_HEAD_TIMEOUT).headers["Content-Length"])
-    chunk = size // THREADS
 
-    def download(start, end, idx):
-        headers = {"Range": f"bytes={start}-{end}"}
-        r = requests.get(url, headers=headers, stream=True, proxies=proxy, timeout=DOWNLOAD_TIMEOUT)
-        with open(f"{temp_file_path}.part{idx}", "wb") as f:
-            for c in r.iter_content(1024 * 1024):
-                f.write(c)
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while len(view) > 0:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+
+class RangeDownloader:
+    """
+    单文件分段并行下载。
+
+    首个请求为 Range: bytes=0-，同时用于判断服务器是否支持分段以及测量单连接速度；
+    按文件大小与实测速度决定分段数，目标文件预先分配，各分段用 os.pwrite 直接写到最终位置，
+    不产生分段文件，也不需要合并。分段中断后从已写入的位置续传，服务器不支持分段时退化为单连接下载。
+    """
+
+    def __init__(self, url, proxy=None, max_connections=DOWNLOAD_MAX_CONNECTIONS, retries=DOWNLOAD_RETRIES):
+        self.url = url
+        self.proxies = _requests_proxies(proxy)
+        self.max_connections = max(1, max_connections)
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # 任一分段最终失败时通知其余分段停止，error 记录最先失败的原因
+        self.failed = threading.Event()
+        self.error = None
+        self.num_ranges = 1
+
+    def _get(self, start=None, end=None):
+        # 分段偏移针对原始字节，禁止压缩传输
+        headers = {"Accept-Encoding": "identity"}
+        if start is not None:
+            headers["Range"] = f"bytes={start}-" + ("" if end is None else str(end - 1))
+        response = self.session.get(self.url, headers=headers, stream=True, proxies=self.proxies, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code != 416:
+            response.raise_for_status()
+        return response
+
+    def _retry(self, attempt, error):
+        if attempt > self.retries or self.failed.is_set():
+            if not self.failed.is_set():
+                self.error = error
+                self.failed.set()
+            raise error
+        print(f"Download {self.url} failed ({error}), retry {attempt}/{self.retries}")
+        time.sleep(min(0.2 * 2 ** attempt, 5))
+
+    def _write(self, chunks, fd, offset, end=None, deadline=None, limit=None):
+        """
+        将响应数据从 offset 起写入文件，写到 end 或数据结束为止，到达 deadline 或写到 limit 时提前返回。
+
+        :return: 已写到的位置。
+        """
+        for chunk in chunks:
+            if self.failed.is_set():
+                raise RuntimeError("download aborted")
+            if end is not None and offset + len(chunk) > end:
+                chunk = chunk[:end - offset]
+            _pwrite_all(fd, chunk, offset)
+            offset += len(chunk)
+            if offset == end or (deadline is not None and time.time() >= deadline) or (limit is not None and offset >= limit):
+                break
+        return offset
+
+    def _download_range(self, fd, start, end, response=None, chunks=None):
+        """下载 [start, end) 到文件对应位置，连接中断时从已写入的位置续传。"""
+        offset, attempt = start, 0
+        while offset < end:
+            try:
+                if response is None:
+                    response = self._get(offset, end)
+                    if response.status_code != 206:
+                        raise RuntimeError(f"range request returned status {response.status_code}")
+                    chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+                offset = self._write(chunks, fd, offset, end)
+                if offset < end:
+                    raise IOError(f"range {start}-{end} ended at {offset}")
+            except Exception as e:
+                attempt += 1
+                self._retry(attempt, e)
+            finally:
+                if response is not None:
+                    response.close()
+                    response = None
+        if response is not None:
+            response.close()
+
+    def _download_single(self, fd, response):
+        """服务器不支持分段：单连接顺序写入，失败后从头重新下载。"""
+        attempt = 0
+        while True:
+            try:
+                if response is None:
+                    response = self._get()
+                offset = self._write(response.iter_content(DOWNLOAD_CHUNK_SIZE), fd, 0)
+                length = response.headers.get("Content-Length")
+                if response.status_code != 416 and length is not None and offset != int(length):
+                    raise IOError(f"received {offset} of {length} bytes")
+                os.ftruncate(fd, offset)
+                return
+            except Exception as e:
+                attempt += 1
+                self._retry(attempt, e)
+            finally:
+                if response is not None:
+                    response.close()
+                    response = None
+
+    def _split(self, offset, size, throughput, first_byte_time):
+        """
+        将 [offset, size) 划分为若干分段：每段不少于 DOWNLOAD_MIN_RANGE_SIZE 字节，且按实测单连接速度
+        至少需要下载 DOWNLOAD_MIN_RANGE_SECONDS 与 4 倍首字节耗时中的较大者，否则新建连接的开销得不偿失。
+        """
+        remaining = size - offset
+        min_range_seconds = max(DOWNLOAD_MIN_RANGE_SECONDS, 4 * first_byte_time)
+        count = min(self.max_connections, remaining // DOWNLOAD_MIN_RANGE_SIZE,
+                    int(remaining / (max(throughput, 1) * min_range_seconds)))
+        count = max(1, count)
+        bounds = [offset + remaining * i // count for i in range(count + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def download(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self._get(0)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    self._retry(attempt, e)
+            content_range = response.headers.get("Content-Range", "")
+            if response.status_code != 206 or "/" not in content_range or content_range.endswith("/*"):
+                return self._download_single(fd, response if response.status_code != 416 else None)
+            size = int(content_range.rsplit("/", 1)[1])
+            # 预分配目标文件：posix_fallocate 真正分配磁盘空间，不支持的文件系统退化为 ftruncate
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+
+            # 首个连接先下载 DOWNLOAD_MIN_RANGE_SIZE 字节（最多 DOWNLOAD_PROBE_SECONDS）测速，再决定剩余部分的分段数，
+            # 首段沿用该连接继续下载
+            first_byte_time = response.elapsed.total_seconds()
+            chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+            start_time = time.time()
+            try:
+                offset = self._write(chunks, fd, 0, size, deadline=start_time + DOWNLOAD_PROBE_SECONDS, limit=DOWNLOAD_MIN_RANGE_SIZE)
+            except Exception:
+                response.close()
+                response, chunks, offset = None, None, 0
+            ranges = self._split(offset, size, offset / max(time.time() - start_time, 1e-3), first_byte_time)
+            self.num_ranges = len(ranges)
+            with ThreadPoolExecutor(max(1, len(ranges) - 1)) as pool:
+                futures = [pool.submit(self._download_range, fd, start, end) for start, end in ranges[1:]]
+                try:
+                    self._download_range(fd, *ranges[0], response=response, chunks=chunks)
+                    for future in futures:
+                        future.result()
+                except Exception as e:
+                    raise self.error or e
+        finally:
+            os.close(fd)
+            self.session.close()
+
+
+def download_file_thread(url, proxy=None, max_connections=DOWNLOAD_MAX_CONNECTIONS):
+    """
+    分段并行下载单个文件到临时目录，并返回临时文件路径。
+
+    :param url: HTTP 文件的下载地址。
+    :param proxy: 可选，HTTP 代理地址（字符串或 requests 的 proxies 字典）。
+    :param max_connections: 最多同时下载的分段数。
+    :return: 下载的临时文件路径。
+    """
+    temp_file_path = _download_temp_path(url)
 
     # 记录开始时间
     start_time = time.time()
-
-    with ThreadPoolExecutor(THREADS) as pool:
-        for i in range(THREADS):
-            pool.submit(
-                download,
-                i * chunk,
-                size - 1 if i == THREADS - 1 else (i + 1) * chunk - 1,
-                i,
-            )
-
-    # 合并
-    with open(temp_file_path, "wb") as out:
-        for i in range(THREADS):
-            with open(f"{temp_file_path}.part{i}", "rb") as f:
-                out.write(f.read())
-            os.remove(f"{temp_file_path}.part{i}")
+    downloader = RangeDownloader(url, proxy=proxy, max_connections=max_connections)
+    try:
+        downloader.download(temp_file_path)
+    except Exception as e:
+        shutil.rmtree(os.path.dirname(temp_file_path), ignore_errors=True)
+        raise RuntimeError(f"Failed to download file: {e}")
 
     # 记录结束时间并计算用时
     end_time = time.time()
     elapsed_time = end_time - start_time
-    print(f"Download origin_http: {url},temp_file_path: {temp_file_path}, completed in {elapsed_time:.2f} seconds.")
+    print(f"Download origin_http: {url},temp_file_path: {temp_file_path}, ranges: {downloader.num_ranges}, completed in {elapsed_time:.2f} seconds.")
 
     return temp_file_path
 
@@ -134,55 +321,176 @@ def _should_use_single_stream(url, proxy=None):
     return False
 
 
-async def download_file_async(session, url, proxy=None):
+def _aiohttp_proxy(proxy):
+    # aiohttp 接受字符串，requests 风格的字典优先使用 https，其次 http
+    if isinstance(proxy, dict):
+        return proxy.get("https") or proxy.get("http")
+    return proxy
+
+
+async def download_file_async(session, url, proxy=None, download_dir=DOWNLOAD_DIR):
     """
-    异步下载单个文件。
+    异步下载单个文件，边下载边计算 sha256，完成后移动到按内容寻址的路径 download_dir/<sha256>/<文件名>。
+
+    同名不同内容的文件互不覆盖，相同内容的文件落在同一路径。
     """
+    tmp_path = None
     try:
         parsed_url = urlparse(url)
         file_name = os.path.basename(parsed_url.path) or "downloaded_file"
-        temp_dir = tempfile.gettempdir()
-        temp_file_path = os.path.join(temp_dir, file_name)
-
-        # 处理代理：aiohttp 接受字符串
-        proxy_url = proxy
-        if isinstance(proxy, dict):
-            # 优先使用 https，其次 http
-            proxy_url = proxy.get("https") or proxy.get("http")
+        os.makedirs(download_dir, exist_ok=True)
+        tmp_path = os.path.join(download_dir, f".{uuid.uuid4().hex}.part")
+        sha256 = hashlib.sha256()
 
-        async with session.get(url, proxy=proxy_url, timeout=DOWNLOAD_TIMEOUT) as response:
+        async with session.get(url, proxy=_aiohttp_proxy(proxy)) as response:
             response.raise_for_status()
-            async with aiofiles.open(temp_file_path, 'wb') as f:
+            async with aiofiles.open(tmp_path, 'wb') as f:
                 async for chunk in response.content.iter_chunked(1024 * 1024):
+                    sha256.update(chunk)
                     await f.write(chunk)
+        content_dir = os.path.join(download_dir, sha256.hexdigest())
+        os.makedirs(content_dir, exist_ok=True)
+        temp_file_path = os.path.join(content_dir, file_name)
+        os.replace(tmp_path, temp_file_path)
         return url, temp_file_path, None
     except Exception as e:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return url, None, str(e)
 
 
-async def multiple_download_async(urls, proxy=None):
+class DownloadManager:
+    """
+    进程级异步下载管理器。
+
+    每个事件循环复用一个长期存在的 ClientSession：连接数按全局与单主机限制，空闲连接 keep-alive 复用，
+    避免每批下载都重新建连；同一 URL 同时进行的下载合并为一次，文件写入按内容寻址的路径。
+    返回的文件可能被多个调用方共享，用完后调用 release 而不是直接删除，最后一个使用者释放时才删除文件。
     """
-    异步并发下载多个文件。
-    """
-    downloaded_files = {}
-    
-    # 限制并发数
-    connector = aiohttp.TCPConnector(limit=20)
-    async with aiohttp.ClientSession(connector=connector) as session:
-        tasks = []
-        for url in urls:
-            tasks.append(download_file_async(session, url, proxy))
-        
-        results = await asyncio.gather(*tasks)
-        
-        for url, path, error in results:
+
+    def __init__(self, download_dir=DOWNLOAD_DIR, limit=DOWNLOAD_CONN_LIMIT, limit_per_host=DOWNLOAD_CONN_LIMIT_PER_HOST,
+                 keepalive_timeout=DOWNLOAD_KEEPALIVE_TIMEOUT):
+        self.download_dir = download_dir
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        # 事件循环 -> (session, 进行中的下载 {(url, proxy): [task, 等待者数量]})
+        self._loops = weakref.WeakKeyDictionary()
+        # 本地路径 -> 引用计数
+        self._refs = {}
+        self._lock = threading.Lock()
+        self.requests, self.coalesced = 0, 0
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None or state[0].closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout, ttl_dns_cache=300)
+            session = aiohttp.ClientSession(connector=connector,
+                                            timeout=aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT, sock_connect=DOWNLOAD_HEAD_TIMEOUT))
+            state = self._loops[loop] = (session, {})
+        return state
+
+    def stream(self, url, proxy=None):
+        """
+        用共享 session 发起 GET，返回 aiohttp 响应的异步上下文管理器，供边下载边处理响应体（不落盘）的调用方使用。
+        """
+        session, _ = self._state()
+        return session.get(url, proxy=_aiohttp_proxy(proxy))
+
+    def _acquire(self, path, count):
+        with self._lock:
+            self._refs[path] = self._refs.get(path, 0) + count
+
+    def release(self, path):
+        """释放 download 返回的文件，引用计数归零时删除文件。"""
+        with self._lock:
+            count = self._refs.get(path, 0) - 1
+            if count > 0:
+                self._refs[path] = count
+                return
+            self._refs.pop(path, None)
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    async def _fetch(self, session, url, proxy, key, inflight):
+        try:
+            _, path, error = await download_file_async(session, url, proxy, self.download_dir)
+        finally:
+            # 出队与加引用之间没有 await：之后再来的相同 URL 会重新下载，已登记的等待者各持有一个引用
+            entry = inflight.pop(key)
+        if path is not None:
+            self._acquire(path, entry[1])
+        return path, error
+
+    async def download(self, url, proxy=None):
+        """
+        下载单个 URL，与进行中的相同下载合并。
+
+        :return: (本地路径, 错误信息)，成功时路径需要调用 release 释放。
+        """
+        session, inflight = self._state()
+        key = (url, str(_aiohttp_proxy(proxy)))
+        self.requests += 1
+        entry = inflight.get(key)
+        if entry is None:
+            entry = inflight[key] = [None, 0]
+            entry[0] = asyncio.create_task(self._fetch(session, url, proxy, key, inflight))
+        else:
+            self.coalesced += 1
+        entry[1] += 1
+        try:
+            # 某个等待者取消时不取消共享的下载
+            return await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            # 取消的等待者也已计入引用，下载完成后代为释放
+            entry[0].add_done_callback(self._release_cancelled)
+            raise
+
+    def _release_cancelled(self, task):
+        if not task.cancelled() and task.exception() is None and task.result()[0] is not None:
+            self.release(task.result()[0])
+
+    async def download_many(self, urls, proxy=None):
+        """
+        并发下载多个文件，重复的 URL 只下载一次。
+
+        :return: {url: 本地路径}，下载失败的为 None；每个成功的路径需要调用一次 release。
+        """
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.download(url, proxy) for url in urls))
+        downloaded_files = {}
+        for url, (path, error) in zip(urls, results):
             if error:
                 print(f"Error downloading file {url}: {error}")
-                downloaded_files[url] = None
-            else:
-                downloaded_files[url] = path
-                
-    return downloaded_files
+            downloaded_files[url] = path
+        return downloaded_files
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "coalesced": self.coalesced, "files": len(self._refs)}
+
+    async def close(self):
+        """关闭当前事件循环上的 session。"""
+        state = self._loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].close()
+
+
+download_manager = DownloadManager()
+
+
+async def multiple_download_async(urls, proxy=None):
+    """
+    异步并发下载多个文件，复用进程级 download_manager 的连接池，重复 URL 只下载一次。
+
+    :return: {url: 本地路径}，下载失败的为 None；文件用完后调用 download_manager.release(path)。
+    """
+    return await download_manager.download_many(urls, proxy=proxy)
 
 if __name__ == "__main__":
     test_url = "https://cdn1.suno.ai/56cb7d08-604b-41ad-932c-3a0fab5db506.mp3"